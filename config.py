@@ -14,3 +14,42 @@ class Config:
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # 合同列表每页条数（URL 参数 per_page 可临时覆盖，最多 200）
+    CONTRACTS_PER_PAGE = int(os.environ.get('FSZN_CONTRACTS_PER_PAGE', 50))
+
+    # 登录用户信息的进程内缓存时间（秒）；角色变更会立即失效，0 表示不缓存
+    USER_CACHE_TTL = int(os.environ.get('FSZN_USER_CACHE_TTL', 60))
+
+    # 部门 / 人员下拉框数据的进程内缓存时间（秒）；本进程内增删改部门/人员会立即失效
+    REFERENCE_CACHE_TTL = int(os.environ.get('FSZN_REFERENCE_CACHE_TTL', 300))
+
+    # 操作日志异步批量写入（默认关闭；开启后由后台线程按批插入，见 services/audit_writer）
+    AUDIT_ASYNC = os.environ.get('FSZN_AUDIT_ASYNC', '').lower() in ('1', 'true', 'yes')
+    AUDIT_QUEUE_SIZE = int(os.environ.get('FSZN_AUDIT_QUEUE_SIZE', 10000))
+    AUDIT_BATCH_SIZE = int(os.environ.get('FSZN_AUDIT_BATCH_SIZE', 200))
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('FSZN_AUDIT_FLUSH_INTERVAL', 1.0))
+
+    # 操作日志在数据库里保留的整月数（含当月），更早的由 flask oplog archive 移入归档段文件
+    LOG_RETENTION_MONTHS = int(os.environ.get('FSZN_LOG_RETENTION_MONTHS', 12))
+
+    # 分块上传（见 services/chunked_upload）：单文件上限、建议的块大小（须小于 MAX_CONTENT_LENGTH）、
+    # 未完成的上传会话保留多久（小时），过期后由 flask files gc-uploads 清理
+    CHUNKED_UPLOAD_MAX_SIZE = int(os.environ.get('FSZN_CHUNKED_UPLOAD_MAX_SIZE', 1024 * 1024 * 1024))
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('FSZN_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+    UPLOAD_SESSION_TTL_HOURS = float(os.environ.get('FSZN_UPLOAD_SESSION_TTL_HOURS', 24))
+
+    # 操作日志说明的 n-gram 索引只建到这么多秒之前就已分配的日志 ID：
+    # 晚提交（ID 较小却在更大 ID 之后才提交）的日志不会被进度跳过，须大于最长的写日志事务
+    SEARCH_LOG_INDEX_GRACE = float(os.environ.get('FSZN_SEARCH_LOG_INDEX_GRACE', 300))
+
+    # 软删除 / 无记录引用的文件保留多少天后才由 flask files gc 从磁盘删除
+    FILE_GC_GRACE_DAYS = float(os.environ.get('FSZN_FILE_GC_GRACE_DAYS', 30))
+
+    # 生成文件缩略图的后台进程数（需要安装 Pillow / PyMuPDF，见 services/previews）
+    PREVIEW_WORKERS = int(os.environ.get('FSZN_PREVIEW_WORKERS', 2))
+
+    # 删除合同只打删除标记，子记录和磁盘文件由后台线程分批清理（见 services/contract_purge）；
+    # 关闭后台线程时改用计划任务执行 flask contracts purge。INTERVAL 为检查未完成清理的间隔（秒）
+    CONTRACT_PURGE_ASYNC = os.environ.get('FSZN_CONTRACT_PURGE_ASYNC', '1').lower() in ('1', 'true', 'yes')
+    CONTRACT_PURGE_BATCH_SIZE = int(os.environ.get('FSZN_CONTRACT_PURGE_BATCH_SIZE', 500))
+    CONTRACT_PURGE_INTERVAL = float(os.environ.get('FSZN_CONTRACT_PURGE_INTERVAL', 300))
@@ -7,7 +7,7 @@ from flask_sqlalchemy import SQLAlchemy
 db = SQLAlchemy()
 
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__)
 
     app.config.from_object('config.Config')
@@ -24,8 +24,47 @@ def create_app():
     app.config['UPLOAD_FOLDER'] = os.path.join(BASE_DIR, 'uploads')
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB，可调
 
+    # 操作日志归档段文件目录（见 services/log_archive）
+    app.config.setdefault('LOG_ARCHIVE_FOLDER', os.path.join(BASE_DIR, 'log_archive'))
+
+    # 测试时覆盖配置（数据库地址、上传目录等，见 tests/conftest.py）
+    if test_config:
+        app.config.update(test_config)
+
     db.init_app(app)
 
+    # 合同汇总表：随子记录增删改自动维护
+    from .services.rollup_service import register_rollup_events
+    register_rollup_events()
+
+    # 列表页子串检索的 n-gram 索引：随公司/合同/人员增删改自动维护
+    from .services.search_index import register_search_index_events
+    register_search_index_events()
+
+    # 已删除（打了删除标记、等待后台清理）的合同：所有查询自动忽略
+    from .services.contract_purge import register_tombstone_filter
+    register_tombstone_filter()
+
+    # 当前登录用户的跨请求缓存：用户被修改 / 删除时自动失效
+    from .auth import register_identity_events
+    register_identity_events()
+
+    # 操作日志异步批量写入（配置 AUDIT_ASYNC 开启时才启用）
+    from .services.audit_writer import init_audit_writer
+    init_audit_writer(app)
+
+    # 文件缩略图的后台进程池（装了 Pillow / PyMuPDF 时才启用）
+    from .services.previews import init_preview_renderer
+    init_preview_renderer(app)
+
+    # 已删除合同的后台分批清理线程（配置 CONTRACT_PURGE_ASYNC 开启时才启用）
+    from .services.contract_purge import init_contract_purger
+    init_contract_purger(app)
+
+    # 命令行维护命令（flask rollups / search ...）
+    from .commands import register_commands
+    register_commands(app)
+
     # 登录/注册
     from .auth import auth_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
@@ -40,11 +79,8 @@ def create_app():
 
     @app.route('/')
     def home():
-        from .models import User
-        user = None
-        user_id = session.get('user_id')
-        if user_id:
-            user = User.query.get(user_id)
+        from .auth import get_current_user
+        user = get_current_user()
         return render_template('home.html', user=user)
 
     @app.context_processor
@@ -1,6 +1,15 @@
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
 from functools import wraps
+from typing import Dict, Optional, Tuple
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, abort
+from flask import (
+    Blueprint, render_template, request, redirect, url_for, flash, session, abort,
+    g, current_app,
+)
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from .models import User
@@ -8,6 +17,144 @@ from . import db
 
 auth_bp = Blueprint('auth', __name__)  # 模板用全局 templates 目录，不用单独指定
 
+
+# ---------------------- 当前登录用户 ----------------------
+#
+# 每个视图都要知道“当前是谁”：写日志用 id，权限判断用 role，模板显示 username。
+# 这里统一由 get_current_user() 加载：
+#   - 同一个请求内只加载一次，结果放在 flask.g 上；
+#   - 跨请求有一个按用户 ID 的小缓存（有效期见配置 USER_CACHE_TTL），
+#     热门页面不再每次都查 users 表；
+#   - 用户的角色 / 用户名等被修改或用户被删除时，事务提交后清掉对应缓存
+#     （批量 update() / delete() 用户表时清空全部缓存；回滚则不清）。
+#
+# 缓存的是只读快照 CurrentUser，而不是 ORM 对象（ORM 对象不能跨请求 / 跨 Session 使用）。
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """当前登录用户的只读快照（字段与 User 模型同名）"""
+    id: int
+    username: str
+    email: str
+    role: Optional[str]
+    created_at: Optional[datetime] = None
+
+    @classmethod
+    def from_model(cls, user: User) -> 'CurrentUser':
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            role=user.role,
+            created_at=user.created_at,
+        )
+
+
+# user_id -> (过期时间, CurrentUser)
+_user_cache: Dict[int, Tuple[float, CurrentUser]] = {}
+_user_cache_lock = threading.Lock()
+
+
+def invalidate_user_cache(user_id: Optional[int] = None) -> None:
+    """清除某个用户（不传则全部）的缓存"""
+    with _user_cache_lock:
+        if user_id is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(user_id, None)
+
+
+def _load_user(user_id: int) -> Optional[CurrentUser]:
+    ttl = current_app.config.get('USER_CACHE_TTL', 0)
+    now = time.monotonic()
+
+    if ttl > 0:
+        with _user_cache_lock:
+            cached = _user_cache.get(user_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        invalidate_user_cache(user_id)
+        return None
+
+    snapshot = CurrentUser.from_model(user)
+    if ttl > 0:
+        with _user_cache_lock:
+            _user_cache[user_id] = (now + ttl, snapshot)
+    return snapshot
+
+
+def get_current_user() -> Optional[CurrentUser]:
+    """当前请求的登录用户（未登录或用户已不存在时返回 None）"""
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        g.current_user = _load_user(user_id) if user_id else None
+    return g.current_user
+
+
+# 待清缓存的用户 ID 先记在 session.info 里，事务提交后才真正清除：
+# flush 之后还可能回滚，提前清掉会让回滚前的并发请求把未提交的数据重新读进缓存
+_PENDING_KEY = 'user_cache_pending'
+_ALL_USERS = 'all'
+
+
+def _pending(session_) -> set:
+    return session_.info.setdefault(_PENDING_KEY, set())
+
+
+def _after_flush(session_, flush_context) -> None:
+    """用户被修改 / 删除：记下 ID，提交后清缓存"""
+    for obj in list(session_.dirty) + list(session_.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            _pending(session_).add(obj.id)
+
+
+def _on_orm_execute(orm_execute_state) -> None:
+    """批量 update() / delete() 不经过 flush，无从得知影响了哪些用户，提交后清空全部缓存"""
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is not None and table == User.__table__:
+        _pending(orm_execute_state.session).add(_ALL_USERS)
+
+
+def _after_commit(session_) -> None:
+    pending = session_.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    if _ALL_USERS in pending:
+        invalidate_user_cache()
+        return
+    for user_id in pending:
+        invalidate_user_cache(user_id)
+
+
+def _after_soft_rollback(session_, previous_transaction) -> None:
+    """
+    整个事务回滚后数据库里的用户没变，缓存不用清。
+    只回滚到保存点时外层的修改还在，待清 ID 保留（多清一次无妨）。
+    """
+    if previous_transaction.parent is None:
+        session_.info.pop(_PENDING_KEY, None)
+
+
+_IDENTITY_EVENTS = (
+    ('after_flush', _after_flush),
+    ('do_orm_execute', _on_orm_execute),
+    ('after_commit', _after_commit),
+    ('after_soft_rollback', _after_soft_rollback),
+)
+
+
+def register_identity_events() -> None:
+    """注册 Session 事件（create_app 中调用，重复调用无副作用）"""
+    for name, fn in _IDENTITY_EVENTS:
+        if not event.contains(db.session, name, fn):
+            event.listen(db.session, name, fn)
+
+
 # 简单的登录检查装饰器，供其它模块使用
 def login_required(view):
     @wraps(view)
@@ -34,12 +181,11 @@ def staff_required(view):
     """只允许内部员工访问的装饰器（客户 customer 会被拒绝）"""
     @wraps(view)
     def wrapped_view(**kwargs):
-        user_id = session.get('user_id')
-        if not user_id:
+        if not session.get('user_id'):
             flash('请先登录')
             return redirect(url_for('auth.login'))
 
-        user = User.query.get(user_id)
+        user = get_current_user()
         if not user or user.role not in INTERNAL_ROLES:
             # 这里直接 403，后面可以再自定义提示页
             abort(403)
@@ -111,6 +257,8 @@ def login():
 
 @auth_bp.route('/logout')
 def logout():
-    session.pop('user_id', None)
+    user_id = session.pop('user_id', None)
+    if user_id:
+        invalidate_user_cache(user_id)
     flash('已退出登录')
     return redirect(url_for('auth.login'))
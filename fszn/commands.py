@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+命令行维护命令（flask CLI）。
+
+用法示例（在项目根目录）：
+    set FLASK_APP=run.py        (Windows)
+    export FLASK_APP=run.py     (Linux / macOS)
+
+    flask rollups rebuild       # 全量重建合同汇总表
+    flask rollups verify        # 校验汇总表是否漂移
+    flask rollups verify --fix  # 校验并修复漂移的合同
+    flask search reindex        # 全量重建列表检索用的 n-gram 索引
+    flask search index-logs     # 给新写入的操作日志说明补建 n-gram 索引（定时执行）
+    flask schema upgrade        # 补齐数据库里缺少的表 / 列 / 索引，并为历史合同补建汇总行
+    flask oplog backfill-contract-ids   # 给历史操作日志补上合同 ID
+    flask oplog backfill-fields         # 把历史日志 extra_data 里的常用字段提取到独立列
+    flask oplog archive                 # 把超过保留期的操作日志移入按月压缩的归档文件
+    flask files migrate-blobs           # 把历史上传文件迁入内容寻址的 blob 存储
+    flask files gc-uploads              # 清理过期的分块上传会话和暂存文件
+    flask files gc                      # 回收软删除超过宽限期 / 无记录引用的文件
+    flask files scrub --max-gb 50       # 完整性巡检（从上次断点继续，每晚跑一段）
+    flask files scrub-report            # 查看巡检发现的问题
+    flask contracts purge               # 清理已删除合同的子记录和磁盘文件（从断点继续）
+    flask contracts purge-status        # 查看未完成的合同清理
+"""
+
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+
+from . import db
+
+
+rollups_cli = AppGroup('rollups', help='合同汇总表（contract_rollups）维护')
+
+
+@rollups_cli.command('rebuild')
+def rollups_rebuild():
+    """全量重建合同汇总表"""
+    from .services.rollup_service import rebuild_rollups
+
+    result = rebuild_rollups()
+    db.session.commit()
+    click.echo(
+        f"已重建 {result['refreshed']} 个合同的汇总行，"
+        f"清理孤儿汇总行 {result['orphans_removed']} 条"
+    )
+
+
+@rollups_cli.command('verify')
+@click.option('--fix', is_flag=True, help='发现漂移时立即重算这些合同')
+def rollups_verify(fix):
+    """校验合同汇总表与实时计算结果是否一致"""
+    from .services.rollup_service import verify_rollups, refresh_rollups
+
+    drifted = verify_rollups()
+    if not drifted:
+        click.echo('汇总表与实时数据一致')
+        return
+
+    preview = ', '.join(str(cid) for cid in drifted[:20])
+    more = ' ...' if len(drifted) > 20 else ''
+    click.echo(f"发现 {len(drifted)} 个合同的汇总行有漂移：{preview}{more}")
+
+    if fix:
+        refresh_rollups(drifted)
+        db.session.commit()
+        click.echo('已修复')
+
+
+search_cli = AppGroup('search', help='列表检索 n-gram 索引（search_ngrams）维护')
+
+
+@search_cli.command('reindex')
+def search_reindex():
+    """全量重建公司 / 合同 / 人员 / 操作日志说明的 n-gram 索引"""
+    from .services.search_index import index_operation_logs, rebuild_search_index
+
+    counts = rebuild_search_index()
+    db.session.commit()
+    counts['OperationLog'] = index_operation_logs()
+    summary = '，'.join(f"{k} {v} 条" for k, v in counts.items())
+    click.echo(f"索引已重建：{summary}")
+
+
+@search_cli.command('index-logs')
+@click.option('--batch-size', default=500, show_default=True, help='每批处理的日志条数')
+@click.option('--limit', type=int, default=None, help='本次最多处理的日志条数（默认不限）')
+def search_index_logs(batch_size, limit):
+    """从上次的进度往后，给操作日志说明补建 n-gram 索引"""
+    from .services.search_index import index_operation_logs
+
+    count = index_operation_logs(batch_size=batch_size, limit=limit)
+    click.echo(f"补建索引 {count} 条日志")
+
+
+schema_cli = AppGroup('schema', help='数据库结构维护')
+
+
+@schema_cli.command('upgrade')
+def schema_upgrade():
+    """补齐模型里新增、数据库里还没有的表 / 列 / 索引，放宽改成 BigInteger 的列（只增不删）"""
+    from .schema import upgrade_schema
+    from .services.rollup_service import fill_missing_rollups
+
+    changes = upgrade_schema()
+    if not any(changes.values()):
+        click.echo('数据库结构已是最新')
+    for kind, label in (
+        ('tables', '新建表'), ('columns', '新增列'), ('indexes', '新建索引'), ('types', '放宽列类型'),
+    ):
+        if changes[kind]:
+            click.echo(f"{label}：{', '.join(changes[kind])}")
+
+    # 历史合同没有汇总行：建表后顺手补齐，列表页按状态筛选 / 排序才完整
+    filled = fill_missing_rollups()
+    db.session.commit()
+    if filled:
+        click.echo(f"补建合同汇总行 {filled} 条")
+
+
+oplog_cli = AppGroup('oplog', help='操作日志（operation_logs）维护')
+
+
+@oplog_cli.command('backfill-contract-ids')
+@click.option('--batch-size', default=1000, show_default=True, help='每批处理的日志条数')
+def oplog_backfill_contract_ids(batch_size):
+    """解析历史日志的 extra_data / 目标对象，补上 contract_id"""
+    from .services.oplog_service import backfill_log_contract_ids
+
+    result = backfill_log_contract_ids(batch_size=batch_size)
+    click.echo(f"扫描 {result['scanned']} 条，补上合同 ID {result['updated']} 条")
+
+
+@oplog_cli.command('backfill-fields')
+@click.option('--batch-size', default=1000, show_default=True, help='每批处理的日志条数')
+def oplog_backfill_fields(batch_size):
+    """把历史日志 extra_data 里的项目编号 / 合同编号 / 文件类型 / 金额提取到独立列"""
+    from .services.oplog_service import backfill_log_fields
+
+    result = backfill_log_fields(batch_size=batch_size)
+    click.echo(f"扫描 {result['scanned']} 条，更新 {result['updated']} 条")
+
+
+@oplog_cli.command('archive')
+@click.option('--months', type=int, default=None,
+              help='数据库里保留的整月数（含当月），默认取配置 LOG_RETENTION_MONTHS')
+def oplog_archive(months):
+    """把超过保留期的操作日志按月写入压缩段文件，并从数据库删除"""
+    from flask import current_app
+    from .services.log_archive import archive_operation_logs
+
+    if months is None:
+        months = current_app.config['LOG_RETENTION_MONTHS']
+    if months < 1:
+        raise click.BadParameter('至少保留 1 个月', param_hint='--months')
+
+    from .services.search_index import index_operation_logs
+
+    folder = current_app.config['LOG_ARCHIVE_FOLDER']
+    result = archive_operation_logs(folder, months)
+    # 顺便给留在数据库里的新日志补建说明索引
+    indexed = index_operation_logs()
+    if indexed:
+        click.echo(f'补建说明索引 {indexed} 条日志')
+    if not result:
+        click.echo('没有需要归档的日志')
+        return
+    for month, count in sorted(result.items()):
+        click.echo(f'{month}：归档 {count} 条')
+    click.echo(f'归档目录：{folder}')
+
+
+files_cli = AppGroup('files', help='项目文件存储维护')
+
+
+@files_cli.command('migrate-blobs')
+@click.option('--batch-size', default=200, show_default=True, help='每批处理的文件数')
+def files_migrate_blobs(batch_size):
+    """把 content_hash 为空的历史文件复制进 blob 存储并补上哈希"""
+    from flask import current_app
+    from .services.blob_store import migrate_legacy_files
+
+    result = migrate_legacy_files(current_app.config['UPLOAD_FOLDER'], batch_size=batch_size)
+    click.echo(
+        f"迁移 {result['migrated']} 个（其中内容重复 {result['deduplicated']} 个），"
+        f"磁盘上找不到 {result['missing']} 个"
+    )
+
+
+@files_cli.command('gc-uploads')
+@click.option('--ttl-hours', type=float, default=None,
+              help='超过多少小时没有进展的上传视为放弃，默认取配置 UPLOAD_SESSION_TTL_HOURS')
+def files_gc_uploads(ttl_hours):
+    """清理放弃的分块上传：删除过期的上传会话和暂存文件"""
+    from flask import current_app
+    from .services.chunked_upload import purge_stale_uploads
+
+    if ttl_hours is None:
+        ttl_hours = current_app.config['UPLOAD_SESSION_TTL_HOURS']
+    result = purge_stale_uploads(current_app.config['UPLOAD_FOLDER'], ttl_hours)
+    click.echo(
+        f"清理上传会话 {result['sessions']} 个，暂存文件 {result['files']} 个，"
+        f"释放 {result['bytes']} 字节"
+    )
+
+
+@files_cli.command('gc')
+@click.option('--grace-days', type=float, default=None,
+              help='宽限期（天），默认取配置 FILE_GC_GRACE_DAYS')
+@click.option('--batch-size', default=500, show_default=True, help='每批核对的文件数')
+@click.option('--limit', type=int, default=None, help='本次最多删除的文件数（默认不限）')
+@click.option('--dry-run', is_flag=True, help='只统计，不删除')
+def files_gc(grace_days, batch_size, limit, dry_run):
+    """回收软删除超过宽限期、或已没有任何记录引用的文件"""
+    from flask import current_app
+    from .services.file_gc import collect_garbage
+
+    if grace_days is None:
+        grace_days = current_app.config['FILE_GC_GRACE_DAYS']
+    result = collect_garbage(
+        current_app.config['UPLOAD_FOLDER'], grace_days,
+        batch_size=batch_size, limit=limit, dry_run=dry_run,
+    )
+    prefix = '（试运行）可' if dry_run else ''
+    click.echo(
+        f"扫描 {result['scanned']} 个文件，{prefix}删除 blob {result['blobs']} 个、"
+        f"平铺文件 {result['files']} 个，{prefix}释放 {result['bytes']} 字节"
+    )
+    if result['stamped']:
+        click.echo(f"补记历史软删除时间 {result['stamped']} 条（宽限期从现在开始计算）")
+
+
+@files_cli.command('scrub')
+@click.option('--max-gb', type=float, default=None, help='本次最多读取多少 GB（默认不限）')
+@click.option('--max-files', type=int, default=None, help='本次最多巡检多少个文件（默认不限）')
+@click.option('--workers', default=4, show_default=True, help='并行计算哈希的线程数')
+@click.option('--restart', is_flag=True, help='忽略断点，从头开始新一轮')
+def files_scrub(max_gb, max_files, workers, restart):
+    """逐个核对文件大小和 SHA-256，问题写入 file_scrub_findings"""
+    from flask import current_app
+    from .services.file_scrub import scrub_files
+
+    max_bytes = int(max_gb * 1024 ** 3) if max_gb is not None else None
+    result = scrub_files(
+        current_app.config['UPLOAD_FOLDER'],
+        max_bytes=max_bytes, max_files=max_files, workers=workers, restart=restart,
+    )
+    click.echo(
+        f"巡检 {result['files']} 个文件，读取 {result['bytes']} 字节，发现问题 {result['problems']} 个"
+    )
+    if result['completed']:
+        click.echo('本轮已全部完成，下次从头开始')
+    else:
+        click.echo(f"已记录断点：文件 ID {result['last_file_id']}，下次从这里继续")
+
+
+@files_cli.command('scrub-report')
+def files_scrub_report():
+    """列出巡检发现、尚未修复的问题"""
+    from .models import FileScrubFinding, ProjectFile
+
+    rows = (
+        db.session.query(FileScrubFinding, ProjectFile)
+        .outerjoin(ProjectFile, ProjectFile.id == FileScrubFinding.file_id)
+        .order_by(FileScrubFinding.status, FileScrubFinding.file_id)
+        .all()
+    )
+    if not rows:
+        click.echo('没有发现问题')
+        return
+    for finding, pf in rows:
+        name = pf.stored_filename if pf else '（文件记录已删除）'
+        click.echo(
+            f"[{finding.status}] 文件 {finding.file_id} {name}："
+            f"大小 {finding.expected_size} -> {finding.actual_size}，"
+            f"首次发现 {finding.first_seen_at:%Y-%m-%d %H:%M}，最近确认 {finding.checked_at:%Y-%m-%d %H:%M}"
+            + (f"，{finding.message}" if finding.message else '')
+        )
+
+
+contracts_cli = AppGroup('contracts', help='项目/合同维护')
+
+
+@contracts_cli.command('purge')
+@click.option('--batch-size', type=int, default=None,
+              help='每批删除的行数，默认取配置 CONTRACT_PURGE_BATCH_SIZE')
+@click.option('--limit', type=int, default=None, help='本次最多清理的合同数（默认不限）')
+def contracts_purge(batch_size, limit):
+    """清理已删除合同的子记录和磁盘文件，最后删除合同本身"""
+    from flask import current_app
+    from .services.contract_purge import purge_deleted_contracts
+
+    if batch_size is None:
+        batch_size = current_app.config['CONTRACT_PURGE_BATCH_SIZE']
+    result = purge_deleted_contracts(
+        current_app.config['UPLOAD_FOLDER'], batch_size=batch_size, limit=limit,
+    )
+    click.echo(
+        f"清理合同 {result['contracts']} 个，删除记录 {result['rows']} 行，"
+        f"删除文件 {result['files']} 个，释放 {result['bytes']} 字节"
+    )
+    if result['skipped']:
+        click.echo(f"{result['skipped']} 个合同正由其它进程清理，已跳过")
+
+
+@contracts_cli.command('purge-status')
+def contracts_purge_status():
+    """列出尚未清理完的已删除合同"""
+    from .models import ContractPurge
+
+    rows = (
+        ContractPurge.query
+        .filter(ContractPurge.finished_at.is_(None))
+        .order_by(ContractPurge.requested_at.asc())
+        .all()
+    )
+    if not rows:
+        click.echo('没有未完成的清理')
+        return
+    for purge in rows:
+        click.echo(
+            f"合同 {purge.contract_id}：删除于 {purge.requested_at:%Y-%m-%d %H:%M}，"
+            f"进行到 {purge.stage or '（未开始）'}，已删除 {purge.rows_deleted} 行、文件 {purge.files_removed} 个"
+            + (f"，正在由 {purge.locked_by} 清理" if purge.locked_until and purge.locked_until > datetime.utcnow() else '')
+            + (f"，上次出错：{purge.last_error}" if purge.last_error else '')
+        )
+
+
+def register_commands(app):
+    """在 create_app 中调用，注册全部 CLI 命令"""
+    app.cli.add_command(rollups_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(schema_cli)
+    app.cli.add_command(oplog_cli)
+    app.cli.add_command(files_cli)
+    app.cli.add_command(contracts_cli)
@@ -3,26 +3,31 @@
 from functools import wraps
 from datetime import datetime, date
 import os, json
+from itertools import chain, islice
 from decimal import Decimal
 
 from flask import (
     Blueprint, render_template, request,
-    redirect, url_for, flash, session, send_from_directory, current_app
+    redirect, url_for, flash, session, send_from_directory, send_file, current_app, jsonify,
+    Response, stream_with_context, abort,
 )
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 
 from . import db
-from sqlalchemy import or_, and_  # 新增：用于日志关键字检索的 OR 条件
+from sqlalchemy import or_, and_, case, func  # 检索条件组合、状态 CASE 表达式、金额合计
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
 
-from .auth import login_required
+from .auth import login_required, get_current_user, CurrentUser
 from .models import (
     Contract, Company, User,
     Department, Person, ProjectDepartmentLeader,
     Task, ProcurementItem, Acceptance, Payment, Invoice, Refund, Feedback,
-    SalesInfo, ProjectFile, OperationLog
+    SalesInfo, ProjectFile, OperationLog, ContractRollup, UploadSession,
 )
 
 from .services.finance_service import (
     get_contract_finance_summary,
+    get_finance_summaries,
     create_payment,
     delete_payment,
     create_invoice,
@@ -33,22 +38,50 @@ from .services.finance_service import (
 
 from .services.file_service import (
     evaluate_file_download,
+    evaluate_file_downloads,
     evaluate_file_delete,
+    file_download_clause,
 )
 
 from .services import create_task, delete_task
+from .services.status_service import get_contract_statuses, status_sort_expression, status_text_expression
+from .services.overview_service import get_contract_overview
+from .services.reference_cache import get_department_choices, get_person_choices
+from .services.audit_writer import SYNC_ACTIONS, get_audit_writer
+from .services.oplog_service import resolve_log_contract_id, promoted_log_fields
+from .services.log_archive import iter_archived_logs
+from .services.blob_store import CHUNK_SIZE as BLOB_CHUNK_SIZE, store_stream, file_disk_path
+from .services.previews import get_preview_renderer, preview_kind, preview_key, preview_path
+from .services.chunked_upload import (
+    UploadError, create_upload_session, write_chunk, finalize_upload,
+)
+from .services.search_index import keyword_condition, log_message_condition
+from .services.contract_purge import find_contract_by_code, get_contract_purger, mark_contract_deleted
+from .pagination import encode_cursor, decode_cursor, seek_condition, seek_order_by
+from .streaming import iter_csv_stream, iter_xlsx_stream, iter_ndjson_stream, iter_zip_stream
 
 # 操作日志记录函数
 
 def log_operation(
-    user: User | None,
+    user: CurrentUser | None,
     action: str,
     target_type: str | None = None,
     target_id: int | None = None,
     message: str | None = None,
     extra: dict | None = None,
+    sync: bool = False,
+    contract_id: int | None = None,
 ) -> None:
-    """记录一条操作日志（不提交事务，由调用方统一 commit）"""
+    """
+    记录一条操作日志。
+
+    contract_id 不传时自动推导（extra['contract_id'] 或目标本身是合同），
+    合同日志页按这一列查询，见 services/oplog_service.resolve_log_contract_id。
+
+    - 默认（未开启 AUDIT_ASYNC）：加入当前 Session，不提交事务，由调用方统一 commit；
+    - 开启 AUDIT_ASYNC 后：交给后台线程批量写入（见 services/audit_writer）；
+      sync=True 或动作在 SYNC_ACTIONS 中时仍然同步写入，与业务数据同一事务。
+    """
     extra_data = None
     if extra:
         try:
@@ -57,64 +90,38 @@ def log_operation(
             # 防御性处理：即便 extra 序列化失败，也不要影响业务
             extra_data = None
 
-    log = OperationLog(
+    row = dict(
         user_id=user.id if user else None,
         action=action,
         target_type=target_type,
         target_id=target_id,
+        contract_id=resolve_log_contract_id(target_type, target_id, extra, contract_id),
+        **promoted_log_fields(extra),
         message=message,
         extra_data=extra_data,
+        # 时间在记录时确定，异步写入时也不会因排队而偏后
+        created_at=datetime.utcnow(),
     )
-    db.session.add(log)
-
-
-
-# 根据任务、验收、付款、反馈等情况计算项目状态
-
-def get_contract_status(contract: Contract):
-    """根据任务、验收、付款、反馈等情况计算项目状态（统一为 5 种业务状态）"""
-    cid = contract.id
-
-    # 是否有任何执行/记录
-    has_tasks = Task.query.filter_by(contract_id=cid).count() > 0
-    has_payments = Payment.query.filter_by(contract_id=cid).count() > 0
-    has_invoices = Invoice.query.filter_by(contract_id=cid).count() > 0
 
-    # 验收记录
-    acceptance_q = Acceptance.query.filter_by(contract_id=cid)
-    has_acceptance = acceptance_q.count() > 0
-    # 是否有通过的验收
-    has_accepted = acceptance_q.filter_by(status='通过').count() > 0
+    writer = get_audit_writer(current_app)
+    if writer is not None and not sync and action not in SYNC_ACTIONS:
+        if writer.submit(row):
+            return
+        # 队列已满：退回同步写入，不丢日志
 
-    # 有未解决反馈？
-    has_unresolved_feedback = Feedback.query.filter_by(
-        contract_id=cid,
-        is_resolved=False
-    ).count() > 0
+    db.session.add(OperationLog(**row))
 
-    # 1）未启动：什么记录都没有
-    if (not has_tasks) and (not has_acceptance) and (not has_payments) and (not has_invoices):
-        return "未启动", "grey"
 
-    # 2）生产中：还没有任何“通过”的验收，但已经开始执行
-    if not has_accepted:
-        # 有任务 / 有验收记录（进行中或不通过） / 有发票等，都可以认为已经在执行
-        return "生产中", "blue"
 
-    # 3）已验收，待回款：有通过验收，但一分钱还没收到
-    if has_accepted and (not has_payments):
-        return "已验收，待回款", "orange"
-
-    # 4）已回款，有未解决问题：有通过验收 + 有收款 + 有未解决反馈
-    if has_accepted and has_payments and has_unresolved_feedback:
-        return "已回款，有未解决问题", "red"
+# 根据任务、验收、付款、反馈等情况计算项目状态
 
-    # 5）已完成：有通过验收 + 有收款 + 没有未解决反馈
-    if has_accepted and has_payments and (not has_unresolved_feedback):
-        return "已完成", "green"
+def get_contract_status(contract: Contract):
+    """根据任务、验收、付款、反馈等情况计算项目状态（统一为 5 种业务状态）
 
-    # 理论上不会走到这里，但为了安全，统一归为“生产中”
-    return "生产中", "blue"
+    单个合同的便捷入口，内部复用批量接口 get_contract_statuses（一次查询）。
+    列表等需要多个合同状态的地方，请直接调用 get_contract_statuses。
+    """
+    return get_contract_statuses([contract.id]).get(contract.id, ("未启动", "grey"))
 
 
 # 状态筛选用的映射：URL 参数值 -> 状态文本
@@ -132,6 +139,12 @@ contracts_bp = Blueprint('contracts', __name__, url_prefix='/contracts')
 
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'doc', 'docx', 'xls', 'xlsx'}
 
+# 本身已压缩的格式：打包 ZIP 时原样存储（STORED），不再重复压缩
+PRECOMPRESSED_EXTENSIONS = {
+    'pdf', 'png', 'jpg', 'jpeg', 'gif', 'webp',
+    'docx', 'xlsx', 'pptx', 'zip', 'rar', '7z', 'gz', 'dwg',
+}
+
 
 # 不同角色允许上传的文件类型
 ROLE_ALLOWED_TYPES = {
@@ -151,10 +164,21 @@ ROLE_ALLOWED_TYPES = {
 # 仅限老板 / 软件工程师可见的文件操作动作
 SENSITIVE_FILE_ACTIONS = (
     'file.download',
+    'file.download_partial',
+    'file.download_not_modified',
+    'file.download_range_not_satisfiable',
     'file.download_denied',
+    'file.bundle_download',
     'file.delete_denied',
 )
 
+# 下载响应状态码 -> 日志动作：断点续传（206）、缓存命中（304）和请求范围无效（416）单独计数
+DOWNLOAD_STATUS_ACTIONS = {
+    206: 'file.download_partial',
+    304: 'file.download_not_modified',
+    416: 'file.download_range_not_satisfiable',
+}
+
 
 
 def allowed_file(filename: str) -> bool:
@@ -164,7 +188,7 @@ def allowed_file(filename: str) -> bool:
     return ext in ALLOWED_EXTENSIONS
 
 
-def get_role_allowed_types(user: User):
+def get_role_allowed_types(user: CurrentUser):
     role = (user.role or '').strip().lower() if user and user.role else ''
     # 简单处理一下常见中文/英文角色映射可以在这里加
     return ROLE_ALLOWED_TYPES.get(role, ROLE_ALLOWED_TYPES['default'])
@@ -236,6 +260,17 @@ def parse_date(date_str):
         return None
 
 
+def parse_amount(amount_str):
+    """将金额字符串转成 Decimal，失败返回 None"""
+    if not amount_str:
+        return None
+    try:
+        amount = Decimal(amount_str)
+    except ArithmeticError:
+        return None
+    return amount if amount.is_finite() else None
+
+
 def login_required(view):
     @wraps(view)
     def wrapped_view(**kwargs):
@@ -247,137 +282,288 @@ def login_required(view):
 
 # 项目/合同列表
 
-@contracts_bp.route('/')
-@login_required
-def list_contracts():
-    """项目/合同列表"""
-    user = None
-    user_id = session.get('user_id')
-    if user_id:
-        user = User.query.get(user_id)
+# 列表每页条数上限（默认值见 config 的 CONTRACTS_PER_PAGE）
+CONTRACTS_MAX_PER_PAGE = 200
+
+# 支持 keyset（seek）分页的排序方式：
+#   order 参数 -> (排序列, 是否降序, 从合同对象上取排序值的函数)
+# 并列时按合同 ID 同方向排序，保证翻页稳定
+KEYSET_ORDERS = {
+    '': (Contract.created_at, True, lambda c: c.created_at),
+    'created_at_asc': (Contract.created_at, False, lambda c: c.created_at),
+    'deal_date_desc': (
+        SalesInfo.deal_date, True,
+        lambda c: c.sales_info.deal_date if c.sales_info else None,
+    ),
+    'deal_date_asc': (
+        SalesInfo.deal_date, False,
+        lambda c: c.sales_info.deal_date if c.sales_info else None,
+    ),
+}
 
-    # 读取查询参数（全部为可选）
-    company_kw = (request.args.get('company') or '').strip()
-    project_kw = (request.args.get('project') or '').strip()
-    contract_no_kw = (request.args.get('contract_no') or '').strip()
-    sales_kw = (request.args.get('sales') or '').strip()
-    leader_kw = (request.args.get('leader') or '').strip()
-    status_param = (request.args.get('status') or '').strip()
-    # 新增：排序参数
-    #   '' / None              -> 按创建时间(新→旧)
-    #   'created_at_asc'       -> 按创建时间(旧→新)
-    #   'deal_date_desc'       -> 按成交日期(新→旧)
-    #   'deal_date_asc'        -> 按成交日期(旧→新)
-    #   'status_asc/desc'      -> 按状态文本排序（Python 层）
-    order_param = (request.args.get('order') or '').strip()
-
-    # 基础查询
-    query = Contract.query
-
-    # 公司名称模糊匹配
+# 剩余应收 / 剩余待开票（SQL 表达式，基于合同汇总表里的金额合计，可直接排序）
+# 报价为空时结果为 NULL，与详情页“未填报价不计算剩余”保持一致
+RECEIVABLE_REMAINING_EXPR = SalesInfo.quote_amount - (
+    func.coalesce(ContractRollup.paid_total, 0) - func.coalesce(ContractRollup.refund_total, 0)
+)
+INVOICE_REMAINING_EXPR = SalesInfo.quote_amount - func.coalesce(ContractRollup.invoiced_total, 0)
+
+# 列表用的状态文本 / 排序序号：优先读合同汇总表；
+# 汇总行缺失（汇总表上线前的历史合同、尚未执行 schema upgrade / rollups rebuild）时在 SQL 里实时推导，
+# 保证这些合同不会被状态筛选漏掉，也不会在状态排序里挤到一端
+_ROLLUP_MISSING = ContractRollup.contract_id.is_(None)
+LIST_STATUS_TEXT_EXPR = case(
+    (_ROLLUP_MISSING, status_text_expression(Contract.id)),
+    else_=ContractRollup.status_text,
+)
+LIST_STATUS_SORT_EXPR = case(
+    (_ROLLUP_MISSING, status_sort_expression(status_text_expression(Contract.id))),
+    else_=ContractRollup.status_sort,
+)
+
+# 按金额排序：order 参数 -> (排序表达式, 是否降序)，走 offset 分页
+AMOUNT_ORDERS = {
+    'receivable_desc': (RECEIVABLE_REMAINING_EXPR, True),
+    'receivable_asc': (RECEIVABLE_REMAINING_EXPR, False),
+    'uninvoiced_desc': (INVOICE_REMAINING_EXPR, True),
+    'uninvoiced_asc': (INVOICE_REMAINING_EXPR, False),
+}
+
+
+def _read_contract_list_filters(args) -> dict:
+    """读取列表页的筛选/排序参数（全部为可选），列表页和导出共用"""
+    return dict(
+        company_kw=(args.get('company') or '').strip(),
+        project_kw=(args.get('project') or '').strip(),
+        contract_no_kw=(args.get('contract_no') or '').strip(),
+        sales_kw=(args.get('sales') or '').strip(),
+        leader_kw=(args.get('leader') or '').strip(),
+        status_param=(args.get('status') or '').strip(),
+        # 排序参数
+        #   '' / None              -> 按创建时间(新→旧)
+        #   'created_at_asc'       -> 按创建时间(旧→新)
+        #   'deal_date_desc'       -> 按成交日期(新→旧)
+        #   'deal_date_asc'        -> 按成交日期(旧→新)
+        #   'status_asc/desc'      -> 按状态文本排序（SQL 层，基于合同汇总表）
+        #   'receivable_asc/desc'  -> 按剩余应收排序
+        #   'uninvoiced_asc/desc'  -> 按剩余待开票排序
+        order_param=(args.get('order') or '').strip(),
+    )
+
+
+def _contract_list_base_query():
+    """列表 / 导出共用的合同查询：外连接汇总表和销售信息，预加载模板用到的关联"""
+    return (
+        Contract.query
+        .outerjoin(ContractRollup, ContractRollup.contract_id == Contract.id)
+        .outerjoin(SalesInfo, SalesInfo.contract_id == Contract.id)
+        .options(
+            contains_eager(Contract.rollup),
+            contains_eager(Contract.sales_info).joinedload(SalesInfo.sales_person),
+            joinedload(Contract.company),
+            selectinload(Contract.department_leaders).options(
+                joinedload(ProjectDepartmentLeader.department),
+                joinedload(ProjectDepartmentLeader.person),
+            ),
+        )
+    )
+
+
+def _build_contract_list_query(filters: dict):
+    """
+    根据筛选参数构造合同查询（未排序、未分页）。
+
+    - 合同汇总表、销售信息都是“每个合同最多一行”，这里统一外连接，
+      既用于筛选/排序，也顺带加载到合同对象上；
+    - 所有筛选都在 SQL 层完成（一对多的条件用 EXISTS 半连接），
+      不会产生重复行，可以直接在数据库里分页；
+    - 列表模板用到的关联（公司、销售负责人、部门负责人及其部门/人员）
+      全部显式预加载，一页固定只需几条查询，不随合同数量增长。
+    """
+    company_kw = filters['company_kw']
+    project_kw = filters['project_kw']
+    contract_no_kw = filters['contract_no_kw']
+    sales_kw = filters['sales_kw']
+    leader_kw = filters['leader_kw']
+    status_param = filters['status_param']
+
+    query = _contract_list_base_query()
+
+    # 公司名称模糊匹配（>=2 个字符时先走 n-gram 索引，见 services/search_index）
     if company_kw:
-        query = query.join(Company).filter(Company.name.ilike(f"%{company_kw}%"))
+        query = query.filter(
+            Contract.company.has(
+                keyword_condition(Company.name, Company.id, 'Company', 'name', company_kw)
+            )
+        )
 
     # 项目编号模糊匹配
     if project_kw:
-        query = query.filter(Contract.project_code.ilike(f"%{project_kw}%"))
+        query = query.filter(
+            keyword_condition(Contract.project_code, Contract.id, 'Contract', 'project_code', project_kw)
+        )
 
     # 合同编号模糊匹配
     if contract_no_kw:
-        query = query.filter(Contract.contract_number.ilike(f"%{contract_no_kw}%"))
+        query = query.filter(
+            keyword_condition(Contract.contract_number, Contract.id, 'Contract', 'contract_number', contract_no_kw)
+        )
 
-    # 销售负责人模糊匹配
-    sales_joined = False
+    # 销售负责人模糊匹配（EXISTS 半连接）
     if sales_kw:
-        query = (
-            query.join(SalesInfo, SalesInfo.contract_id == Contract.id)
-                 .join(Person, Person.id == SalesInfo.sales_person_id)
-                 .filter(Person.name.ilike(f"%{sales_kw}%"))
+        query = query.filter(
+            Contract.sales_info.has(
+                SalesInfo.sales_person.has(
+                    keyword_condition(Person.name, Person.id, 'Person', 'name', sales_kw)
+                )
+            )
         )
-        sales_joined = True
 
-    # 部门负责人模糊匹配
+    # 部门负责人模糊匹配：一个合同可能有多名负责人命中，用 EXISTS 避免重复行
     if leader_kw:
-        query = (
-            query.join(ProjectDepartmentLeader, ProjectDepartmentLeader.contract_id == Contract.id)
-                 .join(Person, Person.id == ProjectDepartmentLeader.person_id)
-                 .filter(Person.name.ilike(f"%{leader_kw}%"))
+        query = query.filter(
+            Contract.department_leaders.any(
+                ProjectDepartmentLeader.person.has(
+                    keyword_condition(Person.name, Person.id, 'Person', 'name', leader_kw)
+                )
+            )
         )
 
-    # ========= 1）数据库层排序 =========
-    if order_param in ('deal_date_asc', 'deal_date_desc'):
-        # 成交日期排序，需要关联 SalesInfo，如果前面没因 sales_kw 关联则补一个外连接
-        if not sales_joined:
-            query = query.outerjoin(SalesInfo, SalesInfo.contract_id == Contract.id)
+    # 按状态筛选（基于合同汇总表，缺汇总行时实时推导）
+    status_filter_text = STATUS_FILTERS.get(status_param) if status_param else None
+    if status_filter_text:
+        query = query.filter(LIST_STATUS_TEXT_EXPR == status_filter_text)
+
+    return query
 
-        if order_param == 'deal_date_asc':
-            query = query.order_by(SalesInfo.deal_date.asc(), Contract.created_at.desc())
-        else:
-            query = query.order_by(SalesInfo.deal_date.desc(), Contract.created_at.desc())
-    else:
-        # 默认按创建时间排序
-        if order_param == 'created_at_asc':
-            query = query.order_by(Contract.created_at.asc())
-        else:
-            query = query.order_by(Contract.created_at.desc())
 
-    contracts = query.all()
+def _contract_list_order_by(order_param: str) -> list:
+    """列表排序对应的 ORDER BY 子句（不含 keyset 游标条件）"""
+    if order_param in KEYSET_ORDERS:
+        sort_col, descending, _ = KEYSET_ORDERS[order_param]
+        return seek_order_by(sort_col, Contract.id, descending)
 
-    # ========= 2）去重（避免 join 产生重复） =========
-    unique_contracts = []
-    seen_ids = set()
-    for c in contracts:
-        if c.id in seen_ids:
+    # 按剩余应收 / 剩余待开票排序；金额相同按创建时间(新→旧)
+    if order_param in AMOUNT_ORDERS:
+        expr, descending = AMOUNT_ORDERS[order_param]
+        return [expr.desc() if descending else expr.asc(), Contract.created_at.desc(), Contract.id.desc()]
+
+    # 按状态排序：status_sort 与状态文本的排序顺序一致；同状态内按创建时间(新→旧)
+    if order_param == 'status_asc':
+        return [LIST_STATUS_SORT_EXPR.asc(), Contract.created_at.desc(), Contract.id.desc()]
+    return [LIST_STATUS_SORT_EXPR.desc(), Contract.created_at.desc(), Contract.id.desc()]
+
+
+def _leaders_by_department(contract: Contract) -> dict:
+    """构造某个合同的“部门 -> [负责人列表]”（按部门 ID / 人员 ID 排序）"""
+    dept_map = {}
+    for l in sorted(
+        contract.department_leaders,
+        key=lambda x: ((x.department_id or 0), (x.person_id or 0))
+    ):
+        if not l.department or not l.person:
             continue
-        seen_ids.add(c.id)
-        unique_contracts.append(c)
-    contracts = unique_contracts
+        dept_map.setdefault(l.department.name, []).append(l.person)
+    return dept_map
+
+
+@contracts_bp.route('/')
+@login_required
+def list_contracts():
+    """项目/合同列表（服务端分页）"""
+    user = get_current_user()
+
+    # 读取查询参数（全部为可选）
+    filters = _read_contract_list_filters(request.args)
+    order_param = filters['order_param']
+
+    # 每页条数：URL 参数 per_page 优先，否则取配置
+    per_page = request.args.get('per_page', type=int) or current_app.config.get('CONTRACTS_PER_PAGE', 50)
+    per_page = max(1, min(per_page, CONTRACTS_MAX_PER_PAGE))
+
+    # ========= 1）筛选（全部在 SQL 层） =========
+    query = _build_contract_list_query(filters)
+
+    # ========= 2）排序 + 分页 =========
+    if order_param in KEYSET_ORDERS:
+        # 按创建时间 / 成交日期排序：keyset 分页，用游标定位，不用 OFFSET
+        sort_col, descending, sort_value = KEYSET_ORDERS[order_param]
+        after = decode_cursor(request.args.get('after'))
+        before = decode_cursor(request.args.get('before')) if not after else None
+
+        if before:
+            # 向前翻页：反方向取 per_page + 1 条，再倒过来
+            rows = (
+                query
+                .filter(seek_condition(sort_col, Contract.id, *before, descending=not descending))
+                .order_by(*seek_order_by(sort_col, Contract.id, not descending))
+                .limit(per_page + 1)
+                .all()
+            )
+            has_prev = len(rows) > per_page
+            has_next = True
+            contracts = list(reversed(rows[:per_page]))
+        else:
+            if after:
+                query = query.filter(seek_condition(sort_col, Contract.id, *after, descending=descending))
+            rows = (
+                query
+                .order_by(*_contract_list_order_by(order_param))
+                .limit(per_page + 1)
+                .all()
+            )
+            has_prev = after is not None
+            has_next = len(rows) > per_page
+            contracts = rows[:per_page]
+
+        pagination = dict(
+            mode='keyset',
+            per_page=per_page,
+            has_prev=has_prev and bool(contracts),
+            has_next=has_next and bool(contracts),
+            prev_cursor=encode_cursor(sort_value(contracts[0]), contracts[0].id) if contracts else None,
+            next_cursor=encode_cursor(sort_value(contracts[-1]), contracts[-1].id) if contracts else None,
+        )
+    else:
+        # 按状态 / 金额排序：offset 分页
+        query = query.order_by(*_contract_list_order_by(order_param))
+
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            page = 1
+        total = query.order_by(None).count()
+        total_pages = (total + per_page - 1) // per_page if total > 0 else 1
+        if page > total_pages:
+            page = total_pages
+
+        contracts = query.offset((page - 1) * per_page).limit(per_page).all()
+
+        pagination = dict(
+            mode='offset',
+            page=page,
+            per_page=per_page,
+            total=total,
+            total_pages=total_pages,
+            has_prev=page > 1,
+            has_next=page < total_pages,
+        )
 
     # ========= 3）构造“部门 -> [负责人列表]” =========
-    leaders_by_contract = {}
-    for c in contracts:
-        dept_map = {}
-        for l in sorted(
-            c.department_leaders,
-            key=lambda x: ((x.department_id or 0), (x.person_id or 0))
-        ):
-            if not l.department or not l.person:
-                continue
-            dept_name = l.department.name
-            dept_map.setdefault(dept_name, []).append(l.person)
-        leaders_by_contract[c.id] = dept_map
+    leaders_by_contract = {c.id: _leaders_by_department(c) for c in contracts}
 
-    # ========= 4）为每个合同计算状态 =========
+    # ========= 4）状态：优先读汇总表，缺汇总行的合同再批量实时计算 =========
     status_map = {}
+    missing_ids = []
     for c in contracts:
-        st_text, st_level = get_contract_status(c)
-        status_map[c.id] = dict(text=st_text, level=st_level)
+        if c.rollup is not None:
+            status_map[c.id] = dict(text=c.rollup.status_text, level=c.rollup.status_level)
+        else:
+            missing_ids.append(c.id)
+    for cid, (st_text, st_level) in get_contract_statuses(missing_ids).items():
+        status_map[cid] = dict(text=st_text, level=st_level)
 
-    # ========= 5）按状态参数进行二次过滤（Python 层） =========
-    status_filter_text = STATUS_FILTERS.get(status_param) if status_param else None
-    if status_filter_text:
-        filtered_contracts = []
-        filtered_status_map = {}
-        for c in contracts:
-            st = status_map.get(c.id)
-            if not st:
-                continue
-            if st['text'] == status_filter_text:
-                filtered_contracts.append(c)
-                filtered_status_map[c.id] = st
-        contracts = filtered_contracts
-        status_map = filtered_status_map
-
-    # ========= 6）按状态文本排序（Python 层） =========
-    if order_param in ('status_asc', 'status_desc'):
-        reverse = (order_param == 'status_desc')
-
-        def status_key(c: Contract):
-            st = status_map.get(c.id)
-            # 没状态的排最后
-            return st['text'] if st and st.get('text') else 'ZZZZZZ'
-
-        contracts = sorted(contracts, key=status_key, reverse=reverse)
+    # ========= 5）剩余应收 / 剩余待开票：整页一次聚合查询 =========
+    finance_map = get_finance_summaries([c.id for c in contracts])
 
     return render_template(
         'contracts/list.html',
@@ -385,42 +571,179 @@ def list_contracts():
         contracts=contracts,
         leaders_by_contract=leaders_by_contract,
         statuses=status_map,
-        # 把当前查询/排序参数传给模板，以便回填表单
-        company_kw=company_kw,
-        project_kw=project_kw,
-        contract_no_kw=contract_no_kw,
-        sales_kw=sales_kw,
-        leader_kw=leader_kw,
-        status_param=status_param,
-        order_param=order_param,
+        finances=finance_map,
+        pagination=pagination,
+        # 把当前查询/排序参数传给模板，以便回填表单 / 生成翻页链接
+        page_args=dict(
+            company=filters['company_kw'],
+            project=filters['project_kw'],
+            contract_no=filters['contract_no_kw'],
+            sales=filters['sales_kw'],
+            leader=filters['leader_kw'],
+            status=filters['status_param'],
+            order=order_param,
+            per_page=per_page,
+        ),
+        **filters,
     )
 
-# 操作日志列表
+# 导出合同列表（CSV / Excel），筛选条件与列表页一致
 
-@contracts_bp.route('/operation_logs')
+# 每次从数据库取多少个合同（同时也是输出的块大小）
+EXPORT_CHUNK_SIZE = 500
+
+CONTRACT_EXPORT_HEADERS = [
+    'ID', '客户公司', '项目编号', '合同编号', '合同名称', '计划交付时间',
+    '客户负责人', '客户联系方式', '我方负责人', '状态', '部门及负责人',
+    '报价', '报价日期', '成交日期', '销售', '剩余应收', '剩余待开票',
+]
+
+
+def _iter_contract_export_chunks(filters: dict):
+    """
+    按块产出导出行。
+
+    先按筛选 / 排序条件取出全部合同 ID（只有一列整数，读完即关闭结果集），
+    再每 EXPORT_CHUNK_SIZE 个 ID 加载一块合同及关联、批量计算状态和金额。
+    不在结果集还没读完时执行其它查询：SQL Server 的 pyodbc 连接不支持服务端游标，
+    没开 MARS 时同一连接上有未读完的结果集，再查询会报 “Connection is busy”；
+    内存里只保留一块合同对象。
+    """
+    ids = [
+        row.id for row in
+        _build_contract_list_query(filters)
+        .with_entities(Contract.id)
+        .order_by(*_contract_list_order_by(filters['order_param']))
+        .all()
+    ]
+
+    def build_rows(contracts):
+        # 缺汇总行的合同，按块批量实时计算状态
+        missing = [c.id for c in contracts if c.rollup is None]
+        computed = get_contract_statuses(missing) if missing else {}
+        finances = get_finance_summaries([c.id for c in contracts])
+
+        rows = []
+        for c in contracts:
+            if c.rollup is not None:
+                status_text = c.rollup.status_text
+            else:
+                status_text = computed.get(c.id, ('', ''))[0]
+
+            leaders = '；'.join(
+                f"{dept}：{'，'.join(p.name for p in persons)}"
+                for dept, persons in _leaders_by_department(c).items()
+            )
+
+            sales = c.sales_info
+            finance = finances.get(c.id, {})
+            rows.append([
+                c.id,
+                c.company.name if c.company else '',
+                c.project_code,
+                c.contract_number,
+                c.name,
+                c.planned_delivery_date,
+                c.client_manager,
+                c.client_contact,
+                c.our_manager,
+                status_text,
+                leaders,
+                sales.quote_amount if sales else None,
+                sales.quote_date if sales else None,
+                sales.deal_date if sales else None,
+                sales.sales_person.name if sales and sales.sales_person else None,
+                finance.get('receivable_remaining'),
+                finance.get('invoice_remaining'),
+            ])
+        return rows
+
+    for start in range(0, len(ids), EXPORT_CHUNK_SIZE):
+        chunk_ids = ids[start:start + EXPORT_CHUNK_SIZE]
+        loaded = {c.id: c for c in _contract_list_base_query().filter(Contract.id.in_(chunk_ids)).all()}
+        # 按导出顺序排列；两次查询之间被删除的合同跳过
+        yield build_rows([loaded[cid] for cid in chunk_ids if cid in loaded])
+
+
+@contracts_bp.route('/export')
 @login_required
-def operation_logs():
-    """操作日志列表（全局，支持过滤 + 分页）"""
-    # 当前登录用户
-    user_id = session.get('user_id')
-    current_user = User.query.get(user_id) if user_id else None
-
-    # ========= 1）读取查询参数 =========
-    action_kw = (request.args.get('action') or '').strip()
-    target_type = (request.args.get('target_type') or '').strip()
-    target_id_raw = (request.args.get('target_id') or '').strip()
-    user_id_raw = (request.args.get('user_id') or '').strip()
-    keyword = (request.args.get('q') or '').strip()
-    start_date_str = (request.args.get('start_date') or '').strip()
-    end_date_str = (request.args.get('end_date') or '').strip()
-
-    # 分页参数
-    page = request.args.get('page', 1, type=int)
-    if page < 1:
-        page = 1
-    per_page = 50
-
-    # ========= 2）构造查询 =========
+def export_contracts():
+    """按列表页的筛选/排序条件导出全部合同（流式输出，不分页）"""
+    filters = _read_contract_list_filters(request.args)
+    fmt = (request.args.get('format') or 'csv').strip().lower()
+
+    row_chunks = _iter_contract_export_chunks(filters)
+
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if fmt == 'xlsx':
+        body = iter_xlsx_stream(CONTRACT_EXPORT_HEADERS, row_chunks, sheet_name='合同列表')
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        filename = f'contracts_{stamp}.xlsx'
+    else:
+        body = iter_csv_stream(CONTRACT_EXPORT_HEADERS, row_chunks)
+        mimetype = 'text/csv; charset=utf-8'
+        filename = f'contracts_{stamp}.csv'
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+
+# 操作日志列表
+
+# 每页条数
+OPERATION_LOGS_PER_PAGE = 50
+
+# 总数最多数到这么多条，超过时显示“1000+”，避免每次翻页都全表 COUNT
+OPERATION_LOGS_COUNT_CAP = 1000
+
+
+def _read_operation_log_filters(args) -> dict:
+    """读取全局操作日志页的筛选参数（全部为可选）"""
+    return dict(
+        action=(args.get('action') or '').strip(),
+        target_type=(args.get('target_type') or '').strip(),
+        target_id=(args.get('target_id') or '').strip(),
+        user_id=(args.get('user_id') or '').strip(),
+        contract_id=(args.get('contract_id') or '').strip(),
+        project_code=(args.get('project_code') or '').strip(),
+        contract_number=(args.get('contract_number') or '').strip(),
+        file_type=(args.get('file_type') or '').strip(),
+        amount_min=(args.get('amount_min') or '').strip(),
+        amount_max=(args.get('amount_max') or '').strip(),
+        q=(args.get('q') or '').strip(),
+        start_date=(args.get('start_date') or '').strip(),
+        end_date=(args.get('end_date') or '').strip(),
+    )
+
+
+def _can_view_sensitive_logs(current_user) -> bool:
+    """仅 boss 和 software_engineer 可以查看敏感文件操作日志"""
+    privileged_roles = ('boss', 'software_engineer')
+    role = (current_user.role or '').strip().lower() if current_user and current_user.role else ''
+    return role in privileged_roles
+
+
+def _operation_log_date_range(filters: dict):
+    """把筛选里的开始 / 结束日期转成 (开始时间, 结束时间)，未填的为 None"""
+    start_date = parse_date(filters['start_date'])
+    end_date = parse_date(filters['end_date'])
+    # 开始日期当天 00:00:00 起，结束日期当天 23:59:59.999999 止
+    start_dt = datetime.combine(start_date, datetime.min.time()) if start_date else None
+    end_dt = datetime.combine(end_date, datetime.max.time()) if end_date else None
+    return start_dt, end_dt
+
+
+def _build_operation_log_query(filters: dict, current_user):
+    """根据筛选参数 + 当前用户角色构造操作日志查询（未排序、未分页）"""
+    action_kw = filters['action']
+    target_type = filters['target_type']
+    target_id_raw = filters['target_id']
+    user_id_raw = filters['user_id']
+    keyword = filters['q']
+
     query = OperationLog.query
 
     # 按动作模糊匹配
@@ -448,35 +771,49 @@ def operation_logs():
         except ValueError:
             pass
 
-    # 按时间范围过滤（使用已有的 parse_date 辅助函数）
-    start_date = parse_date(start_date_str)
-    end_date = parse_date(end_date_str)
-
-    if start_date:
-        # 当天 00:00:00 起
-        query = query.filter(
-            OperationLog.created_at >= datetime.combine(start_date, datetime.min.time())
-        )
-    if end_date:
-        # 当天 23:59:59.999999 止
-        end_dt = datetime.combine(end_date, datetime.max.time())
+    # 按时间范围过滤
+    start_dt, end_dt = _operation_log_date_range(filters)
+    if start_dt:
+        query = query.filter(OperationLog.created_at >= start_dt)
+    if end_dt:
         query = query.filter(OperationLog.created_at <= end_dt)
 
-    # 关键字搜索：在 message 和 extra_data 内模糊匹配
-    if keyword:
-        like = f"%{keyword}%"
-        query = query.filter(
-            or_(
-                OperationLog.message.ilike(like),
-                OperationLog.extra_data.ilike(like),
-            )
-        )
-
-    # ========= 2.5）按角色过滤敏感文件操作日志 =========
-    privileged_roles = ('boss', 'software_engineer')
-    role = (current_user.role or '').strip().lower() if current_user and current_user.role else ''
+    # 按合同 ID 精确匹配
+    if filters['contract_id']:
+        try:
+            query = query.filter(OperationLog.contract_id == int(filters['contract_id']))
+        except ValueError:
+            pass
 
-    if role not in privileged_roles:
+    # 按项目编号 / 合同编号 / 文件类型精确匹配（extra 里提取出的独立列，均有索引）
+    if filters['project_code']:
+        query = query.filter(OperationLog.project_code == filters['project_code'])
+    if filters['contract_number']:
+        query = query.filter(OperationLog.contract_number == filters['contract_number'])
+    if filters['file_type']:
+        query = query.filter(OperationLog.file_type == filters['file_type'])
+
+    # 按金额范围过滤（extra 里的 amount 提取出的独立列）
+    amount_min = parse_amount(filters['amount_min'])
+    amount_max = parse_amount(filters['amount_max'])
+    if amount_min is not None:
+        query = query.filter(OperationLog.amount >= amount_min)
+    if amount_max is not None:
+        query = query.filter(OperationLog.amount <= amount_max)
+
+    # 关键字搜索：说明文字走 n-gram 索引；项目编号 / 合同编号按前缀、文件类型按全值匹配（走索引）。
+    # 不再扫描 extra_data：其中常用于检索的字段都已提取成上面的独立列，
+    # 其余内容（变更前后的值等）只在详情里展示，对整列 JSON 文本做 %kw% 匹配只能全表扫描
+    if keyword:
+        conditions = [log_message_condition(keyword)]
+        if '%' not in keyword and '_' not in keyword:
+            conditions.append(OperationLog.project_code.like(f"{keyword}%"))
+            conditions.append(OperationLog.contract_number.like(f"{keyword}%"))
+            conditions.append(OperationLog.file_type == keyword)
+        query = query.filter(or_(*conditions))
+
+    # 按角色过滤敏感文件操作日志
+    if not _can_view_sensitive_logs(current_user):
         # 非特权角色（含普通内部员工 / customer）：
         # 不允许看到 文件下载 / 下载被拒 / 删除被拒 这三类日志
         query = query.filter(
@@ -486,21 +823,151 @@ def operation_logs():
             )
         )
 
+    return query
+
 
+def _archived_log_filters(filters: dict, current_user):
+    """
+    与 _build_operation_log_query 相同的筛选条件，用于归档日志（见 services/log_archive）。
 
-    # ========= 3）统计总数 + 分页 =========
-    total = query.count()
-    total_pages = (total + per_page - 1) // per_page if total > 0 else 1
-    if page > total_pages and total_pages > 0:
-        page = total_pages
+    返回 (block_filter, row_filter)：
+        block_filter 按旁路索引跳过不可能命中的块，row_filter 对每行精确过滤。
+    """
+    def _int_or_none(raw):
+        try:
+            return int(raw) if raw else None
+        except ValueError:
+            return None
+
+    action_kw = filters['action'].lower()
+    target_type = filters['target_type']
+    target_id = _int_or_none(filters['target_id'])
+    user_id = _int_or_none(filters['user_id'])
+    contract_id = _int_or_none(filters['contract_id'])
+    amount_min = parse_amount(filters['amount_min'])
+    amount_max = parse_amount(filters['amount_max'])
+    keyword = filters['q'].lower()
+    hide_sensitive = not _can_view_sensitive_logs(current_user)
+
+    def block_filter(block) -> bool:
+        if action_kw and not any(action_kw in a.lower() for a in block['actions']):
+            return False
+        if target_type and target_type not in block['target_types']:
+            return False
+        if user_id is not None and user_id not in block['user_ids']:
+            return False
+        if contract_id is not None and contract_id not in block['contract_ids']:
+            return False
+        return True
+
+    def row_filter(row) -> bool:
+        if action_kw and action_kw not in (row['action'] or '').lower():
+            return False
+        if target_type and row['target_type'] != target_type:
+            return False
+        if target_id is not None and row['target_id'] != target_id:
+            return False
+        if user_id is not None and row['user_id'] != user_id:
+            return False
+        if contract_id is not None and row['contract_id'] != contract_id:
+            return False
+        for key in ('project_code', 'contract_number', 'file_type'):
+            if filters[key] and row[key] != filters[key]:
+                return False
+        if amount_min is not None or amount_max is not None:
+            amount = parse_amount(row['amount'])
+            if amount is None:
+                return False
+            if amount_min is not None and amount < amount_min:
+                return False
+            if amount_max is not None and amount > amount_max:
+                return False
+        if keyword and not (
+            keyword in (row['message'] or '').lower()
+            or (row['project_code'] or '').lower().startswith(keyword)
+            or (row['contract_number'] or '').lower().startswith(keyword)
+            or (row['file_type'] or '').lower() == keyword
+        ):
+            return False
+        if hide_sensitive and row['target_type'] == 'ProjectFile' and row['action'] in SENSITIVE_FILE_ACTIONS:
+            return False
+        return True
 
-    logs = (
-        query
-        .order_by(OperationLog.created_at.desc())
-        .offset((page - 1) * per_page)
-        .limit(per_page)
-        .all()
-    )
+    return block_filter, row_filter
+
+
+@contracts_bp.route('/operation_logs')
+@login_required
+def operation_logs():
+    """操作日志列表（全局，支持过滤 + keyset 分页）"""
+    # 当前登录用户
+    current_user = get_current_user()
+
+    # ========= 1）读取查询参数 + 构造查询 =========
+    filters = _read_operation_log_filters(request.args)
+    query = _build_operation_log_query(filters, current_user)
+    per_page = OPERATION_LOGS_PER_PAGE
+
+    # ========= 2）统计总数（封顶，超过上限只显示“1000+”） =========
+    capped = query.order_by(None).limit(OPERATION_LOGS_COUNT_CAP + 1).count()
+    total_capped = capped > OPERATION_LOGS_COUNT_CAP
+    total = min(capped, OPERATION_LOGS_COUNT_CAP)
+
+    # ========= 3）keyset 分页：按 (created_at, id) 倒序，用游标定位 =========
+    # 指定了开始日期时，同时读取该范围内已归档的月份（归档日志都早于热表里的日志，
+    # 按时间倒序时排在热表之后；游标格式相同，可以在两者之间连续翻页）
+    sort_col = OperationLog.created_at
+    after = decode_cursor(request.args.get('after'))
+    before = decode_cursor(request.args.get('before')) if not after else None
+
+    start_dt, end_dt = _operation_log_date_range(filters)
+    archive_folder = current_app.config.get('LOG_ARCHIVE_FOLDER')
+    use_archive = start_dt is not None and bool(archive_folder)
+
+    def archived(cursor, descending, limit):
+        if not use_archive or limit <= 0:
+            return []
+        block_filter, row_filter = _archived_log_filters(filters, current_user)
+        return list(islice(
+            iter_archived_logs(
+                archive_folder, start_dt, end_dt,
+                descending=descending,
+                block_filter=block_filter,
+                row_filter=row_filter,
+                after=cursor,
+            ),
+            limit,
+        ))
+
+    if before:
+        # 向前翻页：反方向取 per_page + 1 条，再倒过来（升序时归档在前、热表在后）
+        fetched = archived(before, False, per_page + 1)
+        if len(fetched) <= per_page:
+            fetched += (
+                query
+                .filter(seek_condition(sort_col, OperationLog.id, *before, descending=False))
+                .order_by(*seek_order_by(sort_col, OperationLog.id, False))
+                .limit(per_page + 1 - len(fetched))
+                .all()
+            )
+        has_prev = len(fetched) > per_page
+        has_next = True
+        logs = list(reversed(fetched[:per_page]))
+    else:
+        hot_query = query
+        if after:
+            hot_query = hot_query.filter(seek_condition(sort_col, OperationLog.id, *after, descending=True))
+        fetched = (
+            hot_query
+            .order_by(*seek_order_by(sort_col, OperationLog.id, True))
+            .limit(per_page + 1)
+            .all()
+        )
+        # 热表不够一页：接着从归档里取
+        fetched += archived(after, True, per_page + 1 - len(fetched))
+        has_prev = after is not None
+        has_next = len(fetched) > per_page
+        logs = fetched[:per_page]
 
     # ========= 4）预加载用户（避免 N+1） =========
     user_ids = {l.user_id for l in logs if l.user_id}
@@ -522,32 +989,31 @@ def operation_logs():
             )
         )
 
-    # 简单分页信息（模板使用）
+    # 分页信息（模板使用）
     pagination = dict(
-        page=page,
         per_page=per_page,
         total=total,
-        total_pages=total_pages,
-        has_prev=page > 1,
-        has_next=page < total_pages,
+        total_capped=total_capped,
+        # 总数只统计数据库里的日志；读取了归档月份时模板里另行提示
+        archive_included=use_archive,
+        has_prev=has_prev and bool(logs),
+        has_next=has_next and bool(logs),
+        prev_cursor=encode_cursor(logs[0].created_at, logs[0].id) if logs else None,
+        next_cursor=encode_cursor(logs[-1].created_at, logs[-1].id) if logs else None,
     )
 
+    audit_writer = get_audit_writer(current_app)
+
     return render_template(
         'contracts/operation_logs.html',
         user=current_user,
         rows=rows,
-        filters=dict(
-            action=action_kw,
-            target_type=target_type,
-            target_id=target_id_raw,
-            user_id=user_id_raw,
-            q=keyword,
-            start_date=start_date_str,
-            end_date=end_date_str,
-        ),
+        filters=filters,
         pagination=pagination,
         # 全局日志页没有指定合同，这里显式传 None，模板里用 if 判断
         current_contract=None,
+        # 开启异步写入时，显示本进程写入器的积压 / 丢弃计数
+        audit_stats=audit_writer.stats() if audit_writer else None,
     )
 
 
@@ -563,38 +1029,19 @@ def operation_logs():
 @login_required
 def contract_operation_logs(contract_id):
     """某个合同相关的操作日志（会过滤敏感文件操作日志）"""
-    user_id = session.get('user_id')
-    current_user = User.query.get(user_id) if user_id else None
+    current_user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
     # ========= 1）基础查询：该合同相关日志 =========
-    logs_query = (
-        OperationLog.query
-        .filter(OperationLog.target_id == contract.id)
-        .filter(
-            OperationLog.target_type.in_([
-                'Contract',
-                'ProjectDepartmentLeader',
-                'Task',
-                'ProjectFile',
-                'Payment',
-                'Invoice',
-                'Refund',
-                'Feedback',
-                'ProcurementItem',
-                'Acceptance',
-            ])
-        )
-    )
+    # 合同本身及其子记录（任务 / 付款 / 文件等）的日志都带 contract_id，
+    # 走 (contract_id, created_at) 索引；历史日志需先执行 flask oplog backfill-contract-ids
+    logs_query = OperationLog.query.filter(OperationLog.contract_id == contract.id)
 
     # ========= 2）按角色过滤敏感文件操作日志 =========
     # 仅 boss 和 software_engineer 可以查看以下三类敏感动作：
     #   file.download / file.download_denied / file.delete_denied
-    privileged_roles = ('boss', 'software_engineer')
-    role = (current_user.role or '').strip().lower() if current_user and current_user.role else ''
-
-    if role not in privileged_roles:
+    if not _can_view_sensitive_logs(current_user):
         # 普通用户：过滤掉敏感日志
         logs_query = logs_query.filter(
             ~and_(
@@ -606,7 +1053,7 @@ def contract_operation_logs(contract_id):
     # ========= 3）排序 + 限制记录数 =========
     logs = (
         logs_query
-        .order_by(OperationLog.created_at.desc())
+        .order_by(OperationLog.created_at.desc(), OperationLog.id.desc())
         .limit(200)
         .all()
     )
@@ -650,8 +1097,7 @@ def contract_operation_logs(contract_id):
 @login_required
 def set_planned_delivery(contract_id):
     """在列表页直接更新合同的计划交付时间"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
@@ -688,6 +1134,161 @@ def set_planned_delivery(contract_id):
 
 # 解析 extra_data 字段
 
+# 操作日志导出：字段顺序（NDJSON 的 key / CSV 的表头）
+OPERATION_LOG_EXPORT_FIELDS = [
+    'id', 'created_at', 'user_id', 'username', 'action', 'target_type', 'target_id',
+    'contract_id', 'project_code', 'contract_number', 'file_type', 'amount',
+    'message', 'extra', 'archived',
+]
+
+# 导出时只查这些列，不加载完整的 ORM 对象
+_OPERATION_LOG_EXPORT_COLUMNS = [
+    OperationLog.id, OperationLog.created_at, OperationLog.user_id, OperationLog.action,
+    OperationLog.target_type, OperationLog.target_id, OperationLog.contract_id,
+    OperationLog.project_code, OperationLog.contract_number, OperationLog.file_type,
+    OperationLog.amount, OperationLog.message, OperationLog.extra_data,
+]
+
+
+def _iter_operation_log_export_chunks(rows, fmt: str):
+    """
+    把日志行（数据库行或归档行）按 EXPORT_CHUNK_SIZE 分块，转成导出记录。
+
+    用户名按块批量查询并在本次导出内缓存；
+    NDJSON 的 extra 解析成对象，CSV 保留原始 JSON 文本。
+    """
+    usernames = {}
+
+    def build(chunk):
+        missing = {r.user_id for r in chunk if r.user_id and r.user_id not in usernames}
+        if missing:
+            usernames.update(
+                db.session.query(User.id, User.username).filter(User.id.in_(missing)).all()
+            )
+            # 已删除的用户也记一下，避免下一块重复查询
+            for uid in missing:
+                usernames.setdefault(uid, None)
+
+        records = []
+        for r in chunk:
+            record = dict(
+                id=r.id,
+                created_at=r.created_at,
+                user_id=r.user_id,
+                username=usernames.get(r.user_id),
+                action=r.action,
+                target_type=r.target_type,
+                target_id=r.target_id,
+                contract_id=r.contract_id,
+                project_code=r.project_code,
+                contract_number=r.contract_number,
+                file_type=r.file_type,
+                amount=r.amount,
+                message=r.message,
+                extra=_parse_extra_data(r.extra_data) if fmt == 'ndjson' else r.extra_data,
+                archived=bool(getattr(r, 'archived', False)),
+            )
+            if fmt == 'ndjson':
+                records.append(record)
+            else:
+                records.append([record[name] for name in OPERATION_LOG_EXPORT_FIELDS])
+        return records
+
+    chunk = []
+    for r in rows:
+        chunk.append(r)
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield build(chunk)
+            chunk = []
+    if chunk:
+        yield build(chunk)
+
+
+def _iter_operation_log_pages(query):
+    """
+    按 (created_at, id) 降序做 keyset 分页，逐页读取数据库里的日志行。
+
+    每页 EXPORT_CHUNK_SIZE 条一次读完、结果集关闭后才往下产出，
+    处理这一页时（按块查用户名）连接上没有未读完的结果集
+    （SQL Server 的 pyodbc 连接没开 MARS 时不允许，见 _iter_contract_export_chunks）。
+    """
+    after = None
+    while True:
+        page_query = query
+        if after is not None:
+            page_query = page_query.filter(
+                seek_condition(OperationLog.created_at, OperationLog.id, after[0], after[1], True)
+            )
+        rows = (
+            page_query
+            .order_by(*seek_order_by(OperationLog.created_at, OperationLog.id, True))
+            .limit(EXPORT_CHUNK_SIZE)
+            .all()
+        )
+        yield from rows
+        if len(rows) < EXPORT_CHUNK_SIZE:
+            return
+        after = (rows[-1].created_at, rows[-1].id)
+
+
+@contracts_bp.route('/operation_logs/export')
+@login_required
+def export_operation_logs():
+    """
+    按日志页的筛选条件导出全部匹配的操作日志（NDJSON 或 CSV，流式输出，不分页）。
+
+    数据库部分按 (created_at, id) keyset 分页读取（见 _iter_operation_log_pages）；
+    填写了开始日期时，接着按同样的条件输出已归档月份里的日志（逐月读取）。
+    """
+    current_user = get_current_user()
+    filters = _read_operation_log_filters(request.args)
+    fmt = (request.args.get('format') or 'ndjson').strip().lower()
+    if fmt not in ('ndjson', 'csv'):
+        fmt = 'ndjson'
+
+    query = (
+        _build_operation_log_query(filters, current_user)
+        .with_entities(*_OPERATION_LOG_EXPORT_COLUMNS)
+    )
+
+    start_dt, end_dt = _operation_log_date_range(filters)
+    archive_folder = current_app.config.get('LOG_ARCHIVE_FOLDER')
+    sources = [_iter_operation_log_pages(query)]
+    if start_dt is not None and archive_folder:
+        block_filter, row_filter = _archived_log_filters(filters, current_user)
+        sources.append(iter_archived_logs(
+            archive_folder, start_dt, end_dt,
+            descending=True, block_filter=block_filter, row_filter=row_filter,
+        ))
+
+    # 导出本身也记一条日志（谁、按什么条件导出了日志）
+    log_operation(
+        user=current_user,
+        action='oplog.export',
+        target_type='OperationLog',
+        message=f'导出操作日志（{fmt}）',
+        extra=dict(format=fmt, **{k: v for k, v in filters.items() if v}),
+    )
+    db.session.commit()
+
+    row_chunks = _iter_operation_log_export_chunks(chain.from_iterable(sources), fmt)
+
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if fmt == 'csv':
+        body = iter_csv_stream(OPERATION_LOG_EXPORT_FIELDS, row_chunks)
+        mimetype = 'text/csv; charset=utf-8'
+    else:
+        body = iter_ndjson_stream(row_chunks)
+        mimetype = 'application/x-ndjson; charset=utf-8'
+    filename = f'operation_logs_{stamp}.{fmt}'
+
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+
 def _parse_extra_data(extra_data: str | None) -> dict:
     """解析 OperationLog.extra_data 的 JSON 字符串，失败则返回空字典"""
     if not extra_data:
@@ -708,10 +1309,7 @@ def _parse_extra_data(extra_data: str | None) -> dict:
 @login_required
 def new_contract():
     """新建项目/合同"""
-    user = None
-    user_id = session.get('user_id')
-    if user_id:
-        user = User.query.get(user_id)
+    user = get_current_user()
 
     if request.method == 'POST':
         company_name = (request.form.get('company_name') or '').strip()
@@ -734,7 +1332,10 @@ def new_contract():
             db.session.flush()
 
         # 检查项目编号全局唯一
-        exists = Contract.query.filter_by(project_code=project_code).first()
+        exists = find_contract_by_code(project_code)
+        if exists and exists.deleted_at:
+            flash('该项目编号属于已删除、正在后台清理的合同，请稍后再试或更换项目编号')
+            return render_template('contracts/new.html', user=user)
         if exists:
             flash('该项目编号已存在，请更换一个唯一的项目编号')
             return render_template('contracts/new.html', user=user)
@@ -747,7 +1348,7 @@ def new_contract():
             client_manager=client_manager,
             client_contact=client_contact,
             our_manager=our_manager,
-            created_by_id=user_id,
+            created_by_id=user.id if user else None,
         )
 
         db.session.add(contract)
@@ -781,8 +1382,7 @@ def new_contract():
 @login_required
 def delete_contract(contract_id):
     """删除合同及其关联记录（任务、采购、验收、款项、销售、文件等）"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
     cid = contract.id
@@ -808,23 +1408,15 @@ def delete_contract(contract_id):
     #     flash('无权限删除合同')
     #     return redirect(url_for('contracts.list_contracts'))
 
-    # 先删所有子记录，避免外键约束冲突
-    Task.query.filter_by(contract_id=cid).delete(synchronize_session=False)
-    ProcurementItem.query.filter_by(contract_id=cid).delete(synchronize_session=False)
-    Acceptance.query.filter_by(contract_id=cid).delete(synchronize_session=False)
-    Payment.query.filter_by(contract_id=cid).delete(synchronize_session=False)
-    Invoice.query.filter_by(contract_id=cid).delete(synchronize_session=False)
-    Refund.query.filter_by(contract_id=cid).delete(synchronize_session=False)
-    Feedback.query.filter_by(contract_id=cid).delete(synchronize_session=False)
-    ProjectDepartmentLeader.query.filter_by(contract_id=cid).delete(synchronize_session=False)
-    # 🔹 关键：显式删除 sales_infos 里所有引用该合同的记录
-    SalesInfo.query.filter_by(contract_id=cid).delete(synchronize_session=False)
-    ProjectFile.query.filter_by(contract_id=cid).delete(synchronize_session=False)
-
-    # 最后删除合同本身
-    db.session.delete(contract)
+    # 只打删除标记：之后所有查询都看不到这个合同；
+    # 子记录、磁盘文件和合同本身由后台分批清理（见 services/contract_purge）
+    mark_contract_deleted(contract, user)
     db.session.commit()
 
+    purger = get_contract_purger(current_app)
+    if purger is not None:
+        purger.notify()
+
     flash('合同及相关记录已删除')
     return redirect(url_for('contracts.list_contracts'))
 
@@ -836,8 +1428,7 @@ def delete_contract(contract_id):
 @login_required
 def manage_leaders(contract_id):
     """管理某个项目/合同的部门负责人（可多名）"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
@@ -902,8 +1493,8 @@ def manage_leaders(contract_id):
         .all()
     )
 
-    departments = Department.query.order_by(Department.id.asc()).all()
-    persons = Person.query.order_by(Person.id.asc()).all()
+    departments = get_department_choices()
+    persons = get_person_choices()
 
     return render_template(
         'contracts/leaders.html',
@@ -920,8 +1511,7 @@ def manage_leaders(contract_id):
 def delete_leader(contract_id: int, leader_id: int):
     """删除某条部门负责人记录，并记录操作日志"""
     # 当前登录用户，用于日志审计
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
@@ -962,8 +1552,7 @@ def delete_leader(contract_id: int, leader_id: int):
 @login_required
 def manage_tasks(contract_id):
     """管理某个项目的任务/生产进度"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
@@ -1066,8 +1655,8 @@ def manage_tasks(contract_id):
         .order_by(Department.id.asc(), Task.start_date.asc(), Task.id.asc())
         .all()
     )
-    departments = Department.query.order_by(Department.id.asc()).all()
-    persons = Person.query.order_by(Person.id.asc()).all()
+    departments = get_department_choices()
+    persons = get_person_choices()
 
     return render_template(
         'contracts/tasks.html',
@@ -1100,8 +1689,8 @@ def delete_task(contract_id, task_id):
         },
     )
 
-db.session.commit()
-flash('任务已删除')
+    db.session.commit()
+    flash('任务已删除')
     return redirect(url_for('contracts.manage_tasks', contract_id=contract.id))
 
 
@@ -1111,8 +1700,7 @@ flash('任务已删除')
 @login_required
 def manage_procurements(contract_id):
     """管理某个项目的采购清单"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
@@ -1184,7 +1772,7 @@ def manage_procurements(contract_id):
     ).all()
 
     # 🔹 仿照任务/验收：查询所有人员
-    persons = Person.query.order_by(Person.id.asc()).all()
+    persons = get_person_choices()
 
     return render_template(
         'contracts/procurements.html',
@@ -1221,8 +1809,7 @@ def delete_procurement(contract_id, item_id):
 @login_required
 def manage_acceptances(contract_id):
     """管理某个项目的验收记录"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
@@ -1286,7 +1873,7 @@ def manage_acceptances(contract_id):
         .order_by(Acceptance.date.asc(), Acceptance.id.asc())
         .all()
     )
-    persons = Person.query.order_by(Person.id.asc()).all()
+    persons = get_person_choices()
 
     return render_template(
         'contracts/acceptances.html',
@@ -1304,8 +1891,7 @@ def manage_acceptances(contract_id):
 def delete_acceptance(contract_id, acc_id):
     """删除某条验收记录 + 写操作日志"""
     # 当前用户
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
     acc = Acceptance.query.filter_by(id=acc_id, contract_id=contract.id).first_or_404()
@@ -1339,8 +1925,7 @@ def delete_acceptance(contract_id, acc_id):
 @login_required
 def manage_sales(contract_id):
     """管理某个项目的销售信息（报价、成交日期、销售负责人）"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
@@ -1440,7 +2025,7 @@ def manage_sales(contract_id):
 
 
     # GET：展示现有销售信息 + 编辑表单
-    persons = Person.query.order_by(Person.id.asc()).all()
+    persons = get_person_choices()
 
     return render_template(
         'contracts/sales.html',
@@ -1485,105 +2070,27 @@ def delete_sales(contract_id):
 @login_required
 def contract_overview(contract_id):
     """项目 / 合同总览页面"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
-
-    contract = Contract.query.get_or_404(contract_id)
-
-    # 部门负责人列表
-    leaders = (
-        ProjectDepartmentLeader.query
-        .filter_by(contract_id=contract.id)
-        .order_by(ProjectDepartmentLeader.id.asc())
-        .all()
-    )
-
-    # 销售信息（可能没有）
-    sales = SalesInfo.query.filter_by(contract_id=contract.id).first()
+    user = get_current_user()
 
-    # 各模块计数（不做金额统计，避免字段名对不上）
-    tasks_count = Task.query.filter_by(contract_id=contract.id).count()
-    proc_count = ProcurementItem.query.filter_by(contract_id=contract.id).count()
-    acc_count = Acceptance.query.filter_by(contract_id=contract.id).count()
-    pay_count = Payment.query.filter_by(contract_id=contract.id).count()
-    inv_count = Invoice.query.filter_by(contract_id=contract.id).count()
-    refund_count = Refund.query.filter_by(contract_id=contract.id).count()
-    fb_count = Feedback.query.filter_by(contract_id=contract.id).count()
-    files_count = ProjectFile.query.filter_by(contract_id=contract.id, is_deleted=False).count()
-
-    # 当前项目状态（文本 + 颜色级别）
-    status_text, status_level = get_contract_status(contract)
-
-    # #  财务汇总
-    # zero = Decimal('0.00')
-
-    # # 报价金额（作为合同金额使用）
-    # quote_amount = None
-    # if sales and getattr(sales, 'quote_amount', None) is not None:
-    #     quote_amount = sales.quote_amount
-
-    # # 已收款总额 / 退款总额 / 实收净额
-    # paid_total = sum((p.amount or zero) for p in contract.payments)
-    # refund_total = sum((r.amount or zero) for r in contract.refunds)
-    # net_received = paid_total - refund_total
-
-    # # 已开票总额
-    # invoiced_total = sum((inv.amount or zero) for inv in contract.invoices)
-
-    # # 剩余应收 / 剩余待开票
-    # receivable_remaining = None
-    # invoice_remaining = None
-    # if quote_amount is not None:
-    #     receivable_remaining = quote_amount - net_received
-    #     invoice_remaining = quote_amount - invoiced_total
-
-    # finance = dict(
-    #     quote_amount=quote_amount,
-    #     paid_total=paid_total,
-    #     refund_total=refund_total,
-    #     net_received=net_received,
-    #     invoiced_total=invoiced_total,
-    #     receivable_remaining=receivable_remaining,
-    #     invoice_remaining=invoice_remaining,
-    # )
-
-    # 财务汇总：交给 FinanceService 统一处理
-    finance = get_contract_finance_summary(contract, sales=sales)
+    # 合同 + 计数 + 状态 + 财务汇总一条查询，部门负责人第二条（见 services/overview_service）
+    overview = get_contract_overview(contract_id)
+    if overview is None:
+        abort(404)
 
     return render_template(
         'contracts/overview.html',
         user=user,
-        contract=contract,
-        leaders=leaders,
-        sales=sales,
-        stats=dict(
-            tasks=tasks_count,
-            proc=proc_count,
-            acc=acc_count,
-            pay=pay_count,
-            inv=inv_count,
-            refund=refund_count,
-            fb=fb_count,
-            files=files_count,
-        ),
-        status=dict(
-            text=status_text,
-            level=status_level,
-        ),
-        finance=finance,  # 传进模板
+        **overview,
     )
 
 
 
-
-
 # 付款管理
 @contracts_bp.route('/<int:contract_id>/payments', methods=['GET', 'POST'])
 @login_required
 def manage_payments(contract_id):
     """管理某个项目的客户付款记录"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
@@ -1664,8 +2171,7 @@ def manage_payments(contract_id):
 @contracts_bp.route('/<int:contract_id>/payments/<int:pay_id>/delete', methods=['POST'])
 @login_required
 def delete_payment(contract_id, pay_id):
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
     contract = Contract.query.get_or_404(contract_id)
     # p = Payment.query.filter_by(id=pay_id, contract_id=contract.id).first_or_404()
     # 交给 Finance Service 做查询 + delete（不提交事务）
@@ -1692,8 +2198,7 @@ def delete_payment(contract_id, pay_id):
 @login_required
 def manage_invoices(contract_id):
     """管理某个项目的开票记录"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
@@ -1774,8 +2279,7 @@ def manage_invoices(contract_id):
 @contracts_bp.route('/<int:contract_id>/invoices/<int:inv_id>/delete', methods=['POST'])
 @login_required
 def delete_invoice(contract_id, inv_id):
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
     contract = Contract.query.get_or_404(contract_id)
     #inv = Invoice.query.filter_by(id=inv_id, contract_id=contract.id).first_or_404()
     # 交给 Finance Service 删除
@@ -1806,8 +2310,7 @@ def delete_invoice(contract_id, inv_id):
 @login_required
 def manage_refunds(contract_id):
     """退款记录列表 + 新增 + 写审计日志"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
@@ -1895,8 +2398,7 @@ def manage_refunds(contract_id):
 @login_required
 def delete_refund(contract_id, refund_id):
     """删除退款记录 + 写操作日志"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
     #refund = Refund.query.filter_by(id=refund_id, contract_id=contract.id).first_or_404()
@@ -1933,8 +2435,7 @@ def delete_refund(contract_id, refund_id):
 @login_required
 def manage_feedbacks(contract_id):
     """客户反馈列表 + 新增 + 写审计日志"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
@@ -1979,7 +2480,7 @@ def manage_feedbacks(contract_id):
         flash('反馈已添加')
         return redirect(url_for('contracts.manage_feedbacks', contract_id=contract.id))
 
-    persons = Person.query.order_by(Person.name.asc()).all()
+    persons = get_person_choices(order='name')
     feedbacks = Feedback.query.filter_by(contract_id=contract.id).order_by(
         Feedback.feedback_time.desc(), Feedback.id.desc()
     ).all()
@@ -1997,8 +2498,7 @@ def manage_feedbacks(contract_id):
 @login_required
 def delete_feedback(contract_id, feedback_id):
     """删除反馈记录 + 写审计日志"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
     fb = Feedback.query.filter_by(
@@ -2036,8 +2536,7 @@ def delete_feedback(contract_id, feedback_id):
 @login_required
 def resolve_feedback(contract_id, feedback_id):
     """标记反馈为已解决"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
     fb = Feedback.query.filter_by(id=feedback_id, contract_id=contract.id).first_or_404()
@@ -2066,8 +2565,7 @@ def resolve_feedback(contract_id, feedback_id):
 @login_required
 def unresolve_feedback(contract_id, feedback_id):
     """标记反馈为未解决"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
     fb = Feedback.query.filter_by(id=feedback_id, contract_id=contract.id).first_or_404()
@@ -2095,22 +2593,91 @@ def unresolve_feedback(contract_id, feedback_id):
 
 # 管理页面（列表+上传）
 
+def _enqueue_preview(pf: ProjectFile) -> None:
+    """上传提交后排队生成缩略图（后台进程池，不等待）"""
+    renderer = get_preview_renderer(current_app)
+    if renderer is None:
+        return
+    try:
+        renderer.submit(pf)
+    except Exception:
+        # 缩略图只是锦上添花，失败不影响上传结果
+        current_app.logger.exception('缩略图任务提交失败：file_id=%s', pf.id)
+
+
+def _check_upload_fields(user: CurrentUser, filename: str, file_type: str):
+    """校验上传的文件名 / 文件类型 / 角色权限，不通过时返回提示文案"""
+    # 对图纸 file_type='drawing' 放宽限制，不检查扩展名
+    if file_type != 'drawing' and not allowed_file(filename):
+        return '不支持的文件类型（非图纸文件请使用常见文档/图片格式）'
+
+    # 校验角色是否允许上传这种类型
+    if file_type not in get_role_allowed_types(user):
+        return '当前角色不允许上传此类型文件'
+    return None
+
+
+def _add_project_file(contract: Contract, user: CurrentUser, *, file_type, version, is_public,
+                      original_filename, content_type, content_hash, size, deduplicated,
+                      extra=None) -> ProjectFile:
+    """内容已放入 blob 存储后，创建 ProjectFile 并写上传日志（由调用方提交）"""
+    author = user.username  # 如果你实际字段叫 name，就改成 user.name
+    stored_filename = generate_file_name(
+        contract, file_type, version, author, original_filename
+    )
+
+    pf = ProjectFile(
+        contract_id=contract.id,
+        uploader_id=user.id,
+        file_type=file_type,
+        version=version,
+        author=author,
+        original_filename=original_filename,
+        stored_filename=stored_filename,
+        content_hash=content_hash,
+        content_type=content_type,
+        file_size=size,
+        is_public=is_public,
+        owner_role=user.role,
+    )
+
+    db.session.add(pf)
+    db.session.flush()
+
+    # 写入操作日志
+    log_operation(
+        user=user,
+        action='file.upload',
+        target_type='ProjectFile',
+        target_id=pf.id,
+        message=f"上传文件：{original_filename}",
+        extra={
+            "contract_id": contract.id,
+            "file_type": file_type,
+            "version": version,
+            "is_public": is_public,
+            "content_hash": content_hash,
+            "deduplicated": deduplicated,
+            **(extra or {}),
+        },
+    )
+    return pf
+
+
 @contracts_bp.route('/<int:contract_id>/files', methods=['GET', 'POST'])
 @login_required
 def manage_files(contract_id):
     """管理某个项目的文件：上传 / 列表 / 删除"""
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
 
-    # 只显示未删除的文件
-    files = (
-        ProjectFile.query
-        .filter_by(contract_id=contract.id, is_deleted=False)
-        .order_by(ProjectFile.created_at.asc(), ProjectFile.id.asc())
-        .all()
-    )
+    # 只显示未删除的文件；勾选“只看我能下载的”时把下载权限规则直接加进查询条件
+    only_downloadable = request.args.get('downloadable') == '1'
+    files_query = ProjectFile.query.filter_by(contract_id=contract.id, is_deleted=False)
+    if only_downloadable:
+        files_query = files_query.filter(file_download_clause(user))
+    files = files_query.order_by(ProjectFile.created_at.asc(), ProjectFile.id.asc()).all()
 
     if request.method == 'POST':
         if not user:
@@ -2126,80 +2693,330 @@ def manage_files(contract_id):
             flash('请选择要上传的文件')
             return redirect(url_for('contracts.manage_files', contract_id=contract.id))
 
-        # 对图纸 file_type='drawing' 放宽限制，不检查扩展名
-        if file_type != 'drawing' and not allowed_file(uploaded_file.filename):
-            flash('不支持的文件类型（非图纸文件请使用常见文档/图片格式）')
-            return redirect(url_for('contracts.manage_files', contract_id=contract.id))
-
-        # 校验角色是否允许上传这种类型
-        allowed_types = get_role_allowed_types(user)
-        if file_type not in allowed_types:
-            flash('当前角色不允许上传此类型文件')
+        error = _check_upload_fields(user, uploaded_file.filename, file_type)
+        if error:
+            flash(error)
             return redirect(url_for('contracts.manage_files', contract_id=contract.id))
 
         # 文件是否公开：只允许合同/技术文档可公开
-        is_public = False
-        if is_public_raw == 'y' and file_type in ('contract', 'tech'):
-            is_public = True
-
-        original_filename = uploaded_file.filename
-        author = user.username  # 如果你实际字段叫 name，就改成 user.name
-        stored_filename = generate_file_name(
-            contract, file_type, version, author, original_filename
+        is_public = is_public_raw == 'y' and file_type in ('contract', 'tech')
+
+        # 内容按 SHA-256 存入 blob 存储，相同内容只存一份
+        blob = store_stream(uploaded_file.stream, current_app.config['UPLOAD_FOLDER'])
+
+        pf = _add_project_file(
+            contract, user,
+            file_type=file_type,
+            version=version,
+            is_public=is_public,
+            original_filename=uploaded_file.filename,
+            content_type=uploaded_file.mimetype,
+            content_hash=blob.content_hash,
+            size=blob.size,
+            deduplicated=blob.deduplicated,
         )
+        db.session.commit()
+        _enqueue_preview(pf)
+
+        flash('文件上传成功')
+        return redirect(url_for('contracts.manage_files', contract_id=contract.id))
 
+    # GET：展示列表 & 上传表单
+    # 能生成缩略图的文件：{文件 ID: 缓存键}，键放进 URL 里，内容变了 URL 也跟着变
+    previews = {}
+    if get_preview_renderer(current_app) is not None:
         upload_folder = current_app.config['UPLOAD_FOLDER']
-        os.makedirs(upload_folder, exist_ok=True)
-        filepath = os.path.join(upload_folder, stored_filename)
+        for f in files:
+            if preview_kind(f):
+                key = preview_key(upload_folder, f)
+                if key:
+                    previews[f.id] = key[:16]
+
+    return render_template(
+        'contracts/files.html',
+        user=user,
+        contract=contract,
+        files=files,
+        previews=previews,
+        downloadable=evaluate_file_downloads(user, files),
+        only_downloadable=only_downloadable,
+    )
+
+
+# 分块上传（大文件、可断点续传；协议说明见 services/chunked_upload）
+
+def _upload_status(contract: Contract, upload: UploadSession) -> dict:
+    return dict(
+        upload_id=upload.id,
+        offset=upload.received,
+        total_size=upload.total_size,
+        chunk_size=current_app.config['UPLOAD_CHUNK_SIZE'],
+        chunk_url=url_for('contracts.upload_chunk', contract_id=contract.id, upload_id=upload.id),
+        finalize_url=url_for('contracts.finalize_chunked_upload', contract_id=contract.id, upload_id=upload.id),
+    )
 
-        uploaded_file.save(filepath)
 
-        file_size = os.path.getsize(filepath)
-        content_type = uploaded_file.mimetype
+def _upload_error(error: UploadError):
+    return jsonify(error=str(error), **error.payload), error.status
 
-        pf = ProjectFile(
+
+def _get_upload_session(contract: Contract, upload_id: str, user: CurrentUser) -> UploadSession:
+    """只有发起上传的用户本人可以继续 / 完成这个上传"""
+    upload = UploadSession.query.filter_by(id=upload_id, contract_id=contract.id).first_or_404()
+    if not user or upload.uploader_id != user.id:
+        abort(403)
+    return upload
+
+
+@contracts_bp.route('/<int:contract_id>/files/uploads', methods=['POST'])
+@login_required
+def initiate_chunked_upload(contract_id):
+    """发起分块上传：提交文件元数据，返回 upload_id 和后续接口地址"""
+    user = get_current_user()
+    contract = Contract.query.get_or_404(contract_id)
+
+    data = request.get_json(silent=True) or request.form
+    filename = (data.get('filename') or '').strip()
+    file_type = (data.get('file_type') or '').strip()
+    version = (data.get('version') or '').strip() or 'V1'
+    try:
+        total_size = int(data.get('size'))
+    except (TypeError, ValueError):
+        total_size = None
+
+    if not filename:
+        return jsonify(error='缺少文件名'), 400
+    error = _check_upload_fields(user, filename, file_type)
+    if error:
+        return jsonify(error=error), 400
+
+    is_public = data.get('is_public') in ('y', True) and file_type in ('contract', 'tech')
+    try:
+        upload = create_upload_session(
+            current_app.config['UPLOAD_FOLDER'],
+            current_app.config['CHUNKED_UPLOAD_MAX_SIZE'],
             contract_id=contract.id,
             uploader_id=user.id,
             file_type=file_type,
             version=version,
-            author=author,
-            original_filename=original_filename,
-            stored_filename=stored_filename,
-            content_type=content_type,
-            file_size=file_size,
             is_public=is_public,
-            owner_role=user.role,
+            original_filename=filename,
+            content_type=(data.get('content_type') or '').strip() or None,
+            total_size=total_size,
         )
+    except UploadError as e:
+        return _upload_error(e)
+    db.session.commit()
 
-        db.session.add(pf)
-        db.session.flush()
+    return jsonify(_upload_status(contract, upload)), 201
 
-        # 写入操作日志
-        log_operation(
-            user=user,
-            action='file.upload',
-            target_type='ProjectFile',
-            target_id=pf.id,
-            message=f"上传文件：{original_filename}",
-            extra={
-                "contract_id": contract.id,
-                "file_type": file_type,
-                "version": version,
-                "is_public": is_public,
-            },
-        )
 
-        db.session.commit()
+@contracts_bp.route('/<int:contract_id>/files/uploads/<upload_id>', methods=['GET'])
+@login_required
+def chunked_upload_status(contract_id, upload_id):
+    """查询上传进度：断线重连后从返回的 offset 继续上传"""
+    contract = Contract.query.get_or_404(contract_id)
+    upload = _get_upload_session(contract, upload_id, get_current_user())
+    return jsonify(_upload_status(contract, upload))
 
-        flash('文件上传成功')
-        return redirect(url_for('contracts.manage_files', contract_id=contract.id))
 
-    # GET：展示列表 & 上传表单
-    return render_template(
-        'contracts/files.html',
+@contracts_bp.route('/<int:contract_id>/files/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(contract_id, upload_id):
+    """上传一块：?offset=N，请求体为原始字节，直接流式写入暂存文件"""
+    contract = Contract.query.get_or_404(contract_id)
+    upload = _get_upload_session(contract, upload_id, get_current_user())
+
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify(error='缺少 offset', offset=upload.received), 400
+
+    try:
+        write_chunk(current_app.config['UPLOAD_FOLDER'], upload, offset, request.stream)
+    except UploadError as e:
+        return _upload_error(e)
+    return jsonify(_upload_status(contract, upload))
+
+
+@contracts_bp.route('/<int:contract_id>/files/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_chunked_upload(contract_id, upload_id):
+    """完成上传：校验并放入 blob 存储，同一事务里创建 ProjectFile 并删除上传会话"""
+    user = get_current_user()
+    contract = Contract.query.get_or_404(contract_id)
+    upload = _get_upload_session(contract, upload_id, user)
+
+    try:
+        blob = finalize_upload(current_app.config['UPLOAD_FOLDER'], upload)
+    except UploadError as e:
+        return _upload_error(e)
+
+    pf = _add_project_file(
+        contract, user,
+        file_type=upload.file_type,
+        version=upload.version,
+        is_public=upload.is_public,
+        original_filename=upload.original_filename,
+        content_type=upload.content_type,
+        content_hash=blob['content_hash'],
+        size=blob['size'],
+        deduplicated=blob['deduplicated'],
+        extra={"chunked": True},
+    )
+    db.session.delete(upload)
+    db.session.commit()
+    _enqueue_preview(pf)
+
+    return jsonify(
+        file_id=pf.id,
+        content_hash=pf.content_hash,
+        size=pf.file_size,
+        files_url=url_for('contracts.manage_files', contract_id=contract.id),
+    )
+
+
+# 文件缩略图
+
+# 缩略图 URL 带内容版本号（?v=），内容不变 URL 不变，可以长期缓存
+PREVIEW_MAX_AGE = 365 * 24 * 3600
+
+
+@contracts_bp.route('/<int:contract_id>/files/<int:file_id>/preview')
+@login_required
+def file_preview(contract_id, file_id):
+    """
+    返回文件的缩略图（PNG）。
+
+    与下载同样的权限规则，但不写操作日志（列表页每次打开都会请求）。
+    还没有生成时（例如功能上线前上传的文件）排队生成并返回 202，稍后再取。
+    """
+    user = get_current_user()
+    contract = Contract.query.get_or_404(contract_id)
+    pf = ProjectFile.query.filter_by(
+        id=file_id,
+        contract_id=contract.id,
+        is_deleted=False
+    ).first_or_404()
+
+    if not evaluate_file_download(user=user, contract=contract, pf=pf)["allowed"]:
+        abort(403)
+
+    renderer = get_preview_renderer(current_app)
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    key = preview_key(upload_folder, pf) if preview_kind(pf) else None
+    if renderer is None or key is None:
+        abort(404)
+
+    path = preview_path(upload_folder, key)
+    if not os.path.isfile(path):
+        renderer.submit(pf)
+        return Response(status=202, headers={'Retry-After': '2'})
+
+    response = send_file(path, mimetype='image/png', conditional=True, etag=key, max_age=PREVIEW_MAX_AGE)
+    response.cache_control.private = True
+    response.cache_control.public = False
+    response.cache_control.immutable = True
+    return response
+
+
+# 打包下载（ZIP，流式输出）
+
+# 一次最多勾选多少个文件（SQL Server 单条语句参数上限 2100）
+BUNDLE_MAX_SELECTED = 1000
+
+def _iter_file_chunks(path: str):
+    """按块读取文件；文件在真正开始打包这一项时才打开"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(BLOB_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _bundle_arcname(pf: ProjectFile, used: set) -> str:
+    """包内文件名用下载文件名；重名时加序号"""
+    name = pf.stored_filename or pf.original_filename or f'file_{pf.id}'
+    base, dot, ext = name.rpartition('.')
+    if not dot:
+        base, ext = name, ''
+    candidate, n = name, 1
+    while candidate in used:
+        n += 1
+        candidate = f'{base}({n}).{ext}' if dot else f'{base}({n})'
+    used.add(candidate)
+    return candidate
+
+
+@contracts_bp.route('/<int:contract_id>/files/bundle')
+@login_required
+def download_files_bundle(contract_id):
+    """
+    把合同的全部文件（或 ?file_id=1&file_id=2 选中的文件）打包成 ZIP 流式下载。
+
+    按下载权限规则批量判断（evaluate_file_downloads），只打包允许下载的；
+    整次打包只写一条日志（包含打包 / 被拒 / 磁盘缺失的文件 ID）。
+    ZIP 边读边发，不生成临时文件；PDF、图片等已压缩格式原样存储。
+    """
+    user = get_current_user()
+    contract = Contract.query.get_or_404(contract_id)
+
+    query = ProjectFile.query.filter_by(contract_id=contract.id, is_deleted=False)
+    selected_ids = request.args.getlist('file_id', type=int)
+    if selected_ids:
+        query = query.filter(ProjectFile.id.in_(selected_ids[:BUNDLE_MAX_SELECTED]))
+    files = query.order_by(ProjectFile.created_at.asc(), ProjectFile.id.asc()).all()
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    allowed = evaluate_file_downloads(user, files)
+    entries, included, denied, missing = [], [], [], []
+    total_bytes = 0
+    used_names = set()
+    for pf in files:
+        if not allowed[pf.id]:
+            denied.append(pf.id)
+            continue
+        path = file_disk_path(upload_folder, pf)
+        if not os.path.isfile(path):
+            missing.append(pf.id)
+            continue
+        ext = pf.stored_filename.rsplit('.', 1)[-1].lower() if '.' in pf.stored_filename else ''
+        entries.append((
+            _bundle_arcname(pf, used_names),
+            _iter_file_chunks(path),
+            ext not in PRECOMPRESSED_EXTENSIONS,
+        ))
+        included.append(pf.id)
+        total_bytes += pf.file_size or 0
+
+    log_operation(
         user=user,
-        contract=contract,
-        files=files,
+        action='file.bundle_download',
+        target_type='Contract',
+        target_id=contract.id,
+        message=f"打包下载文件：{len(included)} 个",
+        extra={
+            "contract_id": contract.id,
+            "file_ids": included,
+            "denied_file_ids": denied,
+            "missing_file_ids": missing,
+            "total_bytes": total_bytes,
+        },
+    )
+    db.session.commit()
+
+    if not entries:
+        flash('没有可以打包下载的文件')
+        return redirect(url_for('contracts.manage_files', contract_id=contract.id))
+
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return Response(
+        stream_with_context(iter_zip_stream(entries)),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="contract_{contract.id}_files_{stamp}.zip"',
+        },
     )
 
 
@@ -2208,8 +3025,7 @@ def manage_files(contract_id):
 @contracts_bp.route('/<int:contract_id>/files/<int:file_id>/download')
 @login_required
 def download_file(contract_id, file_id):
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
     pf = ProjectFile.query.filter_by(
@@ -2244,42 +3060,75 @@ def download_file(contract_id, file_id):
     #     download_name=pf.stored_filename #  pf.original_filename 用原始文件名下载
     # )
 
-    # 调用 Service 评估权限 + 日志信息
+    # 调用 Service 评估权限 + 日志信息（304 / 206 也必须先通过权限检查）
     result = evaluate_file_download(user=user, contract=contract, pf=pf)
 
-    # 统一写操作日志（不管成功或失败）
+    # 若被拒绝：写日志，提示并返回文件管理页
+    if not result["allowed"]:
+        log_operation(
+            user=user,
+            action=result["log_action"],
+            target_type="ProjectFile",
+            target_id=pf.id,
+            message=result["log_message"],
+            extra=result["log_extra"],
+        )
+        db.session.commit()
+
+        if result["flash_message"]:
+            flash(result["flash_message"])
+        return redirect(url_for("contracts.manage_files", contract_id=contract.id))
+
+    # 允许下载，返回实际文件（blob 存储或历史平铺位置）
+    path = file_disk_path(current_app.config["UPLOAD_FOLDER"], pf)
+    if not os.path.isfile(path):
+        abort(404)
+
+    # conditional=True：处理 If-None-Match / If-Modified-Since（304）和 Range（206）。
+    # 强 ETag 用内容哈希；历史文件没有哈希时用 Flask 默认的 mtime + 大小 + 路径。
+    # Last-Modified 用这条文件记录的上传时间：blob 被多条记录共用，
+    # 而且上传命中已有内容时会刷新它的修改时间（见 blob_store.commit_staged_file）
+    try:
+        response = send_file(
+            path,
+            mimetype=pf.content_type or None,
+            as_attachment=True,
+            download_name=pf.stored_filename,  # 如需用原始名，可改为 pf.original_filename
+            conditional=True,
+            etag=pf.content_hash or True,
+            last_modified=pf.created_at,
+            max_age=0,
+        )
+    except RequestedRangeNotSatisfiable as e:
+        # Range 超出文件大小（416）：没有发送任何内容，按单独的动作记日志
+        response = e.get_response()
+    # 需要登录和权限检查，只允许浏览器缓存，且每次使用前都要带校验头确认
+    response.cache_control.private = True
+    response.cache_control.public = False
+    response.cache_control.no_cache = True
+
+    # 按实际响应写日志：完整下载 / 断点续传 / 未修改 / 范围无效
+    log_extra = dict(result["log_extra"])
+    if response.status_code in (206, 416):
+        log_extra["range"] = request.headers.get("Range")
     log_operation(
         user=user,
-        action=result["log_action"],
+        action=DOWNLOAD_STATUS_ACTIONS.get(response.status_code, result["log_action"]),
         target_type="ProjectFile",
         target_id=pf.id,
         message=result["log_message"],
-        extra=result["log_extra"],
+        extra=log_extra,
     )
     db.session.commit()
 
-    # 若被拒绝，提示并返回文件管理页
-    if not result["allowed"]:
-        if result["flash_message"]:
-            flash(result["flash_message"])
-        return redirect(url_for("contracts.manage_files", contract_id=contract.id))
-
-    # 允许下载，返回实际文件
-    upload_folder = current_app.config["UPLOAD_FOLDER"]
-    return send_from_directory(
-        upload_folder,
-        pf.stored_filename,
-        as_attachment=True,
-        download_name=pf.stored_filename,  # 如需用原始名，可改为 pf.original_filename
-    )
+    return response
 
 # 删除文件（软删除+风险提示）
 
 @contracts_bp.route('/<int:contract_id>/files/<int:file_id>/delete', methods=['POST'])
 @login_required
 def delete_file(contract_id, file_id):
-    user_id = session.get('user_id')
-    user = User.query.get(user_id) if user_id else None
+    user = get_current_user()
 
     contract = Contract.query.get_or_404(contract_id)
     pf = ProjectFile.query.filter_by(
@@ -2314,6 +3163,7 @@ def delete_file(contract_id, file_id):
     #     return redirect(url_for('contracts.manage_files', contract_id=contract.id))
 
     pf.is_deleted = True
+    pf.deleted_at = datetime.utcnow()
 
     # 写入软删除日志
     log_operation(
@@ -59,6 +59,10 @@ class Contract(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     created_by = db.relationship('User', backref='contracts')
 
+    # 删除标记（墓碑）：非空表示合同已删除，所有查询自动忽略；
+    # 子记录和磁盘文件由后台分批清理，清理完才真正删除本行（见 services/contract_purge）
+    deleted_at = db.Column(db.DateTime, index=True)
+
 
 class Department(db.Model):
     __tablename__ = 'departments'
@@ -274,13 +278,16 @@ class ProjectFile(db.Model):
 
     # 文件原始名（用户电脑上的名称）
     original_filename = db.Column(db.String(255), nullable=False)
-    # 系统生成的安全文件名（磁盘上的文件名，包含我们设计的命名规则）
+    # 系统生成的安全文件名（包含我们设计的命名规则）；用作下载时的文件名。
+    # 历史文件（content_hash 为空）仍以这个名字平铺保存在 UPLOAD_FOLDER
     stored_filename = db.Column(db.String(255), nullable=False)
+    # 文件内容的 SHA-256（十六进制），对应 blob 存储里的 ab/cd/<hash>，见 services/blob_store
+    content_hash = db.Column(db.String(64), index=True)
 
     # MIME 类型（如 application/pdf）
     content_type = db.Column(db.String(100))
-    # 文件大小（字节）
-    file_size = db.Column(db.Integer)
+    # 文件大小（字节）；BigInteger：超过 2 GiB 的文件（已有数据库由 flask schema upgrade 放宽）
+    file_size = db.Column(db.BigInteger)
 
     # 是否公开给客户下载（只对合同/技术文档生效）
     is_public = db.Column(db.Boolean, default=False)
@@ -290,6 +297,8 @@ class ProjectFile(db.Model):
 
     # 软删除标记
     is_deleted = db.Column(db.Boolean, default=False)
+    # 软删除时间：超过宽限期后由 flask files gc 回收磁盘文件（见 services/file_gc）
+    deleted_at = db.Column(db.DateTime)
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -297,9 +306,108 @@ class ProjectFile(db.Model):
     contract = db.relationship('Contract', backref='files')
     uploader = db.relationship('User', backref='uploaded_files')
 
+class UploadSession(db.Model):
+    """分块上传（可断点续传）的会话：数据先写入暂存文件，完成（finalize）时才生成 ProjectFile。
+
+    见 services/chunked_upload。完成后删除本行；长时间没有进展的会话由
+    flask files gc-uploads 连同暂存文件一起清理。
+    """
+    __tablename__ = 'upload_sessions'
+
+    # 随机令牌（uuid4 hex），同时作为暂存文件名的一部分
+    id = db.Column(db.String(32), primary_key=True)
+
+    contract_id = db.Column(db.Integer, db.ForeignKey('contracts.id'), nullable=False, index=True)
+    uploader_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    # 完成时写入 ProjectFile 的元数据（发起上传时就校验过）
+    file_type = db.Column(db.String(50), nullable=False)
+    version = db.Column(db.String(20))
+    is_public = db.Column(db.Boolean, default=False)
+    original_filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(100))
+
+    # 文件总字节数 / 已确认写入的字节数（下一块必须从这里开始）
+    total_size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, nullable=False, default=0)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+
+class ContractPurge(db.Model):
+    """已删除合同的后台清理进度：每个合同一行，按 stage 顺序逐张表分批删除子记录（见 services/contract_purge）。
+
+    每批删除和进度在同一事务里提交，中断后从 stage 继续；
+    locked_by / locked_until 是租约，多个进程同时运行时同一合同只有一个在清理。
+    """
+    __tablename__ = 'contract_purges'
+
+    # 不加外键：清理的最后一步会删除合同本身，本行保留作为记录
+    contract_id = db.Column(db.Integer, primary_key=True)
+
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+    requested_by_id = db.Column(db.Integer)
+
+    # 当前清理到的表（见 contract_purge.PURGE_STEPS），全部完成后为 done
+    stage = db.Column(db.String(50), nullable=False, default='')
+    rows_deleted = db.Column(db.Integer, nullable=False, default=0)
+    files_removed = db.Column(db.Integer, nullable=False, default=0)
+    bytes_freed = db.Column(db.BigInteger, nullable=False, default=0)
+
+    locked_by = db.Column(db.String(32))
+    locked_until = db.Column(db.DateTime)
+
+    last_error = db.Column(db.String(255))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, index=True)
+
+
+class FileScrubFinding(db.Model):
+    """完整性巡检发现的问题：每个文件只保留最近一次的问题，复查通过后删除（见 services/file_scrub）"""
+    __tablename__ = 'file_scrub_findings'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # 不加外键：删除合同时整批删除文件记录，不受巡检结果牵连
+    file_id = db.Column(db.Integer, nullable=False, unique=True)
+
+    # missing（文件不存在）/ size_mismatch（大小不符）/ hash_mismatch（内容哈希不符）/ error（读取出错）
+    status = db.Column(db.String(20), nullable=False, index=True)
+
+    expected_size = db.Column(db.BigInteger)
+    actual_size = db.Column(db.BigInteger)
+    expected_hash = db.Column(db.String(64))
+    actual_hash = db.Column(db.String(64))
+    message = db.Column(db.String(255))
+
+    # 第一次发现 / 最近一次确认的时间
+    first_seen_at = db.Column(db.DateTime, default=datetime.utcnow)
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class FileScrubState(db.Model):
+    """完整性巡检的断点：按文件 ID 顺序巡检，每批提交后记下最后一个 ID，下次从这里继续"""
+    __tablename__ = 'file_scrub_state'
+
+    # 固定一行：'default'
+    name = db.Column(db.String(20), primary_key=True)
+
+    last_file_id = db.Column(db.Integer, nullable=False, default=0)
+    # 本轮开始时间 / 上一轮完整跑完的时间
+    pass_started_at = db.Column(db.DateTime)
+    last_completed_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 class OperationLog(db.Model):
     """操作审计日志：记录谁在什么时候对什么做了什么事情"""
     __tablename__ = 'operation_logs'
+    __table_args__ = (
+        # 按合同查日志（合同日志页）
+        db.Index('ix_operation_logs_contract_created', 'contract_id', 'created_at'),
+        # 按目标对象查日志
+        db.Index('ix_operation_logs_target_created', 'target_type', 'target_id', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -315,6 +423,16 @@ class OperationLog(db.Model):
     # 目标主键 ID
     target_id = db.Column(db.Integer, nullable=True)
 
+    # 所属合同 ID（合同本身及其下任务 / 付款 / 文件等子记录的日志都会填）
+    # 不加外键：合同删除后日志仍要保留
+    contract_id = db.Column(db.Integer, nullable=True)
+
+    # 以下字段从 extra 里提取出来单独存一份，便于按字段检索（走索引）
+    project_code = db.Column(db.String(100), nullable=True, index=True)
+    contract_number = db.Column(db.String(100), nullable=True, index=True)
+    file_type = db.Column(db.String(50), nullable=True, index=True)
+    amount = db.Column(db.Numeric(14, 2), nullable=True, index=True)
+
     # 简单说明（便于人类阅读）
     message = db.Column(db.String(500), nullable=True)
 
@@ -326,3 +444,86 @@ class OperationLog(db.Model):
     user = db.relationship('User', backref='operation_logs')
 
 
+class ContractRollup(db.Model):
+    """合同汇总表：每个合同一行，缓存子记录计数、状态标志、派生状态和金额合计。
+
+    由 services/rollup_service 在同一事务中随子记录的增删改自动维护，
+    列表页据此在 SQL 里按状态筛选/排序；如有漂移可用 `flask rollups rebuild` 修复。
+    """
+    __tablename__ = 'contract_rollups'
+
+    contract_id = db.Column(db.Integer, db.ForeignKey('contracts.id'), primary_key=True)
+
+    # 子记录计数
+    tasks_count = db.Column(db.Integer, nullable=False, default=0)
+    acceptances_count = db.Column(db.Integer, nullable=False, default=0)
+    payments_count = db.Column(db.Integer, nullable=False, default=0)
+    invoices_count = db.Column(db.Integer, nullable=False, default=0)
+    refunds_count = db.Column(db.Integer, nullable=False, default=0)
+    feedbacks_count = db.Column(db.Integer, nullable=False, default=0)
+
+    # 状态标志
+    has_accepted = db.Column(db.Boolean, nullable=False, default=False)
+    has_unresolved_feedback = db.Column(db.Boolean, nullable=False, default=False)
+
+    # 派生状态：文本 / 颜色级别 / 排序序号（与按状态文本排序的结果一致）
+    status_text = db.Column(db.String(50), nullable=False, default='未启动', index=True)
+    status_level = db.Column(db.String(20), nullable=False, default='grey')
+    status_sort = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+    # 金额合计
+    paid_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    refund_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    invoiced_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    contract = db.relationship(
+        'Contract',
+        backref=db.backref('rollup', uselist=False)
+    )
+
+
+class SearchGram(db.Model):
+    """子串检索用的 n-gram 索引：把公司名 / 项目编号 / 合同编号 / 人员姓名拆成二元组存表。
+
+    `%关键字%` 模糊匹配无法走索引，这里先按二元组在索引表里找出候选 ID，
+    再对少量候选行做 ilike 精确校验。由 services/search_index 随增删改自动维护。
+    """
+    __tablename__ = 'search_ngrams'
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # 实体类型：Company / Contract / Person / OperationLog
+    entity_type = db.Column(db.String(20), nullable=False)
+    # 实体主键 ID
+    entity_id = db.Column(db.Integer, nullable=False)
+    # 字段名：name / project_code / contract_number / message
+    field = db.Column(db.String(30), nullable=False)
+    # 二元组（统一转小写）
+    gram = db.Column(db.String(8), nullable=False)
+
+    __table_args__ = (
+        # 检索：按 (类型, 字段, 二元组) 找实体
+        db.Index('ix_search_ngrams_lookup', 'entity_type', 'field', 'gram', 'entity_id'),
+        # 维护：按实体删除旧索引
+        db.Index('ix_search_ngrams_entity', 'entity_type', 'entity_id'),
+    )
+
+
+class SearchIndexState(db.Model):
+    """后台批量建索引的进度：操作日志说明的 n-gram 索引不在写日志时同步维护，
+    由 services/search_index.index_operation_logs 按 ID 顺序分批补建，这里记录已建到的最大 ID。
+    """
+    __tablename__ = 'search_index_state'
+
+    # 固定一行：'OperationLog'
+    name = db.Column(db.String(30), primary_key=True)
+
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    # 已“落定”的最大 ID：不超过它的日志要么已提交、要么已回滚，不会再有新行出现
+    settled_id = db.Column(db.Integer)
+    # 上次观察到的最大 ID 及观察时间：过了宽限期后成为新的 settled_id
+    pending_id = db.Column(db.Integer)
+    pending_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
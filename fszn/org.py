@@ -8,8 +8,9 @@ from flask import (
 )
 
 from . import db
-from .models import User, Department, Person, ProjectDepartmentLeader, Task, Acceptance, Feedback, SalesInfo
-from .auth import login_required, staff_required
+from .models import Department, Person, ProjectDepartmentLeader, Task, Acceptance, Feedback, SalesInfo
+from .auth import login_required, staff_required, get_current_user
+from .services.reference_cache import bump_reference_version
 
 
 org_bp = Blueprint('org', __name__)
@@ -29,10 +30,7 @@ def login_required(view):
 @staff_required
 def list_departments():
     """部门列表"""
-    user = None
-    user_id = session.get('user_id')
-    if user_id:
-        user = User.query.get(user_id)
+    user = get_current_user()
 
     departments = Department.query.order_by(Department.id.asc()).all()
 
@@ -47,10 +45,7 @@ def list_departments():
 @staff_required
 def new_department():
     """新增部门"""
-    user = None
-    user_id = session.get('user_id')
-    if user_id:
-        user = User.query.get(user_id)
+    user = get_current_user()
 
     if request.method == 'POST':
         name = (request.form.get('name') or '').strip()
@@ -66,6 +61,7 @@ def new_department():
         dept = Department(name=name)
         db.session.add(dept)
         db.session.commit()
+        bump_reference_version()  # 下拉框缓存作废
 
         flash('部门已创建')
         return redirect(url_for('org.list_departments'))
@@ -77,10 +73,7 @@ def new_department():
 @staff_required
 def list_persons():
     """人员列表"""
-    user = None
-    user_id = session.get('user_id')
-    if user_id:
-        user = User.query.get(user_id)
+    user = get_current_user()
 
     persons = (
         Person.query
@@ -107,10 +100,7 @@ def list_persons():
 @staff_required
 def edit_person(person_id):
     """编辑人员信息"""
-    user = None
-    user_id = session.get('user_id')
-    if user_id:
-        user = User.query.get(user_id)
+    user = get_current_user()
 
     person = Person.query.get_or_404(person_id)
     departments = (
@@ -138,6 +128,8 @@ def edit_person(person_id):
         person.department_id = int(dept_id) if dept_id else None
 
         db.session.commit()
+
+        bump_reference_version()  # 下拉框缓存作废
         flash('人员信息已更新')
         return redirect(url_for('org.list_persons'))
 
@@ -156,10 +148,7 @@ def edit_person(person_id):
 @staff_required
 def new_person():
     """新增人员"""
-    user = None
-    user_id = session.get('user_id')
-    if user_id:
-        user = User.query.get(user_id)
+    user = get_current_user()
 
     # 所有部门列表，用于下拉框
     departments = (
@@ -190,6 +179,7 @@ def new_person():
         )
         db.session.add(person)
         db.session.commit()
+        bump_reference_version()  # 下拉框缓存作废
 
         flash('人员已创建')
         return redirect(url_for('org.list_persons'))
@@ -217,6 +207,7 @@ def delete_department(dept_id):
 
     db.session.delete(dept)
     db.session.commit()
+    bump_reference_version()  # 下拉框缓存作废
     flash('部门已删除')
     return redirect(url_for('org.list_departments'))
 
@@ -242,5 +233,6 @@ def delete_person(person_id):
 
     db.session.delete(person)
     db.session.commit()
+    bump_reference_version()  # 下拉框缓存作废
     flash('人员已删除')
     return redirect(url_for('org.list_persons'))
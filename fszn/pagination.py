@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+分页相关的小工具：keyset（seek）分页的游标编码 + 查询条件构造。
+
+keyset 分页按 (排序列, id) 定位“上一页最后一行”，下一页直接
+WHERE (排序列, id) 在它之后，不再使用 OFFSET，翻到多深的页成本都一样。
+
+约定：
+- 排序列允许为 NULL，按 SQL Server 的规则，NULL 视为最小值
+  （升序排在最前，降序排在最后）；
+- id 作为并列时的第二排序键，方向与排序列一致。
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+from datetime import date, datetime
+from typing import Any, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(value: Any, row_id: int) -> str:
+    """把 (排序值, id) 编码成 URL 安全的游标字符串"""
+    if isinstance(value, datetime):
+        raw = ['dt', value.isoformat()]
+    elif isinstance(value, date):
+        raw = ['d', value.isoformat()]
+    elif value is None:
+        raw = ['n', None]
+    else:
+        raw = ['v', value]
+    payload = json.dumps([raw, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str | None) -> Optional[Tuple[Any, int]]:
+    """解析游标字符串，格式不对时返回 None（当作没有游标）"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        (kind, raw), row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if kind == 'dt':
+            value = datetime.fromisoformat(raw)
+        elif kind == 'd':
+            value = date.fromisoformat(raw)
+        elif kind == 'n':
+            value = None
+        else:
+            value = raw
+        return value, int(row_id)
+    except Exception:
+        return None
+
+
+def seek_condition(sort_col, id_col, value: Any, row_id: int, descending: bool):
+    """
+    构造“位于 (value, row_id) 之后”的 WHERE 条件。
+
+    descending=True 表示按 (sort_col DESC, id DESC) 排序，否则为升序。
+    """
+    if descending:
+        if value is None:
+            # NULL 在降序中排最后：之后只剩同为 NULL、id 更小的行
+            return and_(sort_col.is_(None), id_col < row_id)
+        return or_(
+            sort_col < value,
+            and_(sort_col == value, id_col < row_id),
+            sort_col.is_(None),
+        )
+
+    if value is None:
+        # NULL 在升序中排最前：之后是同为 NULL、id 更大的行，以及所有非 NULL 行
+        return or_(
+            and_(sort_col.is_(None), id_col > row_id),
+            sort_col.isnot(None),
+        )
+    return or_(
+        sort_col > value,
+        and_(sort_col == value, id_col > row_id),
+    )
+
+
+def seek_order_by(sort_col, id_col, descending: bool):
+    """与 seek_condition 配套的 ORDER BY 子句列表"""
+    if descending:
+        return [sort_col.desc(), id_col.desc()]
+    return [sort_col.asc(), id_col.asc()]
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+数据库结构补齐（项目没有引入迁移工具时使用）。
+
+upgrade_schema() 对比模型定义和数据库现状，只做“加法”：
+- 缺少的表：直接创建；
+- 已有表缺少的列：ALTER TABLE ... ADD（新增列必须允许为空或带默认值）；
+- 缺少的索引：创建；
+- 模型里已改成 BigInteger、数据库里还是 INT 的列：放宽为 BIGINT
+  （比如文件大小超过 2 GiB；SQLite 的 INTEGER 本来就是 64 位，不用改）。
+不会删除已有的表 / 列 / 索引，也不会收窄列类型，可以重复执行。
+
+命令行：flask schema upgrade
+"""
+
+from __future__ import annotations
+
+from typing import Dict, List
+
+from sqlalchemy import inspect
+from sqlalchemy import types as sqltypes
+from sqlalchemy.schema import CreateColumn
+
+from . import db
+
+
+def needs_widening(reflected_type, column) -> bool:
+    """数据库里是 INT（或更窄的整数），模型里是 BigInteger"""
+    return (
+        isinstance(column.type, sqltypes.BigInteger)
+        and isinstance(reflected_type, sqltypes.Integer)
+        and not isinstance(reflected_type, sqltypes.BigInteger)
+    )
+
+
+def widen_column_sql(dialect, table_name: str, column) -> str:
+    """把已有列改成模型里的类型（保持原有的可空性）；不支持的数据库返回空串"""
+    col_type = column.type.compile(dialect=dialect)
+    if dialect.name == 'mssql':
+        null = 'NULL' if column.nullable else 'NOT NULL'
+        return f'ALTER TABLE {table_name} ALTER COLUMN {column.name} {col_type} {null}'
+    if dialect.name == 'postgresql':
+        return f'ALTER TABLE {table_name} ALTER COLUMN {column.name} TYPE {col_type}'
+    if dialect.name in ('mysql', 'mariadb'):
+        null = 'NULL' if column.nullable else 'NOT NULL'
+        return f'ALTER TABLE {table_name} MODIFY COLUMN {column.name} {col_type} {null}'
+    return ''
+
+
+def upgrade_schema() -> Dict[str, List[str]]:
+    """补齐缺少的表 / 列 / 索引、放宽整数列，返回做了哪些改动"""
+    changes: Dict[str, List[str]] = dict(tables=[], columns=[], indexes=[], types=[])
+    metadata = db.metadata
+
+    with db.engine.begin() as conn:
+        insp = inspect(conn)
+        existing_tables = set(insp.get_table_names())
+
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                table.create(conn)
+                changes['tables'].append(table.name)
+                continue
+
+            existing_cols = {c['name']: c for c in insp.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_cols:
+                    if needs_widening(existing_cols[column.name]['type'], column):
+                        sql = widen_column_sql(conn.dialect, table.name, column)
+                        if sql:
+                            conn.exec_driver_sql(sql)
+                            changes['types'].append(f'{table.name}.{column.name}')
+                    continue
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD {ddl}')
+                changes['columns'].append(f'{table.name}.{column.name}')
+
+            existing_indexes = {ix['name'] for ix in insp.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    changes['indexes'].append(index.name)
+
+    return changes
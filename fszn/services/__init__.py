@@ -11,6 +11,7 @@ get_contract_finance_summary 等。
 
 from .finance_service import (
     get_contract_finance_summary,
+    get_finance_summaries,
     create_payment,
     delete_payment,
     create_invoice,
@@ -21,7 +22,9 @@ from .finance_service import (
 
 from .file_service import (
     evaluate_file_download,
+    evaluate_file_downloads,
     evaluate_file_delete,
+    file_download_clause,
 )
 
 from .task_service import (
@@ -29,3 +32,19 @@ from .task_service import (
     update_task,
     delete_task,
 )
+
+from .status_service import (
+    get_contract_statuses,
+    get_contract_status_flags,
+    derive_contract_status,
+)
+
+from .overview_service import (
+    get_contract_overview,
+)
+
+from .reference_cache import (
+    get_department_choices,
+    get_person_choices,
+    bump_reference_version,
+)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+操作日志（OperationLog）的异步批量写入。
+
+设计目的：
+- 原来 log_operation 把日志加进当前请求的 Session，随业务一起 commit；
+  下载文件这类高频接口，每次都要先同步写一条审计日志才能开始发送文件；
+- 开启 AUDIT_ASYNC 后，log_operation 只把日志放进进程内的有界队列，
+  由后台线程按批（AUDIT_BATCH_SIZE 条 / AUDIT_FLUSH_INTERVAL 秒）批量插入；
+- 需要和业务数据同一事务的动作（见 SYNC_ACTIONS，例如删除合同），
+  以及调用方显式传 sync=True 的，仍然走同步写入；
+- 队列满时不丢日志，退回同步写入当前 Session，并计入 overflow；
+  后台批量写入失败的条数计入 dropped（同时写错误日志）；
+- 进程退出时（atexit）把队列里剩余的日志写完；
+- 每批写入后顺便给新日志的说明补建 n-gram 索引（见 search_index.index_operation_logs），
+  索引的写入成本也留在后台线程里。
+
+默认关闭（AUDIT_ASYNC=False），行为与原来完全一致。
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import queue
+import threading
+from typing import Dict, List, Optional
+
+from .. import db
+from ..models import OperationLog
+from .search_index import index_operation_logs
+
+
+# 必须与业务数据同一事务写入的动作
+SYNC_ACTIONS = frozenset({
+    'contract.delete',
+})
+
+# 队列里的结束标记
+_STOP = object()
+
+
+class AuditWriter:
+    """有界队列 + 后台线程的批量日志写入器（每个 app 一个）"""
+
+    def __init__(self, app, queue_size: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 1.0):
+        self.app = app
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = dict(enqueued=0, written=0, overflow=0, dropped=0, batches=0)
+
+    # ---------- 对外接口 ----------
+
+    def submit(self, row: Dict) -> bool:
+        """放入一条日志（OperationLog 的字段字典）；队列已满返回 False"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('overflow')
+            return False
+        self._count('enqueued')
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待当前队列里的日志全部写完（timeout 秒内写完返回 True）。
+
+        相当于带超时的 queue.join()：在队列自带的条件变量上等待，
+        后台线程每写完一批调用 task_done 时唤醒，不另起线程。
+        """
+        if self._thread is None:
+            return True
+        q = self._queue
+        with q.all_tasks_done:
+            return q.all_tasks_done.wait_for(lambda: q.unfinished_tasks == 0, timeout)
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        """停止后台线程；停止前把队列里剩余的日志写完"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """计数：enqueued / written / overflow / dropped / batches，以及当前积压 backlog"""
+        with self._stats_lock:
+            result = dict(self._stats)
+        result['backlog'] = self._queue.qsize()
+        return result
+
+    # ---------- 内部实现 ----------
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[key] += n
+
+    def _ensure_started(self) -> None:
+        # fork 出来的子进程（如 gunicorn --preload）没有父进程的线程，需要重新启动
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        stopping = False
+        while True:
+            try:
+                if stopping:
+                    item = self._queue.get_nowait()
+                else:
+                    item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if stopping:
+                    return
+                continue
+
+            # 尽量凑满一批再写
+            items = [item]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            rows = [i for i in items if i is not _STOP]
+            if rows:
+                self._write(rows)
+            for _ in items:
+                self._queue.task_done()
+
+            # 收到停止标记：继续把队列里剩下的写完再退出
+            if len(rows) != len(items):
+                stopping = True
+
+    def _write(self, rows: List[Dict]) -> None:
+        with self.app.app_context():
+            try:
+                db.session.add_all([OperationLog(**row) for row in rows])
+                db.session.commit()
+                self._count('written', len(rows))
+                self._count('batches')
+            except Exception:
+                db.session.rollback()
+                self._count('dropped', len(rows))
+                self.app.logger.exception('操作日志批量写入失败，丢弃 %d 条', len(rows))
+                db.session.remove()
+                return
+            try:
+                index_operation_logs()
+            except Exception:
+                # 索引只是加速检索，失败了下次再补
+                db.session.rollback()
+                self.app.logger.exception('操作日志说明索引补建失败')
+            finally:
+                db.session.remove()
+
+
+def init_audit_writer(app) -> Optional[AuditWriter]:
+    """在 create_app 中调用：配置开启 AUDIT_ASYNC 时创建写入器并注册退出时刷新"""
+    if not app.config.get('AUDIT_ASYNC'):
+        return None
+    writer = AuditWriter(
+        app,
+        queue_size=app.config.get('AUDIT_QUEUE_SIZE', 10000),
+        batch_size=app.config.get('AUDIT_BATCH_SIZE', 200),
+        flush_interval=app.config.get('AUDIT_FLUSH_INTERVAL', 1.0),
+    )
+    app.extensions['audit_writer'] = writer
+    atexit.register(writer.shutdown)
+    return writer
+
+
+def get_audit_writer(app) -> Optional[AuditWriter]:
+    """当前 app 的异步写入器；未开启异步时返回 None"""
+    return app.extensions.get('audit_writer')
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+项目文件的内容寻址存储（content-addressed blob store）。
+
+设计目的：
+- 原来每次上传都按 generate_file_name 生成的长文件名平铺保存在 UPLOAD_FOLDER，
+  同一天同名上传会互相覆盖；同一份图纸传到多个项目会在磁盘上存多份；
+- 现在文件内容按 SHA-256 存放：UPLOAD_FOLDER/blobs/ab/cd/<hash>，
+  相同内容只存一份，ProjectFile.content_hash 指向它；
+  生成的文件名（stored_filename）只作为元数据和下载时的文件名。
+
+写入流程（store_stream）：
+- 边读上传流边算哈希，写入同一文件系统下的临时文件（blobs/tmp/），fsync；
+- 目标已存在：删除临时文件（去重）；否则 os.replace 原子改名到目标位置。
+  两个请求同时上传相同内容时，后改名的会覆盖成同样的内容，结果一致。
+
+历史文件（content_hash 为空，仍在 UPLOAD_FOLDER 平铺）：
+- file_disk_path 兼容两种位置；
+- migrate_legacy_files 把它们复制进 blob 存储并补上 content_hash
+  （命令行：flask files migrate-blobs），旧文件留给后续清理。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+from collections import namedtuple
+from typing import BinaryIO, Dict
+
+from .. import db
+from ..models import ProjectFile
+
+
+# 每次从上传流读取 / 写入的字节数
+CHUNK_SIZE = 1024 * 1024
+
+BLOB_DIRNAME = 'blobs'
+TMP_DIRNAME = 'tmp'
+
+# store_stream 的返回值：哈希、字节数、是否与已有内容重复
+StoredBlob = namedtuple('StoredBlob', 'content_hash size deduplicated')
+
+
+def blob_root(upload_folder: str) -> str:
+    return os.path.join(upload_folder, BLOB_DIRNAME)
+
+
+def blob_relpath(content_hash: str) -> str:
+    """ab/cd/<hash>：两级分片，避免单个目录下文件过多"""
+    return os.path.join(content_hash[:2], content_hash[2:4], content_hash)
+
+
+def blob_path(upload_folder: str, content_hash: str) -> str:
+    return os.path.join(blob_root(upload_folder), blob_relpath(content_hash))
+
+
+def file_disk_path(upload_folder: str, pf: ProjectFile) -> str:
+    """文件在磁盘上的实际位置：有 content_hash 的在 blob 存储，历史文件在 UPLOAD_FOLDER 平铺"""
+    if pf.content_hash:
+        return blob_path(upload_folder, pf.content_hash)
+    return os.path.join(upload_folder, pf.stored_filename)
+
+
+def _staging_dir(upload_folder: str) -> str:
+    path = os.path.join(blob_root(upload_folder), TMP_DIRNAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def commit_staged_file(upload_folder: str, tmp_path: str, content_hash: str) -> bool:
+    """
+    把已写完、已算好哈希的临时文件放到 blob 位置。
+
+    返回 True 表示内容已存在（临时文件被删除，去重）；
+    临时文件必须和 blob 存储在同一文件系统上（os.replace 才是原子的）。
+    """
+    dest = blob_path(upload_folder, content_hash)
+    if os.path.exists(dest):
+        os.remove(tmp_path)
+        # 刷新修改时间：空间回收只删除宽限期内没动过的 blob，
+        # 避免在新记录提交之前，把刚被复用的“孤儿” blob 删掉。
+        # 下载时的 Last-Modified 取文件记录的上传时间，不受这里影响
+        try:
+            os.utime(dest)
+        except FileNotFoundError:
+            pass
+        return True
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    os.replace(tmp_path, dest)
+    return False
+
+
+def store_stream(stream: BinaryIO, upload_folder: str) -> StoredBlob:
+    """边写临时文件边计算 SHA-256，写完后放入 blob 存储"""
+    digest = hashlib.sha256()
+    size = 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=_staging_dir(upload_folder), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+
+        content_hash = digest.hexdigest()
+        deduplicated = commit_staged_file(upload_folder, tmp_path, content_hash)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return StoredBlob(content_hash, size, deduplicated)
+
+
+def migrate_legacy_files(upload_folder: str, batch_size: int = 200) -> Dict[str, int]:
+    """
+    把 content_hash 为空的历史文件复制进 blob 存储并补上 content_hash。
+
+    按 ID 分批处理，每批提交一次，可以重复执行；磁盘上找不到的文件计入 missing。
+    返回 dict(migrated=..., deduplicated=..., missing=...)。
+    """
+    result = dict(migrated=0, deduplicated=0, missing=0)
+    last_id = 0
+    while True:
+        files = (
+            ProjectFile.query
+            .filter(ProjectFile.content_hash.is_(None), ProjectFile.id > last_id)
+            .order_by(ProjectFile.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not files:
+            break
+
+        for pf in files:
+            legacy_path = os.path.join(upload_folder, pf.stored_filename)
+            if not os.path.isfile(legacy_path):
+                result['missing'] += 1
+                continue
+            with open(legacy_path, 'rb') as src:
+                blob = store_stream(src, upload_folder)
+            pf.content_hash = blob.content_hash
+            pf.file_size = blob.size
+            result['migrated'] += 1
+            if blob.deduplicated:
+                result['deduplicated'] += 1
+
+        db.session.commit()
+        last_id = files[-1].id
+
+    return result
+
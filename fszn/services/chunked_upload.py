@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+大文件分块上传（可断点续传）。
+
+协议（视图见 contracts.py 的 /<contract_id>/files/uploads...）：
+    1）发起：POST，带文件名 / 总大小 / 文件类型等元数据，返回 upload_id；
+    2）上传块：PUT ?offset=N，请求体就是这一块的原始字节；
+       offset 必须等于服务端已确认的字节数，否则返回 409 和正确的 offset；
+    3）查询进度：GET，返回已确认的 offset（断线后从这里继续）；
+    4）完成：POST .../finalize，校验大小、计算 SHA-256，放入 blob 存储，
+       在同一个事务里创建 ProjectFile、写日志、删除上传会话。
+
+设计要点：
+- 每块直接从 request.stream 按 CHUNK_SIZE 读出写入暂存文件，不在内存里拼整块；
+  单块大小受 MAX_CONTENT_LENGTH 限制，整个文件的上限是 CHUNKED_UPLOAD_MAX_SIZE；
+- 暂存文件放在 blob 存储的 tmp 目录（同一文件系统），完成时 os.replace 原子改名；
+- 只有整块写完并 fsync 之后才推进 received，中途断开的半块会被下一次重传覆盖；
+- 超过 UPLOAD_SESSION_TTL_HOURS 没有进展的会话及其暂存文件由
+  purge_stale_uploads 清理（命令行：flask files gc-uploads）。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import BinaryIO, Dict
+
+from .. import db
+from ..models import UploadSession
+from .blob_store import CHUNK_SIZE, TMP_DIRNAME, blob_root, commit_staged_file
+
+
+class UploadError(ValueError):
+    """分块上传协议错误；status 为建议返回的 HTTP 状态码"""
+
+    def __init__(self, message: str, status: int = 400, **payload):
+        super().__init__(message)
+        self.status = status
+        self.payload = payload
+
+
+def staging_path(upload_folder: str, upload_id: str) -> str:
+    return os.path.join(blob_root(upload_folder), TMP_DIRNAME, f'upload-{upload_id}.part')
+
+
+def create_upload_session(upload_folder: str, max_size: int, **fields) -> UploadSession:
+    """创建上传会话和空的暂存文件（调用方负责提交事务）"""
+    total_size = fields.get('total_size')
+    if total_size is None or total_size < 0:
+        raise UploadError('缺少文件大小')
+    if total_size > max_size:
+        raise UploadError(f'文件超过允许的最大大小（{max_size} 字节）', status=413)
+
+    upload = UploadSession(id=uuid.uuid4().hex, received=0, **fields)
+    path = staging_path(upload_folder, upload.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+    db.session.add(upload)
+    return upload
+
+
+def write_chunk(upload_folder: str, upload: UploadSession, offset: int, stream: BinaryIO) -> int:
+    """
+    把请求体写到暂存文件的 offset 处，成功后推进 received 并提交。
+
+    offset 与 received 不一致时抛 UploadError(409)，payload 里带正确的 offset；
+    两个请求并发写同一位置时，只有一个能推进 received，另一个同样得到 409。
+    返回新的 received。
+    """
+    if offset != upload.received:
+        raise UploadError('offset 与服务端进度不一致', status=409, offset=upload.received)
+
+    path = staging_path(upload_folder, upload.id)
+    if not os.path.exists(path):
+        raise UploadError('暂存文件已丢失，请重新发起上传', status=410)
+
+    written = 0
+    with open(path, 'r+b') as out:
+        out.seek(offset)
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if offset + written + len(chunk) > upload.total_size:
+                raise UploadError('写入内容超过声明的文件大小', status=416, offset=upload.received)
+            out.write(chunk)
+            written += len(chunk)
+        out.flush()
+        os.fsync(out.fileno())
+
+    if written == 0:
+        return upload.received
+
+    table = UploadSession.__table__
+    result = db.session.execute(
+        table.update()
+        .where(table.c.id == upload.id, table.c.received == offset)
+        .values(received=offset + written, updated_at=datetime.utcnow())
+    )
+    db.session.commit()
+    if result.rowcount != 1:
+        db.session.refresh(upload)
+        raise UploadError('offset 与服务端进度不一致', status=409, offset=upload.received)
+
+    db.session.refresh(upload)
+    return upload.received
+
+
+def finalize_upload(upload_folder: str, upload: UploadSession) -> Dict:
+    """
+    校验大小、计算 SHA-256 并把暂存文件放入 blob 存储。
+
+    返回 dict(content_hash, size, deduplicated)；ProjectFile 由调用方创建，
+    并在同一个事务里删除上传会话（db.session.delete(upload)）。
+    """
+    if upload.received != upload.total_size:
+        raise UploadError('文件还没有上传完整', status=409, offset=upload.received)
+
+    path = staging_path(upload_folder, upload.id)
+    if not os.path.exists(path):
+        raise UploadError('暂存文件已丢失，请重新发起上传', status=410)
+
+    # 之前中断的块可能在文件尾部留下多余字节
+    with open(path, 'r+b') as f:
+        f.truncate(upload.total_size)
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+
+    content_hash = digest.hexdigest()
+    deduplicated = commit_staged_file(upload_folder, path, content_hash)
+    return dict(content_hash=content_hash, size=upload.total_size, deduplicated=deduplicated)
+
+
+def purge_stale_uploads(upload_folder: str, ttl_hours: float) -> Dict[str, int]:
+    """
+    清理超过 ttl_hours 没有进展的上传会话及其暂存文件，
+    以及 tmp 目录里找不到会话、且同样过期的暂存文件（例如进程崩溃留下的）。
+
+    返回 dict(sessions=..., files=..., bytes=...)。
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=ttl_hours)
+    result = dict(sessions=0, files=0, bytes=0)
+
+    def remove(path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        result['files'] += 1
+        result['bytes'] += size
+
+    stale = UploadSession.query.filter(UploadSession.updated_at < cutoff).all()
+    for upload in stale:
+        remove(staging_path(upload_folder, upload.id))
+        db.session.delete(upload)
+        result['sessions'] += 1
+    db.session.commit()
+
+    tmp_dir = os.path.join(blob_root(upload_folder), TMP_DIRNAME)
+    if os.path.isdir(tmp_dir):
+        live_ids = {row.id for row in db.session.query(UploadSession.id).all()}
+        cutoff_ts = time.time() - ttl_hours * 3600
+        for name in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, name)
+            if name.startswith('upload-') and name[len('upload-'):-len('.part')] in live_ids:
+                continue
+            try:
+                if os.path.getmtime(path) >= cutoff_ts:
+                    continue
+            except FileNotFoundError:
+                continue
+            remove(path)
+
+    return result
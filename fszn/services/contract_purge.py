@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+合同的“墓碑删除” + 后台分批清理。
+
+设计目的：
+- 原来删除合同要在一个请求、一个事务里删光十几张表的子记录，
+  子记录多的合同删除很慢，还长时间锁住这些表；
+- 现在删除只给合同打上 deleted_at 标记并登记一行 contract_purges（O(1)），立即返回；
+- register_tombstone_filter 给 Session 加了全局的 ORM 查询条件：
+  所有查询（列表、get_or_404、关系加载、汇总/概览统计等）都自动忽略已删除的合同，
+  确实需要看到它们时给查询加 execution_options(include_deleted_contracts=True)；
+- 后台线程（ContractPurger）按 PURGE_STEPS 的顺序逐张表分批删除子记录，
+  每批删除和进度（stage / rows_deleted）在同一事务里提交，进程中断后从断点继续；
+  最后删除合同本身（search_ngrams 由 search_index 的 flush 事件一并删除）；
+- 文件记录删除后，不再被任何记录引用的 blob / 平铺文件连同缩略图直接从磁盘删除；
+  刚被其它上传复用过（修改时间很新）的 blob 留给 flask files gc 按宽限期回收，
+  删除记录后、删磁盘文件前中断留下的文件也由 flask files gc 回收。
+
+注意：清理完成前，已删除合同的项目编号仍然被占用（project_code 唯一）。
+
+命令行：
+    flask contracts purge [--batch-size N] [--limit N]   # 立即执行清理（关闭后台线程时放进计划任务）
+    flask contracts purge-status                         # 查看未完成的清理
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event, or_, select
+from sqlalchemy.orm import with_loader_criteria
+
+from .. import db
+from ..models import (
+    Acceptance,
+    Contract,
+    ContractPurge,
+    ContractRollup,
+    Feedback,
+    FileScrubFinding,
+    Invoice,
+    Payment,
+    ProcurementItem,
+    ProjectDepartmentLeader,
+    ProjectFile,
+    Refund,
+    SalesInfo,
+    Task,
+    UploadSession,
+)
+from .blob_store import blob_path
+from .chunked_upload import staging_path
+from .previews import preview_path
+
+
+# 查询时带上这个执行选项，就能看到已删除（尚未清理完）的合同
+INCLUDE_DELETED = 'include_deleted_contracts'
+
+# 每批删除多少行（SQL Server 单条语句参数上限 2100）
+PURGE_BATCH_SIZE = 500
+
+# 清理顺序：逐张表删除子记录，最后删除合同本身
+PURGE_STEPS = (
+    UploadSession,
+    Task,
+    ProcurementItem,
+    Acceptance,
+    Payment,
+    Invoice,
+    Refund,
+    Feedback,
+    ProjectDepartmentLeader,
+    SalesInfo,
+    ProjectFile,
+    ContractRollup,
+)
+STAGE_CONTRACT = 'contracts'
+STAGE_DONE = 'done'
+
+# 租约时长（秒）：每提交一批就续期；进程崩溃后租约过期，其它进程可以接手
+LEASE_SECONDS = 300
+
+# 修改时间在这个时间（秒）之内的 blob 可能刚被其它上传复用，不在这里删除，交给 flask files gc
+RECENT_FILE_SECONDS = 3600
+
+
+# ---------------------- 全局查询条件 ----------------------
+
+def _hide_deleted_contracts(execute_state) -> None:
+    if (
+        execute_state.is_select
+        and not execute_state.is_column_load
+        and not execute_state.execution_options.get(INCLUDE_DELETED, False)
+    ):
+        execute_state.statement = execute_state.statement.options(
+            with_loader_criteria(Contract, lambda cls: cls.deleted_at.is_(None), include_aliases=True)
+        )
+
+
+def register_tombstone_filter() -> None:
+    """在 create_app 中调用：所有 ORM 查询自动忽略已删除的合同（幂等）"""
+    if not event.contains(db.session, 'do_orm_execute', _hide_deleted_contracts):
+        event.listen(db.session, 'do_orm_execute', _hide_deleted_contracts)
+
+
+def find_contract_by_code(project_code: str) -> Optional[Contract]:
+    """按项目编号查找合同，包括已删除、尚未清理完的（项目编号仍被占用）"""
+    return (
+        Contract.query
+        .execution_options(**{INCLUDE_DELETED: True})
+        .filter_by(project_code=project_code)
+        .first()
+    )
+
+
+def mark_contract_deleted(contract: Contract, user=None) -> ContractPurge:
+    """给合同打删除标记并登记清理任务（调用方负责提交事务）"""
+    contract.deleted_at = datetime.utcnow()
+    purge = db.session.get(ContractPurge, contract.id)
+    if purge is None:
+        purge = ContractPurge(contract_id=contract.id, stage='', rows_deleted=0,
+                              files_removed=0, bytes_freed=0)
+        db.session.add(purge)
+    purge.requested_at = contract.deleted_at
+    purge.requested_by_id = user.id if user else None
+    purge.finished_at = None
+    return purge
+
+
+# ---------------------- 分批清理 ----------------------
+
+def _remaining_steps(stage: str) -> List:
+    names = [model.__tablename__ for model in PURGE_STEPS]
+    if stage in names:
+        return list(PURGE_STEPS[names.index(stage):])
+    if stage in (STAGE_CONTRACT, STAGE_DONE):
+        return []
+    return list(PURGE_STEPS)
+
+
+def _claim(contract_id: int, token: str) -> bool:
+    """拿到（或续上）这个合同的清理租约；别的进程正在清理时返回 False"""
+    now = datetime.utcnow()
+    table = ContractPurge.__table__
+    result = db.session.execute(
+        table.update()
+        .where(
+            table.c.contract_id == contract_id,
+            table.c.finished_at.is_(None),
+            or_(
+                table.c.locked_until.is_(None),
+                table.c.locked_until < now,
+                table.c.locked_by == token,
+            ),
+        )
+        .values(locked_by=token, locked_until=now + timedelta(seconds=LEASE_SECONDS))
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _remove(path: str, min_age: float = 0) -> int:
+    """删除一个文件，返回释放的字节数；不存在或太新时返回 -1"""
+    try:
+        st = os.stat(path)
+        if min_age and st.st_mtime > time.time() - min_age:
+            return -1
+        os.remove(path)
+    except FileNotFoundError:
+        return -1
+    return st.st_size
+
+
+def _remove_unreferenced_files(upload_folder: str, rows: Iterable) -> Dict[str, int]:
+    """已删除的文件记录 (id, content_hash, stored_filename)：删掉不再被任何记录引用的磁盘文件"""
+    result = dict(files=0, bytes=0)
+    hashes = {r.content_hash for r in rows if r.content_hash}
+    names = {r.stored_filename for r in rows if not r.content_hash and r.stored_filename}
+
+    def count(freed: int) -> None:
+        if freed >= 0:
+            result['files'] += 1
+            result['bytes'] += freed
+
+    if hashes:
+        live = {
+            row[0] for row in
+            db.session.query(ProjectFile.content_hash)
+            .filter(ProjectFile.content_hash.in_(hashes))
+            .distinct()
+        }
+        for content_hash in hashes - live:
+            freed = _remove(blob_path(upload_folder, content_hash), min_age=RECENT_FILE_SECONDS)
+            count(freed)
+            if freed >= 0:
+                _remove(preview_path(upload_folder, content_hash))
+
+    if names:
+        live = {
+            row[0] for row in
+            db.session.query(ProjectFile.stored_filename)
+            .filter(ProjectFile.stored_filename.in_(names), ProjectFile.content_hash.is_(None))
+            .distinct()
+        }
+        for name in names - live:
+            count(_remove(os.path.join(upload_folder, name)))
+
+    return result
+
+
+def _purge_batch(upload_folder: str, model, purge: ContractPurge, batch_size: int) -> int:
+    """删除一批子记录并提交进度，返回删除的行数（0 表示这张表已清空）"""
+    pk = model.__mapper__.primary_key[0]
+    columns = [pk]
+    if model is ProjectFile:
+        columns += [ProjectFile.content_hash, ProjectFile.stored_filename]
+    rows = db.session.execute(
+        select(*columns)
+        .where(model.contract_id == purge.contract_id)
+        .order_by(pk)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return 0
+
+    ids = [row[0] for row in rows]
+    db.session.execute(model.__table__.delete().where(pk.in_(ids)))
+    if model is ProjectFile:
+        # 巡检结果没有外键，随文件记录一起删除
+        db.session.execute(FileScrubFinding.__table__.delete().where(FileScrubFinding.file_id.in_(ids)))
+    purge.stage = model.__tablename__
+    purge.rows_deleted += len(ids)
+    purge.locked_until = datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+    db.session.commit()
+
+    # 记录提交之后再删磁盘文件；文件计数随下一次提交写入
+    if model is UploadSession:
+        for upload_id in ids:
+            freed = _remove(staging_path(upload_folder, upload_id))
+            if freed >= 0:
+                purge.files_removed += 1
+                purge.bytes_freed += freed
+    elif model is ProjectFile:
+        removed = _remove_unreferenced_files(upload_folder, rows)
+        purge.files_removed += removed['files']
+        purge.bytes_freed += removed['bytes']
+    return len(ids)
+
+
+def purge_contract(
+    upload_folder: str,
+    contract_id: int,
+    batch_size: int = PURGE_BATCH_SIZE,
+    token: Optional[str] = None,
+) -> Optional[Dict[str, int]]:
+    """
+    清理一个已删除的合同：从断点继续逐表分批删除，最后删除合同本身。
+    别的进程正在清理（租约未过期）时返回 None，否则返回 dict(rows, files, bytes)。
+    """
+    token = token or uuid.uuid4().hex
+    if not _claim(contract_id, token):
+        return None
+
+    purge = db.session.get(ContractPurge, contract_id)
+    start = dict(rows=purge.rows_deleted, files=purge.files_removed, bytes=purge.bytes_freed)
+    try:
+        for model in _remaining_steps(purge.stage):
+            while _purge_batch(upload_folder, model, purge, batch_size):
+                pass
+
+        purge.stage = STAGE_CONTRACT
+        contract = db.session.get(Contract, contract_id, execution_options={INCLUDE_DELETED: True})
+        if contract is not None:
+            db.session.delete(contract)
+        purge.stage = STAGE_DONE
+        purge.finished_at = datetime.utcnow()
+        purge.locked_by = None
+        purge.locked_until = None
+        purge.last_error = None
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        purge = db.session.get(ContractPurge, contract_id)
+        purge.last_error = str(e)[:255]
+        purge.locked_by = None
+        purge.locked_until = None
+        db.session.commit()
+        raise
+
+    return dict(
+        rows=purge.rows_deleted - start['rows'],
+        files=purge.files_removed - start['files'],
+        bytes=purge.bytes_freed - start['bytes'],
+    )
+
+
+def purge_deleted_contracts(
+    upload_folder: str,
+    batch_size: int = PURGE_BATCH_SIZE,
+    limit: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    按删除先后清理所有未完成的合同，返回 dict(contracts, skipped, rows, files, bytes)：
+    skipped 为正在被其它进程清理而跳过的合同数。limit 限制本次最多清理的合同数。
+    """
+    result = dict(contracts=0, skipped=0, rows=0, files=0, bytes=0)
+    pending = [
+        row[0] for row in
+        db.session.query(ContractPurge.contract_id)
+        .filter(ContractPurge.finished_at.is_(None))
+        .order_by(ContractPurge.requested_at.asc(), ContractPurge.contract_id.asc())
+    ]
+    db.session.rollback()
+
+    token = uuid.uuid4().hex
+    for contract_id in pending:
+        if limit is not None and result['contracts'] >= limit:
+            break
+        done = purge_contract(upload_folder, contract_id, batch_size=batch_size, token=token)
+        if done is None:
+            result['skipped'] += 1
+            continue
+        result['contracts'] += 1
+        for key in ('rows', 'files', 'bytes'):
+            result[key] += done[key]
+    return result
+
+
+# ---------------------- 后台线程 ----------------------
+
+class ContractPurger:
+    """后台清理线程（每个 app 一个）：删除合同后被唤醒，另外每 interval 秒检查一次未完成的清理"""
+
+    def __init__(self, app, batch_size: int = PURGE_BATCH_SIZE, interval: float = 300):
+        self.app = app
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+    def notify(self) -> None:
+        """有新的合同被删除：唤醒后台线程"""
+        self.ensure_started()
+        self._wake.set()
+
+    def ensure_started(self) -> None:
+        # fork 出来的子进程（如 gunicorn --preload）没有父进程的线程，需要重新启动
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wake.set()  # 启动后先处理一遍上次没清理完的
+            self._thread = threading.Thread(target=self._run, name='contract-purger', daemon=True)
+            self._thread.start()
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        """停止后台线程（当前这一批提交后退出，剩下的下次继续）"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._stopping = True
+        self._wake.set()
+        thread.join(timeout)
+
+    def run_once(self) -> Optional[Dict[str, int]]:
+        with self.app.app_context():
+            try:
+                return purge_deleted_contracts(self.app.config['UPLOAD_FOLDER'], batch_size=self.batch_size)
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception('已删除合同的后台清理失败，稍后重试')
+                return None
+            finally:
+                db.session.remove()
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping:
+                return
+            self.run_once()
+
+
+def init_contract_purger(app) -> Optional[ContractPurger]:
+    """在 create_app 中调用：配置开启 CONTRACT_PURGE_ASYNC 时创建后台清理线程（第一个请求时启动）"""
+    if not app.config.get('CONTRACT_PURGE_ASYNC'):
+        return None
+    purger = ContractPurger(
+        app,
+        batch_size=app.config.get('CONTRACT_PURGE_BATCH_SIZE', PURGE_BATCH_SIZE),
+        interval=app.config.get('CONTRACT_PURGE_INTERVAL', 300),
+    )
+    app.extensions['contract_purger'] = purger
+    app.before_request(purger.ensure_started)
+    atexit.register(purger.shutdown)
+    return purger
+
+
+def get_contract_purger(app) -> Optional[ContractPurger]:
+    """当前 app 的后台清理线程；未开启时返回 None"""
+    return app.extensions.get('contract_purger')
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+上传目录的空间回收（垃圾回收）。
+
+需要回收的文件：
+- 软删除（ProjectFile.is_deleted）超过宽限期（FILE_GC_GRACE_DAYS 天）的文件；
+- 没有任何 ProjectFile 引用的文件：删除合同时整批删掉了文件记录，或迁移进 blob 存储后
+  留在 UPLOAD_FOLDER 平铺的旧文件、上传中途失败留下的文件等。
+
+规则：
+- blob 存储（blobs/ab/cd/<hash>）：没有“有效引用”的 blob 删除；
+  有效引用 = 未删除的文件记录，或软删除未超过宽限期的文件记录；
+  同一内容被多条记录共用时，只要还有一条有效引用就保留；
+- UPLOAD_FOLDER 平铺的历史文件：按 stored_filename 同样判断（只看 content_hash 为空的记录）；
+- 磁盘上的修改时间也必须早于宽限期，避免误删“刚写进磁盘、记录还没提交”的文件
+  （上传命中已有 blob 时会刷新它的修改时间，见 blob_store.commit_staged_file）；
+- blob 删除时连同它的缩略图一起删除；blobs/tmp 里的暂存文件归 flask files gc-uploads 管。
+
+执行方式：
+- 边扫描目录边按批（batch_size 个文件一次查询）核对数据库，只读查询、不长时间持有锁；
+- limit 限制单次最多删除多少个文件，可以每晚分多次跑；
+- 命令行：flask files gc [--grace-days N] [--limit N] [--dry-run]
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import or_
+
+from .. import db
+from ..models import ProjectFile
+from .blob_store import BLOB_DIRNAME, TMP_DIRNAME, blob_root
+from .previews import PREVIEW_DIRNAME, preview_path
+
+
+# 每批核对多少个文件（SQL Server 单条语句参数上限 2100）
+GC_BATCH_SIZE = 500
+
+# UPLOAD_FOLDER 下由程序管理的子目录，扫描平铺文件时跳过
+_MANAGED_DIRS = {BLOB_DIRNAME, PREVIEW_DIRNAME}
+
+
+def _live_condition(cutoff: datetime):
+    """文件记录仍是“有效引用”的条件：未删除，或软删除未超过宽限期"""
+    return or_(
+        ProjectFile.is_deleted == False,  # noqa: E712
+        ProjectFile.is_deleted.is_(None),
+        ProjectFile.deleted_at > cutoff,
+    )
+
+
+def stamp_legacy_soft_deletes() -> int:
+    """
+    给早于 deleted_at 字段的软删除记录补上删除时间（记为现在），宽限期从现在开始算。
+    返回补上的条数。
+    """
+    table = ProjectFile.__table__
+    result = db.session.execute(
+        table.update()
+        .where(table.c.is_deleted == True, table.c.deleted_at.is_(None))  # noqa: E712
+        .values(deleted_at=datetime.utcnow())
+    )
+    db.session.commit()
+    return result.rowcount or 0
+
+
+def _iter_blobs(upload_folder: str) -> Iterator[Tuple[str, str]]:
+    """逐个产出 (hash, 路径)，按目录流式扫描"""
+    root = blob_root(upload_folder)
+    if not os.path.isdir(root):
+        return
+    for shard1 in sorted(os.listdir(root)):
+        if shard1 == TMP_DIRNAME:
+            continue
+        dir1 = os.path.join(root, shard1)
+        if not os.path.isdir(dir1):
+            continue
+        for shard2 in sorted(os.listdir(dir1)):
+            dir2 = os.path.join(dir1, shard2)
+            if not os.path.isdir(dir2):
+                continue
+            with os.scandir(dir2) as it:
+                for entry in it:
+                    if entry.is_file():
+                        yield entry.name, entry.path
+
+
+def _iter_flat_files(upload_folder: str) -> Iterator[Tuple[str, str]]:
+    """UPLOAD_FOLDER 顶层的平铺文件：(文件名, 路径)"""
+    if not os.path.isdir(upload_folder):
+        return
+    with os.scandir(upload_folder) as it:
+        for entry in it:
+            if entry.name in _MANAGED_DIRS:
+                continue
+            if entry.is_file():
+                yield entry.name, entry.path
+
+
+def _batches(items: Iterator[Tuple[str, str]], size: int) -> Iterator[List[Tuple[str, str]]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def collect_garbage(
+    upload_folder: str,
+    grace_days: float,
+    batch_size: int = GC_BATCH_SIZE,
+    limit: Optional[int] = None,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    """
+    回收无效文件，返回 dict(scanned, blobs, files, bytes, stamped)：
+        scanned 扫描的文件数，blobs / files 删除的 blob / 平铺文件数，
+        bytes 释放的字节数，stamped 补上删除时间的历史软删除记录数。
+    dry_run=True 时只统计、不删除。
+    """
+    cutoff = datetime.utcnow() - timedelta(days=grace_days)
+    cutoff_ts = time.time() - grace_days * 86400
+    result = dict(scanned=0, blobs=0, files=0, bytes=0, stamped=0)
+    if not dry_run:
+        result['stamped'] = stamp_legacy_soft_deletes()
+
+    def reclaim(path: str, kind: str) -> bool:
+        """删除一个过了宽限期的文件；返回是否已达到本次上限"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if st.st_mtime >= cutoff_ts:
+            return False
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return False
+        result[kind] += 1
+        result['bytes'] += st.st_size
+        return limit is not None and result['blobs'] + result['files'] >= limit
+
+    # 1）blob 存储
+    for batch in _batches(_iter_blobs(upload_folder), batch_size):
+        result['scanned'] += len(batch)
+        hashes = [h for h, _ in batch]
+        live = {
+            row[0] for row in
+            db.session.query(ProjectFile.content_hash)
+            .filter(ProjectFile.content_hash.in_(hashes), _live_condition(cutoff))
+            .distinct()
+        }
+        for content_hash, path in batch:
+            if content_hash in live:
+                continue
+            done = reclaim(path, 'blobs')
+            if not dry_run:
+                thumb = preview_path(upload_folder, content_hash)
+                if os.path.exists(thumb) and not os.path.exists(path):
+                    os.remove(thumb)
+            if done:
+                return result
+        db.session.rollback()  # 结束只读事务，不长时间持有快照
+
+    # 2）UPLOAD_FOLDER 平铺的历史文件
+    for batch in _batches(_iter_flat_files(upload_folder), batch_size):
+        result['scanned'] += len(batch)
+        names = [n for n, _ in batch]
+        live = {
+            row[0] for row in
+            db.session.query(ProjectFile.stored_filename)
+            .filter(
+                ProjectFile.stored_filename.in_(names),
+                ProjectFile.content_hash.is_(None),
+                _live_condition(cutoff),
+            )
+            .distinct()
+        }
+        for name, path in batch:
+            if name in live:
+                continue
+            if reclaim(path, 'files'):
+                return result
+        db.session.rollback()
+
+    return result
@@ -8,12 +8,21 @@
 视图层只需：
 - 调用 evaluate_file_download / evaluate_file_delete
 - 根据返回结果决定：是否放行、flash 提示、写 OperationLog、提交事务
+
+权限规则只在 DOWNLOAD_POLICY / DELETE_POLICY 里声明一次，同一份规则可以：
+- 逐个判断：evaluate_file_download / evaluate_file_delete（返回结构不变）；
+- 批量判断：evaluate_file_downloads，一次遍历给出一批文件的可下载标记；
+- 编译成 SQL：file_download_clause，直接加到 ProjectFile 查询的 WHERE 里，
+  列表只查出当前用户能下载的文件，不用先全部取出再在 Python 里过滤。
 """
 
 from __future__ import annotations
 
-from typing import Optional, Dict, Any, Tuple
-from datetime import date
+from collections import namedtuple
+from typing import Optional, Dict, Any, Iterable
+
+from sqlalchemy import and_, false, or_, true
+
 from ..models import User, Contract, ProjectFile
 
 
@@ -22,6 +31,135 @@ def _get_role(user: Optional[User]) -> str:
     return (user.role or "").strip().lower() if user and user.role else ""
 
 
+# ---------------------- 规则条件 ----------------------
+# 每个条件同时提供 Python 判断（test）和 SQL 表达式（clause），两者语义保持一致
+
+class Always:
+    """无条件放行"""
+
+    def test(self, pf: ProjectFile, user: Optional[User]) -> bool:
+        return True
+
+    def clause(self, user: Optional[User]):
+        return true()
+
+
+class PublicFileTypes:
+    """文件已公开，且属于指定类别"""
+
+    def __init__(self, *file_types: str):
+        self.file_types = file_types
+
+    def test(self, pf: ProjectFile, user: Optional[User]) -> bool:
+        return bool(pf.is_public) and pf.file_type in self.file_types
+
+    def clause(self, user: Optional[User]):
+        return and_(ProjectFile.is_public == True, ProjectFile.file_type.in_(self.file_types))  # noqa: E712
+
+
+class SameOwnerRole:
+    """
+    文件没有归属角色（NULL / 空串），或归属角色与当前用户角色完全相同（没有登录用户时不限制）。
+    按原值精确比较，不忽略大小写和空格：放宽规则属于权限策略变更，不在这里做。
+    """
+
+    def test(self, pf: ProjectFile, user: Optional[User]) -> bool:
+        return not (pf.owner_role and user and pf.owner_role != user.role)
+
+    def clause(self, user: Optional[User]):
+        if not user:
+            return true()
+        conditions = [ProjectFile.owner_role.is_(None), ProjectFile.owner_role == ""]
+        if user.role is not None:
+            conditions.append(ProjectFile.owner_role == user.role)
+        return or_(*conditions)
+
+
+class IsUploader:
+    """当前用户是上传者"""
+
+    def test(self, pf: ProjectFile, user: Optional[User]) -> bool:
+        return bool(user) and user.id == pf.uploader_id
+
+    def clause(self, user: Optional[User]):
+        return ProjectFile.uploader_id == user.id if user else false()
+
+
+# 一条规则：适用的角色（None 表示其它所有角色）、放行条件、不满足时的提示和日志
+Rule = namedtuple("Rule", "roles condition flash_message log_message log_extra_keys")
+
+
+DOWNLOAD_POLICY = (
+    # 管理员 / 老板 / 软件工程师：完全放行
+    Rule(
+        roles={"admin", "boss", "software_engineer"},
+        condition=Always(),
+        flash_message=None, log_message=None, log_extra_keys=(),
+    ),
+    # 客户：只能下载公开的合同/技术文档
+    Rule(
+        roles={"customer"},
+        condition=PublicFileTypes("contract", "tech"),
+        flash_message="你没有权限下载此文件",
+        log_message="客户尝试下载未公开文件",
+        log_extra_keys=("file_type", "is_public"),
+    ),
+    # 内部普通员工：只能下载 owner_role == 自己 role 的文件
+    Rule(
+        roles=None,
+        condition=SameOwnerRole(),
+        flash_message="你只能下载自己部门上传的文件",
+        log_message="员工尝试下载非本部门文件",
+        log_extra_keys=("file_type", "owner_role", "user_role"),
+    ),
+)
+
+
+DELETE_POLICY = (
+    # admin / boss 可以删除任何文件
+    Rule(
+        roles={"admin", "boss"},
+        condition=Always(),
+        flash_message=None, log_message=None, log_extra_keys=(),
+    ),
+    # 其它用户：只能删除自己上传的
+    Rule(
+        roles=None,
+        condition=IsUploader(),
+        flash_message="你没有权限删除此文件",
+        log_message="无权限删除文件",
+        log_extra_keys=("stored_filename", "file_type", "uploader_id", "user_id", "user_role"),
+    ),
+)
+
+
+def _match_rule(policy, user: Optional[User]) -> Rule:
+    role = _get_role(user)
+    for rule in policy:
+        if rule.roles is None or role in rule.roles:
+            return rule
+    return policy[-1]
+
+
+def _extra_value(key: str, pf: ProjectFile, user: Optional[User]):
+    if key == "user_id":
+        return user.id if user else None
+    if key == "user_role":
+        return user.role if user and user.role else None
+    return getattr(pf, key)
+
+
+def file_download_clause(user: Optional[User]):
+    """当前用户可下载文件的 SQL 条件，用于 ProjectFile 查询的 filter(...)"""
+    return _match_rule(DOWNLOAD_POLICY, user).condition.clause(user)
+
+
+def evaluate_file_downloads(user: Optional[User], files: Iterable[ProjectFile]) -> Dict[int, bool]:
+    """批量判断一批文件能否下载：{文件 ID: 是否允许}（角色规则只匹配一次）"""
+    condition = _match_rule(DOWNLOAD_POLICY, user).condition
+    return {pf.id: condition.test(pf, user) for pf in files}
+
+
 def evaluate_file_download(
     user: Optional[User],
     contract: Contract,
@@ -38,63 +176,29 @@ def evaluate_file_download(
         "log_extra": dict,            # 日志 extra_data
     }
     """
-    role = _get_role(user)
-
-    # 默认：允许下载
-    allowed = True
-    flash_message: Optional[str] = None
-    log_action = "file.download"
-    log_message = f"下载文件：{pf.original_filename}"
-    log_extra = {
-        "contract_id": contract.id,
-        "file_type": pf.file_type,
-        "version": pf.version,
-        "is_public": pf.is_public,
-    }
+    rule = _match_rule(DOWNLOAD_POLICY, user)
 
-    # ------ 权限规则 ------
-
-    if role in ("admin", "boss", "software_engineer"):
-        # 完全放行
+    if rule.condition.test(pf, user):
         return dict(
             allowed=True,
             flash_message=None,
-            log_action=log_action,
-            log_message=log_message,
-            log_extra=log_extra,
-        )
-
-    if role == "customer":
-        # 客户：只能下载公开的合同/技术文档
-        if not (pf.is_public and pf.file_type in ("contract", "tech")):
-            allowed = False
-            flash_message = "你没有权限下载此文件"
-            log_action = "file.download_denied"
-            log_message = "客户尝试下载未公开文件"
-            log_extra = {
+            log_action="file.download",
+            log_message=f"下载文件：{pf.original_filename}",
+            log_extra={
                 "contract_id": contract.id,
                 "file_type": pf.file_type,
+                "version": pf.version,
                 "is_public": pf.is_public,
-            }
-    else:
-        # 内部普通员工：只能下载 owner_role == 自己 role 的文件
-        if pf.owner_role and user and pf.owner_role != user.role:
-            allowed = False
-            flash_message = "你只能下载自己部门上传的文件"
-            log_action = "file.download_denied"
-            log_message = "员工尝试下载非本部门文件"
-            log_extra = {
-                "contract_id": contract.id,
-                "file_type": pf.file_type,
-                "owner_role": pf.owner_role,
-                "user_role": user.role if user and user.role else None,
-            }
+            },
+        )
 
+    log_extra = {"contract_id": contract.id}
+    log_extra.update({key: _extra_value(key, pf, user) for key in rule.log_extra_keys})
     return dict(
-        allowed=allowed,
-        flash_message=flash_message,
-        log_action=log_action,
-        log_message=log_message,
+        allowed=False,
+        flash_message=rule.flash_message,
+        log_action="file.download_denied",
+        log_message=rule.log_message,
         log_extra=log_extra,
     )
 
@@ -115,40 +219,33 @@ def evaluate_file_delete(
         "log_extra": dict,
     }
 
-    规则：
+    规则（见 DELETE_POLICY）：
     - 上传者 / admin / boss 可以删除
     - 其它用户删除 -> 记 file.delete_denied
     """
-    role = _get_role(user)
+    rule = _match_rule(DELETE_POLICY, user)
 
-    allowed = True
-    flash_message: Optional[str] = None
-    log_action = "file.delete_soft"
-    log_message = f"软删除文件：{pf.original_filename}"
-    log_extra = {
-        "contract_id": contract.id,
-        "stored_filename": pf.stored_filename,
-        "file_type": pf.file_type,
-    }
-
-    if (not user) or (user.id != pf.uploader_id and role not in ("admin", "boss")):
-        allowed = False
-        flash_message = "你没有权限删除此文件"
-        log_action = "file.delete_denied"
-        log_message = "无权限删除文件"
-        log_extra = {
-            "contract_id": contract.id,
-            "stored_filename": pf.stored_filename,
-            "file_type": pf.file_type,
-            "uploader_id": pf.uploader_id,
-            "user_id": user.id if user else None,
-            "user_role": user.role if user and user.role else None,
-        }
+    if user and rule.condition.test(pf, user):
+        return dict(
+            allowed=True,
+            flash_message=None,
+            log_action="file.delete_soft",
+            log_message=f"软删除文件：{pf.original_filename}",
+            log_extra={
+                "contract_id": contract.id,
+                "stored_filename": pf.stored_filename,
+                "file_type": pf.file_type,
+            },
+        )
 
+    # 没有登录用户时按“其它用户”的规则拒绝
+    rule = DELETE_POLICY[-1] if not user else rule
+    log_extra = {"contract_id": contract.id}
+    log_extra.update({key: _extra_value(key, pf, user) for key in rule.log_extra_keys})
     return dict(
-        allowed=allowed,
-        flash_message=flash_message,
-        log_action=log_action,
-        log_message=log_message,
+        allowed=False,
+        flash_message=rule.flash_message,
+        log_action="file.delete_denied",
+        log_message=rule.log_message,
         log_extra=log_extra,
     )
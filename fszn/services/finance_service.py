@@ -11,50 +11,28 @@
 from __future__ import annotations
 
 from decimal import Decimal
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable
 from datetime import date
 
-from ..models import Contract, SalesInfo
+from sqlalchemy import func, select
 
+from .. import db
+from ..models import Contract, SalesInfo, Payment, Invoice, Refund
 
-ZERO = Decimal('0.00')
-
-
-def get_contract_finance_summary(contract: Contract,
-                                 sales: Optional[SalesInfo] = None) -> Dict[str, Any]:
-    """
-    计算单个合同的财务汇总信息。
 
-    返回的字典字段：
-        - quote_amount: 报价金额（合同金额），可能为 None
-        - paid_total: 已收款总额
-        - refund_total: 退款总额
-        - net_received: 实收净额 = 已收款 - 退款
-        - invoiced_total: 已开票总额
-        - receivable_remaining: 剩余应收（可能为 None）
-        - invoice_remaining: 剩余待开票（可能为 None）
+ZERO = Decimal('0.00')
 
-    说明：
-    - 调用方如果已经查过 SalesInfo，可以通过 sales 参数传进来，避免重复查询；
-    - 如果 sales 为 None，这里会自行根据 contract_id 查询。
-    """
-    # 如果没传销售信息，这里自己查一遍
-    if sales is None:
-        sales = SalesInfo.query.filter_by(contract_id=contract.id).first()
+# SQL Server 单条语句最多 2100 个参数，IN 列表按批拆分
+ID_BATCH_SIZE = 1000
 
-    # 报价金额（作为合同金额使用）
-    quote_amount = None
-    if sales and getattr(sales, 'quote_amount', None) is not None:
-        quote_amount = sales.quote_amount
 
-    # 已收款总额 / 退款总额 / 实收净额
-    paid_total = sum((p.amount or ZERO) for p in contract.payments)
-    refund_total = sum((r.amount or ZERO) for r in contract.refunds)
+def build_finance_summary(quote_amount, paid_total, refund_total, invoiced_total) -> Dict[str, Any]:
+    """由报价和三项合计推导出完整的财务汇总字典"""
+    paid_total = Decimal(paid_total or ZERO)
+    refund_total = Decimal(refund_total or ZERO)
+    invoiced_total = Decimal(invoiced_total or ZERO)
     net_received = paid_total - refund_total
 
-    # 已开票总额
-    invoiced_total = sum((inv.amount or ZERO) for inv in contract.invoices)
-
     # 剩余应收 / 剩余待开票（报价为空时，这两个也保持 None）
     receivable_remaining = None
     invoice_remaining = None
@@ -73,6 +51,85 @@ def get_contract_finance_summary(contract: Contract,
     )
 
 
+def _amount_total(model):
+    """某张金额表里当前合同的金额合计（相关子查询，不再单独绑定一遍合同 ID）"""
+    return (
+        select(func.sum(model.amount))
+        .where(model.contract_id == Contract.id)
+        .scalar_subquery()
+    )
+
+
+def get_finance_summaries(contract_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """
+    批量计算多个合同的财务汇总，返回 {contract_id: 汇总字典}。
+
+    字段与 get_contract_finance_summary 完全相同。
+    付款 / 退款 / 开票在数据库里用相关子查询按合同求和，不把明细行加载到 Python 里累加；
+    合同 ID 在每条语句里只绑定一次，每 ID_BATCH_SIZE 个合同一次查询。
+    """
+    ids = list(dict.fromkeys(cid for cid in contract_ids if cid is not None))
+    result: Dict[int, Dict[str, Any]] = {}
+
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[start:start + ID_BATCH_SIZE]
+        stmt = (
+            select(
+                Contract.id,
+                SalesInfo.quote_amount,
+                _amount_total(Payment).label('paid_total'),
+                _amount_total(Refund).label('refund_total'),
+                _amount_total(Invoice).label('invoiced_total'),
+            )
+            .outerjoin(SalesInfo, SalesInfo.contract_id == Contract.id)
+            .where(Contract.id.in_(batch))
+        )
+        for row in db.session.execute(stmt):
+            result[row.id] = build_finance_summary(
+                row.quote_amount,
+                row.paid_total,
+                row.refund_total,
+                row.invoiced_total,
+            )
+
+    return result
+
+
+def get_contract_finance_summary(contract: Contract,
+                                 sales: Optional[SalesInfo] = None) -> Dict[str, Any]:
+    """
+    计算单个合同的财务汇总信息。
+
+    返回的字典字段：
+        - quote_amount: 报价金额（合同金额），可能为 None
+        - paid_total: 已收款总额
+        - refund_total: 退款总额
+        - net_received: 实收净额 = 已收款 - 退款
+        - invoiced_total: 已开票总额
+        - receivable_remaining: 剩余应收（可能为 None）
+        - invoice_remaining: 剩余待开票（可能为 None）
+
+    说明：
+    - 金额合计由 get_finance_summaries 在数据库里聚合，不加载明细行；
+    - 调用方如果已经查过 SalesInfo，可以通过 sales 参数传进来，报价直接取它。
+    """
+    summary = get_finance_summaries([contract.id]).get(contract.id)
+    if summary is None:
+        # 合同尚未入库（理论上不会出现），按无任何款项处理
+        summary = build_finance_summary(None, ZERO, ZERO, ZERO)
+
+    if sales is not None:
+        quote_amount = getattr(sales, 'quote_amount', None)
+        summary = build_finance_summary(
+            quote_amount,
+            summary['paid_total'],
+            summary['refund_total'],
+            summary['invoiced_total'],
+        )
+
+    return summary
+
+
 # ---------------------- 付款（Payment） ----------------------
 
 
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+操作日志（operation_logs）按月归档。
+
+设计目的：
+- operation_logs 是增长最快的表（每次下载文件都会写一条），
+  超过保留期（LOG_RETENTION_MONTHS 个月）的日志移出数据库，热表保持小而快；
+- 每个月一个只追加的压缩段文件：operation_logs-YYYY-MM.ndjson.gz，
+  每次归档追加若干个独立的 gzip 块（每块最多 ARCHIVE_BLOCK_SIZE 行 NDJSON）；
+- 每个段文件有一个旁路索引 operation_logs-YYYY-MM.idx.json，记录每个块的
+  偏移 / 长度 / 行数 / ID 与时间范围，以及块内出现过的 action / target_type /
+  user_id / contract_id，查询时先按索引跳过不可能命中的块；
+- 日志页的日期范围早于热表时，透明地读取归档月份（见 iter_archived_logs）。
+
+可靠性：
+- 先追加块并 fsync，再原子替换旁路索引，最后才从数据库删除这批日志；
+- 旁路索引是唯一可信来源：崩溃时文件尾部多出来的未登记数据会被忽略；
+- 已登记进索引、但数据库里还没删掉的行（索引写完后中断），重跑时只删除不重复写入。
+
+命令行：flask oplog archive [--months N]
+"""
+
+from __future__ import annotations
+
+import gzip
+import heapq
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, func, select
+
+from .. import db
+from ..models import OperationLog, SearchGram
+
+
+# 每个 gzip 块最多多少行（同时也是每批从数据库删除的行数）
+ARCHIVE_BLOCK_SIZE = 5000
+
+# 旁路索引里按块记录的取值集合：索引字段名 -> 日志列名
+INDEXED_KEYS = {
+    'actions': 'action',
+    'target_types': 'target_type',
+    'user_ids': 'user_id',
+    'contract_ids': 'contract_id',
+}
+
+# SQL Server 单条语句参数上限 2100，删除时按批拆 IN 列表
+_DELETE_BATCH = 1000
+
+
+# ---------------------- 路径 / 月份工具 ----------------------
+
+def _month_key(d: date) -> str:
+    return f"{d.year:04d}-{d.month:02d}"
+
+
+def _month_start(year: int, month: int) -> datetime:
+    return datetime(year, month, 1)
+
+
+def _next_month(dt: datetime) -> datetime:
+    if dt.month == 12:
+        return datetime(dt.year + 1, 1, 1)
+    return datetime(dt.year, dt.month + 1, 1)
+
+
+def retention_cutoff(months: int, today: Optional[date] = None) -> datetime:
+    """保留最近 months 个整月（含当月）：早于返回时间点的日志可以归档"""
+    today = today or datetime.utcnow().date()
+    total = today.year * 12 + (today.month - 1) - (months - 1)
+    return _month_start(total // 12, total % 12 + 1)
+
+
+def _segment_path(folder: str, month: str) -> str:
+    return os.path.join(folder, f'operation_logs-{month}.ndjson.gz')
+
+
+def _index_path(folder: str, month: str) -> str:
+    return os.path.join(folder, f'operation_logs-{month}.idx.json')
+
+
+def load_segment_index(folder: str, month: str) -> Dict[str, Any]:
+    path = _index_path(folder, month)
+    if not os.path.exists(path):
+        return dict(month=month, blocks=[])
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_segment_index(folder: str, month: str, index: Dict[str, Any]) -> None:
+    path = _index_path(folder, month)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def archived_months(folder: str) -> List[str]:
+    """已有归档的月份（'YYYY-MM'，升序）"""
+    if not folder or not os.path.isdir(folder):
+        return []
+    months = []
+    for name in os.listdir(folder):
+        if name.startswith('operation_logs-') and name.endswith('.idx.json'):
+            months.append(name[len('operation_logs-'):-len('.idx.json')])
+    return sorted(months)
+
+
+# ---------------------- 序列化 ----------------------
+
+_COLUMNS = [c.name for c in OperationLog.__table__.columns]
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    return {name: _encode_value(getattr(row, name)) for name in _COLUMNS}
+
+
+class ArchivedLog:
+    """归档日志行：属性与 OperationLog 同名，模板可以直接当日志对象用"""
+
+    archived = True
+
+    def __init__(self, data: Dict[str, Any]):
+        for name in _COLUMNS:
+            setattr(self, name, data.get(name))
+        if self.created_at:
+            self.created_at = datetime.fromisoformat(self.created_at)
+        if self.amount is not None:
+            self.amount = Decimal(self.amount)
+
+
+# ---------------------- 归档 ----------------------
+
+def _append_block(folder: str, month: str, rows: List[Dict[str, Any]], index: Dict[str, Any]) -> None:
+    """追加一个 gzip 块（块内按 (created_at, id) 排序），并把它登记进旁路索引"""
+    rows = sorted(rows, key=_sort_key)
+    payload = ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in rows).encode('utf-8')
+    data = gzip.compress(payload)
+
+    path = _segment_path(folder, month)
+    with open(path, 'ab') as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    block = dict(
+        offset=offset,
+        length=len(data),
+        count=len(rows),
+        min_id=min(r['id'] for r in rows),
+        max_id=max(r['id'] for r in rows),
+        min_created_at=min(r['created_at'] for r in rows),
+        max_created_at=max(r['created_at'] for r in rows),
+    )
+    for key, column in INDEXED_KEYS.items():
+        block[key] = sorted({r[column] for r in rows if r[column] is not None})
+
+    index['blocks'].append(block)
+    _save_segment_index(folder, month, index)
+
+
+def _delete_rows(ids: List[int]) -> None:
+    """从数据库删除已归档的日志及其 n-gram 索引（批量删除不会触发 flush 事件）"""
+    log_table = OperationLog.__table__
+    gram_table = SearchGram.__table__
+    for start in range(0, len(ids), _DELETE_BATCH):
+        batch = ids[start:start + _DELETE_BATCH]
+        db.session.execute(gram_table.delete().where(and_(
+            gram_table.c.entity_type == 'OperationLog',
+            gram_table.c.entity_id.in_(batch),
+        )))
+        db.session.execute(log_table.delete().where(log_table.c.id.in_(batch)))
+
+
+def archive_operation_logs(folder: str, months: int, block_size: int = ARCHIVE_BLOCK_SIZE) -> Dict[str, int]:
+    """
+    把早于保留期的日志按月写入归档段文件，并从数据库删除。
+
+    每个块写入后立即提交一次删除，可以随时中断、重复执行。
+    返回 {月份: 归档行数}。
+    """
+    os.makedirs(folder, exist_ok=True)
+    cutoff = retention_cutoff(months)
+    table = OperationLog.__table__
+
+    oldest = db.session.execute(
+        select(func.min(table.c.created_at)).where(table.c.created_at < cutoff)
+    ).scalar()
+    if oldest is None:
+        return {}
+
+    result: Dict[str, int] = {}
+    month_start = _month_start(oldest.year, oldest.month)
+    while month_start < cutoff:
+        month_end = min(_next_month(month_start), cutoff)
+        month = _month_key(month_start)
+        index = load_segment_index(folder, month)
+
+        # 已登记进索引但还没从数据库删掉的行（上次在删除前中断）：只删除
+        archived_upto = max((b['max_id'] for b in index['blocks']), default=0)
+        in_month = and_(table.c.created_at >= month_start, table.c.created_at < month_end)
+        if archived_upto:
+            leftover = db.session.execute(
+                select(table.c.id).where(in_month, table.c.id <= archived_upto)
+            ).scalars().all()
+            if leftover:
+                _delete_rows(leftover)
+                db.session.commit()
+
+        count = 0
+        while True:
+            rows = db.session.execute(
+                select(table)
+                .where(in_month, table.c.id > archived_upto)
+                .order_by(table.c.id.asc())
+                .limit(block_size)
+            ).all()
+            if not rows:
+                break
+            data = [_row_to_dict(r) for r in rows]
+            _append_block(folder, month, data, index)
+            _delete_rows([r['id'] for r in data])
+            db.session.commit()
+            archived_upto = data[-1]['id']
+            count += len(data)
+
+        if count:
+            result[month] = count
+        month_start = _next_month(month_start)
+
+    return result
+
+
+# ---------------------- 读取 ----------------------
+
+def _read_block(path: str, block: Dict[str, Any]) -> List[Dict[str, Any]]:
+    with open(path, 'rb') as f:
+        f.seek(block['offset'])
+        data = f.read(block['length'])
+    text = gzip.decompress(data).decode('utf-8')
+    return [json.loads(line) for line in text.splitlines() if line]
+
+
+def _sort_key(row: Dict[str, Any]) -> Tuple[str, int]:
+    # created_at 是 ISO 字符串，按字符串比较即按时间比较
+    return (row['created_at'] or '', row['id'])
+
+
+class _Descending:
+    """堆里按倒序比较的键"""
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+
+def _merge_blocks(
+    path: str,
+    blocks: List[Dict[str, Any]],
+    keep: Callable[[Dict[str, Any]], bool],
+    descending: bool,
+) -> Iterator[Dict[str, Any]]:
+    """
+    多个块按 (created_at, id) 归并输出（k 路归并）。
+
+    块按“第一行可能出现的位置”排序，归并到某个块的时间范围时才解压它：
+    归档按 ID 分块、ID 与时间基本同序，块之间的时间范围很少重叠，
+    内存里通常只有一两个块。
+    """
+    if descending:
+        blocks = sorted(blocks, key=lambda b: b['max_created_at'], reverse=True)
+    else:
+        blocks = sorted(blocks, key=lambda b: b['min_created_at'])
+
+    def heap_key(row):
+        key = _sort_key(row)
+        return _Descending(key) if descending else key
+
+    def may_precede(block, created: str) -> bool:
+        if descending:
+            return block['max_created_at'] >= created
+        return block['min_created_at'] <= created
+
+    heap: List = []
+    seq = 0
+    pos = 0
+    while True:
+        while pos < len(blocks) and (not heap or may_precede(blocks[pos], heap[0][2]['created_at'] or '')):
+            rows = [r for r in _read_block(path, blocks[pos]) if keep(r)]
+            pos += 1
+            if not rows:
+                continue
+            rows.sort(key=_sort_key, reverse=descending)
+            it = iter(rows)
+            row = next(it)
+            heapq.heappush(heap, (heap_key(row), seq, row, it))
+            seq += 1
+        if not heap:
+            return
+        _, _, row, it = heapq.heappop(heap)
+        yield row
+        nxt = next(it, None)
+        if nxt is not None:
+            heapq.heappush(heap, (heap_key(nxt), seq, nxt, it))
+            seq += 1
+
+
+def iter_archived_logs(
+    folder: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    descending: bool = True,
+    block_filter: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    row_filter: Optional[Callable[[Dict[str, Any]], bool]] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+) -> Iterator[ArchivedLog]:
+    """
+    按 (created_at, id) 顺序逐条产出归档日志。
+
+    - start / end：时间范围（含两端），决定读取哪些月份；
+    - block_filter：传入旁路索引里的块信息，返回 False 的块直接跳过（不解压）；
+    - row_filter：对解析出的行（字典）做精确过滤；
+    - after：(created_at, id) 游标，只产出排在它之后的行（方向由 descending 决定）。
+    块之间边读边归并（见 _merge_blocks），内存不随月份大小增长。
+    """
+    after_key = (after[0].isoformat(), after[1]) if after and after[0] is not None else None
+
+    months = archived_months(folder)
+    if start is not None:
+        months = [m for m in months if m >= _month_key(start)]
+    if end is not None:
+        months = [m for m in months if m <= _month_key(end)]
+    if after_key is not None:
+        # 游标所在月份之前（降序）/ 之后（升序）的月份不可能有结果
+        after_month = after_key[0][:7]
+        months = [m for m in months if (m <= after_month if descending else m >= after_month)]
+    if descending:
+        months = list(reversed(months))
+
+    start_s = start.isoformat() if start else None
+    end_s = end.isoformat() if end else None
+
+    def keep(row) -> bool:
+        created = row['created_at']
+        if start_s and created < start_s:
+            return False
+        if end_s and created > end_s:
+            return False
+        if after_key is not None:
+            key = _sort_key(row)
+            if (descending and key >= after_key) or (not descending and key <= after_key):
+                return False
+        return row_filter is None or row_filter(row)
+
+    for month in months:
+        index = load_segment_index(folder, month)
+        blocks = []
+        for block in index['blocks']:
+            if start_s and block['max_created_at'] < start_s:
+                continue
+            if end_s and block['min_created_at'] > end_s:
+                continue
+            if after_key is not None:
+                if descending and block['min_created_at'] > after_key[0]:
+                    continue
+                if not descending and block['max_created_at'] < after_key[0]:
+                    continue
+            if block_filter is not None and not block_filter(block):
+                continue
+            blocks.append(block)
+
+        for row in _merge_blocks(_segment_path(folder, month), blocks, keep, descending):
+            yield ArchivedLog(row)
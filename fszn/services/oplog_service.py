@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+操作日志（OperationLog）相关的 Service。
+
+- resolve_log_contract_id：推导一条日志属于哪个合同，
+  log_operation 写入时和历史数据回填时共用同一套规则；
+- backfill_log_contract_ids：给历史日志补上 contract_id
+  （命令行：flask oplog backfill-contract-ids）；
+- promoted_log_fields：从 extra 里提取常用字段（项目编号、合同编号、文件类型、金额），
+  写入 OperationLog 上带索引的独立列，按字段检索时不用再扫 extra_data 文本；
+- backfill_log_fields：历史日志的同样提取（命令行：flask oplog backfill-fields）。
+
+日志说明（message）的关键字检索走 search_ngrams 的 n-gram 索引（后台批量补建），见 services/search_index。
+"""
+
+from __future__ import annotations
+
+import json
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Optional
+
+from sqlalchemy import bindparam, select
+
+from .. import db
+from ..models import OperationLog
+
+
+def _as_int(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value is not None and value != '' else None
+    except (TypeError, ValueError):
+        return None
+
+
+def resolve_log_contract_id(
+    target_type: Optional[str],
+    target_id: Optional[int],
+    extra: Optional[Dict[str, Any]] = None,
+    contract_id: Optional[int] = None,
+) -> Optional[int]:
+    """
+    推导日志所属的合同 ID，优先级：
+        1）调用方显式传入的 contract_id；
+        2）extra 里的 contract_id（子记录的日志都会带上）；
+        3）目标本身就是合同（target_type == 'Contract'）时取 target_id。
+    都没有时返回 None（与合同无关的日志，比如部门 / 人员维护）。
+    """
+    if contract_id is not None:
+        return contract_id
+    if isinstance(extra, dict):
+        from_extra = _as_int(extra.get('contract_id'))
+        if from_extra is not None:
+            return from_extra
+    if target_type == 'Contract':
+        return _as_int(target_id)
+    return None
+
+
+# 从 extra 提取到独立列的文本字段：extra 的 key -> (列名, 最大长度)
+PROMOTED_TEXT_FIELDS = {
+    'project_code': ('project_code', 100),
+    'contract_number': ('contract_number', 100),
+    'file_type': ('file_type', 50),
+}
+
+
+def _as_amount(value: Any) -> Optional[Decimal]:
+    if value is None or value == '' or isinstance(value, bool):
+        return None
+    try:
+        amount = Decimal(str(value)).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        return None
+    # Numeric(14, 2) 放不下的值不提取（原始数据仍在 extra_data 里）
+    if not amount.is_finite() or abs(amount) >= Decimal('1e12'):
+        return None
+    return amount
+
+
+def promoted_log_fields(extra: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """从 extra 里提取要单独存列的字段；extra 里没有的字段返回 None"""
+    fields: Dict[str, Any] = {column: None for column, _ in PROMOTED_TEXT_FIELDS.values()}
+    fields['amount'] = None
+    if not isinstance(extra, dict):
+        return fields
+
+    for key, (column, max_len) in PROMOTED_TEXT_FIELDS.items():
+        value = extra.get(key)
+        if value is not None and value != '':
+            fields[column] = str(value)[:max_len]
+    fields['amount'] = _as_amount(extra.get('amount'))
+    return fields
+
+
+def _parse_extra(extra_data: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not extra_data:
+        return None
+    try:
+        data = json.loads(extra_data)
+    except (TypeError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def backfill_log_contract_ids(batch_size: int = 1000) -> Dict[str, int]:
+    """
+    给 contract_id 为空的历史日志补上合同 ID（解析 extra_data / target）。
+
+    按 ID 分批扫描，每批提交一次，中途中断后重新执行会从头跳过已填好的行。
+    返回 dict(scanned=扫描条数, updated=补上的条数)。
+    """
+    table = OperationLog.__table__
+    update_stmt = (
+        table.update()
+        .where(table.c.id == bindparam('log_id'))
+        .values(contract_id=bindparam('new_contract_id'))
+    )
+
+    scanned = updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.target_type, table.c.target_id, table.c.extra_data)
+            .where(table.c.contract_id.is_(None), table.c.id > last_id)
+            .order_by(table.c.id.asc())
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        params = []
+        for row in rows:
+            cid = resolve_log_contract_id(row.target_type, row.target_id, _parse_extra(row.extra_data))
+            if cid is not None:
+                params.append(dict(log_id=row.id, new_contract_id=cid))
+
+        if params:
+            db.session.execute(update_stmt, params)
+        db.session.commit()
+
+        scanned += len(rows)
+        updated += len(params)
+        last_id = rows[-1].id
+
+    return dict(scanned=scanned, updated=updated)
+
+
+def backfill_log_fields(batch_size: int = 1000) -> Dict[str, int]:
+    """
+    把历史日志 extra_data 里的常用字段提取到独立列（只更新能提取出值的行）。
+
+    按 ID 分批扫描全部带 extra_data 的日志，每批提交一次，可以重复执行。
+    返回 dict(scanned=扫描条数, updated=更新条数)。
+    """
+    table = OperationLog.__table__
+    columns = list(promoted_log_fields(None).keys())
+    update_stmt = (
+        table.update()
+        .where(table.c.id == bindparam('log_id'))
+        .values({column: bindparam(f'new_{column}') for column in columns})
+    )
+
+    scanned = updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.extra_data)
+            .where(table.c.extra_data.isnot(None), table.c.id > last_id)
+            .order_by(table.c.id.asc())
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        params = []
+        for row in rows:
+            fields = promoted_log_fields(_parse_extra(row.extra_data))
+            if any(v is not None for v in fields.values()):
+                params.append(dict(log_id=row.id, **{f'new_{k}': v for k, v in fields.items()}))
+
+        if params:
+            db.session.execute(update_stmt, params)
+        db.session.commit()
+
+        scanned += len(rows)
+        updated += len(params)
+        last_id = rows[-1].id
+
+    return dict(scanned=scanned, updated=updated)
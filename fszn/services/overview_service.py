@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+项目 / 合同总览页的数据 Service。
+
+设计目的：
+- 原来的总览页要跑 8 次 COUNT、一次负责人查询、一次销售信息查询，
+  状态再跑 6 次 COUNT，财务汇总还要把付款 / 退款 / 开票明细整表加载；
+- 这里把“合同 + 公司 + 销售信息 + 各模块计数 + 状态标志位 + 金额合计”
+  放进同一条 SELECT（计数和合计都是相关子查询，状态标志位复用 status_service），
+  部门负责人用 selectinload 作为第二条查询一起带出；
+- 整个总览只需要 2 次数据库往返，与合同下挂多少记录无关。
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload, selectinload
+
+from .. import db
+from ..models import (
+    Contract, SalesInfo, Person, ProjectDepartmentLeader,
+    Task, ProcurementItem, Acceptance, Payment, Invoice, Refund, Feedback,
+    ProjectFile,
+)
+from .status_service import STATUS_FLAG_KEYS, status_flag_columns, derive_contract_status
+from .finance_service import build_finance_summary
+
+
+# 各模块计数：stats 字典的 key -> (模型, 额外条件)
+OVERVIEW_COUNTS = {
+    'tasks': (Task, None),
+    'proc': (ProcurementItem, None),
+    'acc': (Acceptance, None),
+    'pay': (Payment, None),
+    'inv': (Invoice, None),
+    'refund': (Refund, None),
+    'fb': (Feedback, None),
+    'files': (ProjectFile, ProjectFile.is_deleted == False),  # noqa: E712
+}
+
+# 金额合计：label -> 模型
+OVERVIEW_SUMS = {
+    'paid_total': Payment,
+    'refund_total': Refund,
+    'invoiced_total': Invoice,
+}
+
+
+def _count_column(model, extra_cond, name):
+    stmt = select(func.count()).select_from(model).where(model.contract_id == Contract.id)
+    if extra_cond is not None:
+        stmt = stmt.where(extra_cond)
+    return stmt.scalar_subquery().label(f'count_{name}')
+
+
+def _sum_column(model, name):
+    return (
+        select(func.coalesce(func.sum(model.amount), 0))
+        .where(model.contract_id == Contract.id)
+        .scalar_subquery()
+        .label(name)
+    )
+
+
+def get_contract_overview(contract_id: int) -> Optional[Dict[str, Any]]:
+    """
+    一次性取出总览页需要的全部数据；合同不存在时返回 None。
+
+    返回字典字段：
+        - contract: 合同对象（公司已预加载）
+        - sales: 销售信息（可能为 None，销售负责人已预加载）
+        - leaders: 部门负责人列表（按 ID 排序，部门 / 人员 / 人员所属部门已预加载）
+        - stats: 各模块记录数（tasks / proc / acc / pay / inv / refund / fb / files）
+        - status: dict(text=..., level=...)
+        - finance: 与 get_contract_finance_summary 相同的财务汇总
+    """
+    stmt = (
+        select(
+            Contract,
+            SalesInfo,
+            *[_count_column(model, cond, key) for key, (model, cond) in OVERVIEW_COUNTS.items()],
+            *status_flag_columns(Contract.id),
+            *[_sum_column(model, key) for key, model in OVERVIEW_SUMS.items()],
+        )
+        .outerjoin(SalesInfo, SalesInfo.contract_id == Contract.id)
+        .where(Contract.id == contract_id)
+        .options(
+            joinedload(Contract.company),
+            joinedload(SalesInfo.sales_person),
+            selectinload(Contract.department_leaders).options(
+                joinedload(ProjectDepartmentLeader.department),
+                joinedload(ProjectDepartmentLeader.person).joinedload(Person.department),
+            ),
+        )
+    )
+    row = db.session.execute(stmt).first()
+    if row is None:
+        return None
+
+    contract = row.Contract
+    sales = row.SalesInfo
+
+    stats = {key: getattr(row, f'count_{key}') or 0 for key in OVERVIEW_COUNTS}
+
+    flags = {key: bool(getattr(row, key)) for key in STATUS_FLAG_KEYS}
+    status_text, status_level = derive_contract_status(**flags)
+
+    finance = build_finance_summary(
+        sales.quote_amount if sales is not None else None,
+        row.paid_total,
+        row.refund_total,
+        row.invoiced_total,
+    )
+
+    return dict(
+        contract=contract,
+        sales=sales,
+        leaders=sorted(contract.department_leaders, key=lambda l: l.id),
+        stats=stats,
+        status=dict(text=status_text, level=status_level),
+        finance=finance,
+    )
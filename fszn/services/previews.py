@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+项目文件的缩略图（预览图）。
+
+设计目的：
+- 文件列表只有文件名，想确认是哪张图纸只能把几 MB 的 PDF / 图片整个下载下来；
+- 上传完成后把“生成缩略图”的任务交给进程池（PREVIEW_WORKERS 个进程），
+  上传请求不等待渲染；PDF 取第一页，图片直接缩放，统一输出 PNG；
+- 缩略图按内容缓存在 UPLOAD_FOLDER/previews/ab/<hash>.png，
+  相同内容的文件共用一张；URL 带内容版本号，响应可以长期缓存；
+- 功能上线前上传的文件：第一次请求缩略图时才排队生成（懒生成）。
+
+依赖（可选）：Pillow 处理图片，PyMuPDF（fitz）处理 PDF；
+没装的格式不生成缩略图，列表照常显示文件名。
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from importlib.util import find_spec
+from typing import Optional
+
+from ..models import ProjectFile
+from .blob_store import file_disk_path
+
+
+# 缩略图最大宽高（像素）
+PREVIEW_SIZE = 320
+
+PREVIEW_DIRNAME = 'previews'
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp'}
+
+# 只检查是否安装，真正的 import 在工作进程里做，Web 进程不加载这些库
+HAS_PIL = find_spec('PIL') is not None
+HAS_PYMUPDF = find_spec('fitz') is not None
+
+
+def preview_kind(pf: ProjectFile) -> Optional[str]:
+    """能生成缩略图时返回 'pdf' / 'image'，否则返回 None"""
+    name = pf.stored_filename or pf.original_filename or ''
+    ext = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    if ext == 'pdf' and HAS_PYMUPDF:
+        return 'pdf'
+    if ext in IMAGE_EXTENSIONS and HAS_PIL:
+        return 'image'
+    return None
+
+
+def preview_key(upload_folder: str, pf: ProjectFile) -> Optional[str]:
+    """
+    缩略图的缓存键：有内容哈希时就用哈希；
+    历史文件用 文件 ID + 修改时间 + 大小（文件被替换后自动换键）。
+    """
+    if pf.content_hash:
+        return pf.content_hash
+    try:
+        st = os.stat(file_disk_path(upload_folder, pf))
+    except OSError:
+        return None
+    return f'legacy-{pf.id}-{int(st.st_mtime)}-{st.st_size}'
+
+
+def preview_path(upload_folder: str, key: str) -> str:
+    shard = key[:2] if not key.startswith('legacy-') else 'legacy'
+    return os.path.join(upload_folder, PREVIEW_DIRNAME, shard, f'{key}.png')
+
+
+def render_preview(kind: str, src_path: str, dest_path: str, size: int = PREVIEW_SIZE) -> str:
+    """在工作进程里执行：渲染缩略图，先写临时文件再原子改名"""
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    tmp_path = f'{dest_path}.{os.getpid()}.tmp'
+
+    if kind == 'pdf':
+        import fitz
+
+        with fitz.open(src_path) as doc:
+            page = doc.load_page(0)
+            zoom = size / max(page.rect.width, page.rect.height)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            pix.save(tmp_path, output='png')
+    else:
+        from PIL import Image
+
+        with Image.open(src_path) as img:
+            img.thumbnail((size, size))
+            if img.mode not in ('RGB', 'RGBA', 'L'):
+                img = img.convert('RGBA')
+            img.save(tmp_path, format='PNG')
+
+    os.replace(tmp_path, dest_path)
+    return dest_path
+
+
+class PreviewRenderer:
+    """进程池 + 去重的缩略图任务队列（每个 app 一个）"""
+
+    def __init__(self, upload_folder: str, workers: int = 2, size: int = PREVIEW_SIZE):
+        self.upload_folder = upload_folder
+        self.workers = max(1, workers)
+        self.size = size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # fork 出来的子进程不能沿用父进程的进程池，需要重新创建
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._pid = os.getpid()
+            self._pending = set()
+        return self._executor
+
+    def submit(self, pf: ProjectFile) -> bool:
+        """排队生成缩略图；已有缓存、正在生成或不支持的格式返回 False"""
+        kind = preview_kind(pf)
+        key = preview_key(self.upload_folder, pf) if kind else None
+        if key is None:
+            return False
+        dest = preview_path(self.upload_folder, key)
+        if os.path.exists(dest):
+            return False
+
+        src = file_disk_path(self.upload_folder, pf)
+        with self._lock:
+            executor = self._get_executor()
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            future = executor.submit(render_preview, kind, src, dest, self.size)
+
+        def _done(f, key=key):
+            with self._lock:
+                self._pending.discard(key)
+
+        future.add_done_callback(_done)
+        return True
+
+    def shutdown(self) -> None:
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def init_preview_renderer(app) -> Optional[PreviewRenderer]:
+    """在 create_app 中调用：装了 Pillow / PyMuPDF 之一时创建渲染器"""
+    if not (HAS_PIL or HAS_PYMUPDF):
+        return None
+    renderer = PreviewRenderer(
+        app.config['UPLOAD_FOLDER'],
+        workers=app.config.get('PREVIEW_WORKERS', 2),
+    )
+    app.extensions['preview_renderer'] = renderer
+    atexit.register(renderer.shutdown)
+    return renderer
+
+
+def get_preview_renderer(app) -> Optional[PreviewRenderer]:
+    """当前 app 的缩略图渲染器；没装依赖时返回 None"""
+    return app.extensions.get('preview_renderer')
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+部门 / 人员下拉框数据的进程内缓存。
+
+设计目的：
+- 任务、采购、验收、负责人、销售、反馈等页面每次打开都要
+  把整张人员表（部分还有部门表）查出来，只为了填下拉框；
+- 这些基础数据一周也改不了几次，这里缓存轻量的只读投影
+  （部门：id / name；人员：id / name / position / department_id）；
+- 缓存带一个版本号，org.py 里新增 / 编辑 / 删除部门或人员后
+  调用 bump_reference_version()，本进程的缓存立即作废；
+- 多进程部署时其它进程感知不到版本号变化，靠 REFERENCE_CACHE_TTL 兜底过期。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import namedtuple
+from typing import Callable, Dict, List, Tuple
+
+from flask import current_app
+
+from .. import db
+from ..models import Department, Person
+
+
+DepartmentRef = namedtuple('DepartmentRef', ['id', 'name'])
+PersonRef = namedtuple('PersonRef', ['id', 'name', 'position', 'department_id'])
+
+_lock = threading.Lock()
+_version = 0
+# 缓存 key -> (版本号, 过期时间, 数据)
+_cache: Dict[str, Tuple[int, float, list]] = {}
+
+
+def bump_reference_version() -> int:
+    """部门 / 人员数据有变化时调用：版本号 +1，旧缓存全部作废"""
+    global _version
+    with _lock:
+        _version += 1
+        _cache.clear()
+        return _version
+
+
+def _cached(key: str, loader: Callable[[], list]) -> list:
+    ttl = current_app.config.get('REFERENCE_CACHE_TTL', 300)
+    now = time.monotonic()
+
+    with _lock:
+        version = _version
+        entry = _cache.get(key)
+    if entry and entry[0] == version and entry[1] > now:
+        return entry[2]
+
+    data = loader()
+    with _lock:
+        # 加载期间版本号变了就不写回，避免把旧数据放进新版本
+        if _version == version:
+            _cache[key] = (version, now + ttl, data)
+    return data
+
+
+def get_department_choices() -> List[DepartmentRef]:
+    """全部部门（按 ID 排序）"""
+    def load():
+        rows = db.session.query(Department.id, Department.name).order_by(Department.id.asc())
+        return [DepartmentRef(*row) for row in rows]
+
+    return _cached('departments', load)
+
+
+# 人员支持的排序方式
+_PERSON_ORDERS = {
+    'id': (Person.id.asc(),),
+    'name': (Person.name.asc(), Person.id.asc()),
+}
+
+
+def get_person_choices(order: str = 'id') -> List[PersonRef]:
+    """全部人员；order='id' 按 ID 排序，order='name' 按姓名排序（排序在数据库里做）"""
+    order_by = _PERSON_ORDERS[order]
+
+    def load():
+        rows = (
+            db.session.query(Person.id, Person.name, Person.position, Person.department_id)
+            .order_by(*order_by)
+        )
+        return [PersonRef(*row) for row in rows]
+
+    return _cached(f'persons:{order}', load)
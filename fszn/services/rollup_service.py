@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+合同汇总表（contract_rollups）的维护 Service。
+
+设计目的：
+- 每个合同一行，缓存子记录计数、验收/反馈标志、派生状态、金额合计；
+- 通过 Session 的 after_flush 事件，在任务 / 验收 / 付款 / 开票 / 退款 / 反馈
+  增删改时，于同一事务内重算受影响合同的汇总行，视图层无需关心；
+- 列表页可以直接在 SQL 里按状态筛选、排序；
+- 提供 rebuild_rollups / verify_rollups 用于修复漂移（见 `flask rollups ...` 命令），
+  fill_missing_rollups 为历史合同补建汇总行（`flask schema upgrade` 时自动执行）。
+
+注意：Query.delete() 这类批量删除不会触发 flush 事件，调用方需要自行处理
+（比如删除合同时显式删除对应汇总行）。
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Any, Set
+
+from sqlalchemy import event, func, select, exists, and_, inspect
+from sqlalchemy.orm import Session
+
+from .. import db
+from ..models import (
+    Contract, Task, Acceptance, Payment, Invoice, Refund, Feedback,
+    ContractRollup,
+)
+from .status_service import (
+    ID_BATCH_SIZE,
+    STATUS_SORT_ORDER,
+    derive_contract_status,
+    exists_flag,
+)
+
+
+ZERO = Decimal('0.00')
+
+# 会影响汇总行的子记录模型
+ROLLUP_CHILD_MODELS = (Task, Acceptance, Payment, Invoice, Refund, Feedback)
+
+# 汇总行中需要比对/写入的字段
+ROLLUP_FIELDS = (
+    'tasks_count',
+    'acceptances_count',
+    'payments_count',
+    'invoices_count',
+    'refunds_count',
+    'feedbacks_count',
+    'has_accepted',
+    'has_unresolved_feedback',
+    'status_text',
+    'status_level',
+    'status_sort',
+    'paid_total',
+    'refund_total',
+    'invoiced_total',
+)
+
+
+def _count_of(model):
+    return (
+        select(func.count())
+        .select_from(model)
+        .where(model.contract_id == Contract.id)
+        .scalar_subquery()
+    )
+
+
+def _sum_of(model):
+    return (
+        select(func.coalesce(func.sum(model.amount), 0))
+        .where(model.contract_id == Contract.id)
+        .scalar_subquery()
+    )
+
+
+def compute_rollups(contract_ids: Iterable[int], connection=None) -> Dict[int, Dict[str, Any]]:
+    """
+    按批计算合同汇总值（每 1000 个合同一次查询），返回 {contract_id: {字段: 值}}。
+
+    connection 为空时使用当前 db.session；flush 事件里会传入当前连接。
+    """
+    executor = connection if connection is not None else db.session
+    ids = list(dict.fromkeys(cid for cid in contract_ids if cid is not None))
+    result: Dict[int, Dict[str, Any]] = {}
+
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[start:start + ID_BATCH_SIZE]
+        stmt = (
+            select(
+                Contract.id,
+                _count_of(Task).label('tasks_count'),
+                _count_of(Acceptance).label('acceptances_count'),
+                _count_of(Payment).label('payments_count'),
+                _count_of(Invoice).label('invoices_count'),
+                _count_of(Refund).label('refunds_count'),
+                _count_of(Feedback).label('feedbacks_count'),
+                exists_flag(and_(
+                    Acceptance.contract_id == Contract.id,
+                    Acceptance.status == '通过',
+                )).label('has_accepted'),
+                exists_flag(and_(
+                    Feedback.contract_id == Contract.id,
+                    Feedback.is_resolved == False,  # noqa: E712
+                )).label('has_unresolved_feedback'),
+                _sum_of(Payment).label('paid_total'),
+                _sum_of(Refund).label('refund_total'),
+                _sum_of(Invoice).label('invoiced_total'),
+            )
+            .where(Contract.id.in_(batch))
+        )
+        for row in executor.execute(stmt):
+            has_accepted = bool(row.has_accepted)
+            has_unresolved_feedback = bool(row.has_unresolved_feedback)
+            status_text, status_level = derive_contract_status(
+                has_tasks=row.tasks_count > 0,
+                has_payments=row.payments_count > 0,
+                has_invoices=row.invoices_count > 0,
+                has_acceptance=row.acceptances_count > 0,
+                has_accepted=has_accepted,
+                has_unresolved_feedback=has_unresolved_feedback,
+            )
+            result[row.id] = dict(
+                tasks_count=row.tasks_count,
+                acceptances_count=row.acceptances_count,
+                payments_count=row.payments_count,
+                invoices_count=row.invoices_count,
+                refunds_count=row.refunds_count,
+                feedbacks_count=row.feedbacks_count,
+                has_accepted=has_accepted,
+                has_unresolved_feedback=has_unresolved_feedback,
+                status_text=status_text,
+                status_level=status_level,
+                status_sort=STATUS_SORT_ORDER.get(status_text, 0),
+                paid_total=Decimal(row.paid_total or ZERO),
+                refund_total=Decimal(row.refund_total or ZERO),
+                invoiced_total=Decimal(row.invoiced_total or ZERO),
+            )
+
+    return result
+
+
+def refresh_rollups(contract_ids: Iterable[int], connection=None) -> int:
+    """
+    重算并写入（更新或插入）指定合同的汇总行，不提交事务。
+
+    返回写入的行数。已不存在的合同不会写入。
+    """
+    executor = connection if connection is not None else db.session
+    values_map = compute_rollups(contract_ids, connection=connection)
+    if not values_map:
+        return 0
+
+    table = ContractRollup.__table__
+    ids = list(values_map.keys())
+    existing: Set[int] = set()
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[start:start + ID_BATCH_SIZE]
+        existing.update(
+            executor.execute(
+                select(table.c.contract_id).where(table.c.contract_id.in_(batch))
+            ).scalars()
+        )
+
+    now = datetime.utcnow()
+    inserts: List[Dict[str, Any]] = []
+    for cid, values in values_map.items():
+        if cid in existing:
+            executor.execute(
+                table.update()
+                .where(table.c.contract_id == cid)
+                .values(updated_at=now, **values)
+            )
+        else:
+            inserts.append(dict(contract_id=cid, **values))
+
+    if inserts:
+        executor.execute(table.insert(), inserts)
+
+    return len(values_map)
+
+
+def _collect_contract_ids(session: Session) -> Set[int]:
+    """从本次 flush 涉及的对象中，找出需要重算汇总的合同 ID"""
+    ids: Set[int] = set()
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Contract):
+            # 新建合同：插入一行初始汇总；删除合同由调用方负责删除汇总行
+            if obj in session.new and obj.id is not None:
+                ids.add(obj.id)
+            continue
+
+        if not isinstance(obj, ROLLUP_CHILD_MODELS):
+            continue
+
+        # contract_id 被修改时，新旧两个合同都要重算
+        hist = inspect(obj).attrs.contract_id.history
+        for cid in list(hist.added) + list(hist.unchanged) + list(hist.deleted):
+            if cid is not None:
+                ids.add(cid)
+
+    # 本次 flush 中被删除的合同不再维护
+    for obj in session.deleted:
+        if isinstance(obj, Contract):
+            ids.discard(obj.id)
+
+    return ids
+
+
+def _after_flush(session: Session, flush_context) -> None:
+    ids = _collect_contract_ids(session)
+    if ids:
+        refresh_rollups(ids, connection=session.connection())
+
+
+def register_rollup_events() -> None:
+    """注册 flush 事件（create_app 中调用，重复调用无副作用）"""
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+
+
+def rebuild_rollups(batch_size: int = ID_BATCH_SIZE) -> Dict[str, int]:
+    """
+    全量重建汇总表（不提交事务，调用方负责 commit）：
+    - 为所有合同重算并写入汇总行；
+    - 删除已无对应合同的孤儿汇总行。
+    """
+    table = ContractRollup.__table__
+    refreshed = 0
+    last_id = 0
+    while True:
+        ids = list(
+            db.session.execute(
+                select(Contract.id)
+                .where(Contract.id > last_id)
+                .order_by(Contract.id.asc())
+                .limit(batch_size)
+            ).scalars()
+        )
+        if not ids:
+            break
+        refreshed += refresh_rollups(ids)
+        last_id = ids[-1]
+
+    orphans = db.session.execute(
+        table.delete().where(~exists().where(Contract.id == table.c.contract_id))
+    ).rowcount or 0
+
+    return dict(refreshed=refreshed, orphans_removed=orphans)
+
+
+def fill_missing_rollups(batch_size: int = ID_BATCH_SIZE) -> int:
+    """
+    只为还没有汇总行的合同补建汇总行（不提交事务，调用方负责 commit），返回补建行数。
+
+    汇总表上线前的历史合同没有汇总行，`flask schema upgrade` 建表后随即调用；
+    已有汇总行的合同不重算，可重复执行。
+    """
+    table = ContractRollup.__table__
+    filled = 0
+    last_id = 0
+    while True:
+        ids = list(
+            db.session.execute(
+                select(Contract.id)
+                .where(Contract.id > last_id)
+                .where(~exists().where(table.c.contract_id == Contract.id))
+                .order_by(Contract.id.asc())
+                .limit(batch_size)
+            ).scalars()
+        )
+        if not ids:
+            break
+        filled += refresh_rollups(ids)
+        last_id = ids[-1]
+    return filled
+
+
+def verify_rollups(batch_size: int = ID_BATCH_SIZE) -> List[int]:
+    """
+    校验汇总表与实时计算结果是否一致，返回有漂移（或缺失汇总行）的合同 ID 列表。
+    """
+    drifted: List[int] = []
+    last_id = 0
+    while True:
+        ids = list(
+            db.session.execute(
+                select(Contract.id)
+                .where(Contract.id > last_id)
+                .order_by(Contract.id.asc())
+                .limit(batch_size)
+            ).scalars()
+        )
+        if not ids:
+            break
+        expected = compute_rollups(ids)
+        # 直接读表（不走 ORM 标识映射），避免读到会话里缓存的旧值
+        table = ContractRollup.__table__
+        stored = {
+            r.contract_id: r
+            for r in db.session.execute(
+                select(table).where(table.c.contract_id.in_(ids))
+            )
+        }
+        for cid in ids:
+            row = stored.get(cid)
+            values = expected.get(cid)
+            if row is None or values is None:
+                drifted.append(cid)
+                continue
+            if any(getattr(row, k) != values[k] for k in ROLLUP_FIELDS):
+                drifted.append(cid)
+        last_id = ids[-1]
+
+    return drifted
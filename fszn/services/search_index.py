@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+列表页子串检索的 n-gram 索引 Service。
+
+设计目的：
+- `ilike('%关键字%')` 前导通配符无法使用索引，每次检索都要全表扫描；
+- 这里把需要模糊检索的字段拆成二元组（bigram，中文按字切分即可），
+  存到 search_ngrams 表，并在 (类型, 字段, 二元组) 上建索引；
+- 检索时先用关键字的全部二元组在索引表里求交集得到候选 ID，
+  再只对候选行做 ilike 校验，保证结果与原来的模糊匹配完全一致；
+- 单个字符的关键字拆不出二元组，仍然直接走 ilike。
+
+索引通过 Session 的 after_flush 事件随公司 / 合同 / 人员的增删改自动维护，
+历史数据可以用 `flask search reindex` 一次性补齐。
+
+操作日志的说明（message）不在写日志时同步建索引（每条日志会多写几十上百行二元组，
+又把写入成本放回了请求里）：
+- index_operation_logs 按日志 ID 顺序分批补建，进度记在 search_index_state；
+  由异步日志写入线程在每批写入后调用，也可以用 `flask search index-logs` 定时执行，
+  `flask oplog archive` 结束时也会补一次；
+- ID 是写入时分配的，提交顺序却不一定按 ID：异步写入线程和并发请求里，
+  较小的 ID 可能在较大的 ID 之后才提交。进度只推进到“落定”的 ID
+  （SEARCH_LOG_INDEX_GRACE 秒之前观察到的最大 ID，见 _settled_log_id），
+  晚提交的日志不会被进度跳过；
+- 检索时已建索引的部分（ID <= 进度）走 n-gram 候选集，尚未建索引的尾部（ID > 进度）
+  直接 ilike，按主键范围只扫最近的少量日志，见 log_message_condition。
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from flask import current_app
+
+from sqlalchemy import event, func, select, and_, or_, inspect
+from sqlalchemy.orm import Session
+
+from .. import db
+from ..models import Company, Contract, Person, OperationLog, SearchGram, SearchIndexState
+
+
+# 需要建索引的实体及字段：模型 -> (实体类型, [字段名...])
+INDEXED_FIELDS = {
+    Company: ('Company', ('name',)),
+    Contract: ('Contract', ('project_code', 'contract_number')),
+    Person: ('Person', ('name',)),
+}
+
+# 操作日志说明的索引：实体类型 / 字段名（后台批量维护，不在 INDEXED_FIELDS 里）
+LOG_ENTITY_TYPE = 'OperationLog'
+LOG_FIELD = 'message'
+
+NGRAM_SIZE = 2
+
+
+def make_grams(text: Optional[str]) -> Set[str]:
+    """把文本拆成二元组集合（统一转小写，与 ilike 的大小写不敏感保持一致）"""
+    if not text:
+        return set()
+    text = text.lower()
+    if len(text) < NGRAM_SIZE:
+        return set()
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+def ngram_candidates(entity_type: str, field: str, keyword: str):
+    """
+    返回“可能包含该关键字”的实体 ID 子查询；关键字不足两个字符时返回 None。
+
+    候选集是必要条件：包含关键字的文本一定包含关键字的全部二元组。
+    """
+    grams = make_grams(keyword)
+    if not grams:
+        return None
+    return (
+        select(SearchGram.entity_id)
+        .where(
+            SearchGram.entity_type == entity_type,
+            SearchGram.field == field,
+            SearchGram.gram.in_(sorted(grams)),
+        )
+        .group_by(SearchGram.entity_id)
+        .having(func.count(func.distinct(SearchGram.gram)) == len(grams))
+    )
+
+
+def keyword_condition(column, entity_id_col, entity_type: str, field: str, keyword: str):
+    """
+    构造“column 包含 keyword”的查询条件。
+
+    - 关键字 >= 2 个字符：先按 n-gram 索引限定候选 ID，再 ilike 校验；
+    - 关键字只有 1 个字符，或含 LIKE 通配符（% / _）：退回普通 ilike。
+    """
+    like = column.ilike(f"%{keyword}%")
+    if '%' in keyword or '_' in keyword:
+        return like
+    candidates = ngram_candidates(entity_type, field, keyword)
+    if candidates is None:
+        return like
+    return and_(entity_id_col.in_(candidates), like)
+
+
+def _index_rows(entity_type: str, entity_id: int, field: str, text: Optional[str]) -> List[Dict]:
+    return [
+        dict(entity_type=entity_type, entity_id=entity_id, field=field, gram=gram)
+        for gram in sorted(make_grams(text))
+    ]
+
+
+def reindex_entities(
+    items: Iterable[Tuple[object, bool]],
+    connection=None,
+    clear_existing: bool = True,
+) -> None:
+    """
+    重建若干实体的索引（不提交事务）。
+
+    items: [(ORM 对象, 是否已删除), ...]；已删除的实体只清除索引。
+    clear_existing=False 时跳过“先删旧索引”（全量重建时表已清空）。
+    """
+    executor = connection if connection is not None else db.session
+    table = SearchGram.__table__
+
+    inserts: List[Dict] = []
+    for obj, deleted in items:
+        entity_type, fields = INDEXED_FIELDS[type(obj)]
+        if clear_existing:
+            executor.execute(
+                table.delete().where(and_(
+                    table.c.entity_type == entity_type,
+                    table.c.entity_id == obj.id,
+                ))
+            )
+        if deleted:
+            continue
+        for field in fields:
+            inserts.extend(_index_rows(entity_type, obj.id, field, getattr(obj, field)))
+
+    if inserts:
+        executor.execute(table.insert(), inserts)
+
+
+def _field_changed(obj, fields) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[f].history.has_changes() for f in fields)
+
+
+def _after_flush(session: Session, flush_context) -> None:
+    # 新插入的实体还没有索引，不需要先删旧索引
+    new_items = [(obj, False) for obj in session.new if type(obj) in INDEXED_FIELDS]
+    if new_items:
+        reindex_entities(new_items, connection=session.connection(), clear_existing=False)
+
+    items: List[Tuple[object, bool]] = []
+
+    for obj in session.dirty:
+        if type(obj) in INDEXED_FIELDS and _field_changed(obj, INDEXED_FIELDS[type(obj)][1]):
+            items.append((obj, False))
+
+    for obj in session.deleted:
+        if type(obj) in INDEXED_FIELDS:
+            items.append((obj, True))
+
+    if items:
+        reindex_entities(items, connection=session.connection())
+
+
+def register_search_index_events() -> None:
+    """注册 flush 事件（create_app 中调用，重复调用无副作用）"""
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+
+
+def rebuild_search_index(batch_size: int = 500) -> Dict[str, int]:
+    """
+    全量重建公司 / 合同 / 人员的 n-gram 索引（不提交事务，调用方负责 commit），返回各类实体的数量。
+    操作日志的索引同时清空、进度归零，之后由 index_operation_logs 重新补建。
+    """
+    db.session.execute(SearchGram.__table__.delete())
+    _log_index_state().last_id = 0
+
+    counts: Dict[str, int] = {}
+    for model, (entity_type, _fields) in INDEXED_FIELDS.items():
+        total = 0
+        last_id = 0
+        while True:
+            batch = (
+                model.query
+                .filter(model.id > last_id)
+                .order_by(model.id.asc())
+                .limit(batch_size)
+                .all()
+            )
+            if not batch:
+                break
+            reindex_entities(((obj, False) for obj in batch), clear_existing=False)
+            total += len(batch)
+            last_id = batch[-1].id
+        counts[entity_type] = total
+
+    return counts
+
+
+# ---------------------- 操作日志说明：后台批量索引 ----------------------
+
+def _log_index_state() -> SearchIndexState:
+    state = db.session.get(SearchIndexState, LOG_ENTITY_TYPE)
+    if state is None:
+        state = SearchIndexState(name=LOG_ENTITY_TYPE, last_id=0)
+        db.session.add(state)
+        db.session.flush()
+    return state
+
+
+def log_index_watermark() -> int:
+    """已建好说明索引的最大日志 ID（ID 不超过它的日志都已建索引）"""
+    last_id = db.session.execute(
+        select(SearchIndexState.last_id).where(SearchIndexState.name == LOG_ENTITY_TYPE)
+    ).scalar()
+    return last_id or 0
+
+
+def _settled_log_id(grace_seconds: float) -> int:
+    """
+    可以建索引的最大日志 ID（提交事务）。
+
+    每隔 grace_seconds 记一次当时的最大日志 ID：比它小的 ID 在那时都已分配，
+    只要写日志的事务不超过宽限期，过了宽限期这些日志就都已提交或回滚，
+    之后不会再冒出 ID 不超过它的新日志。宽限期为 0 时直接取当前最大 ID（测试 / 单进程用）。
+    """
+    state = _log_index_state()
+    now = datetime.utcnow()
+    max_id = db.session.execute(select(func.max(OperationLog.id))).scalar() or 0
+    if grace_seconds <= 0:
+        state.settled_id = max_id
+    elif state.pending_at is None or state.pending_at <= now - timedelta(seconds=grace_seconds):
+        if state.pending_at is not None:
+            state.settled_id = max(state.settled_id or 0, state.pending_id or 0)
+        state.pending_id = max_id
+        state.pending_at = now
+    settled = state.settled_id or 0
+    db.session.commit()
+    return settled
+
+
+def index_operation_logs(
+    batch_size: int = 500,
+    limit: Optional[int] = None,
+    grace_seconds: Optional[float] = None,
+) -> int:
+    """
+    从进度往后给已落定的日志说明建 n-gram 索引，每批提交一次，返回本次建索引的日志条数。
+
+    grace_seconds 默认取配置 SEARCH_LOG_INDEX_GRACE；刚写入的日志要等宽限期过后才建索引，
+    在那之前检索时走 ilike（见 log_message_condition）。
+    进度用条件 UPDATE 推进：多个进程同时执行时，同一批只有一个会提交成功，
+    其余回滚（连同已插入的二元组），不会重复建索引。
+    """
+    if grace_seconds is None:
+        grace_seconds = current_app.config.get('SEARCH_LOG_INDEX_GRACE', 300)
+    table = SearchGram.__table__
+    state_table = SearchIndexState.__table__
+    settled_id = _settled_log_id(grace_seconds)
+
+    total = 0
+    while limit is None or total < limit:
+        last_id = log_index_watermark()
+        size = batch_size if limit is None else min(batch_size, limit - total)
+        rows = db.session.execute(
+            select(OperationLog.id, OperationLog.message)
+            .where(OperationLog.id > last_id, OperationLog.id <= settled_id)
+            .order_by(OperationLog.id.asc())
+            .limit(size)
+        ).all()
+        if not rows:
+            db.session.rollback()
+            break
+
+        inserts: List[Dict] = []
+        for log_id, message in rows:
+            inserts.extend(_index_rows(LOG_ENTITY_TYPE, log_id, LOG_FIELD, message))
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+        advanced = db.session.execute(
+            state_table.update()
+            .where(state_table.c.name == LOG_ENTITY_TYPE, state_table.c.last_id == last_id)
+            .values(last_id=rows[-1].id)
+        ).rowcount
+        if advanced != 1:
+            # 别的进程已经建过这一批
+            db.session.rollback()
+            break
+        db.session.commit()
+        total += len(rows)
+
+    return total
+
+
+def log_message_condition(keyword: str):
+    """
+    “日志说明包含 keyword”的查询条件：
+    已建索引的日志走 n-gram 候选集，尚未建索引的尾部日志直接 ilike。
+    """
+    like = OperationLog.message.ilike(f"%{keyword}%")
+    if '%' in keyword or '_' in keyword:
+        return like
+    candidates = ngram_candidates(LOG_ENTITY_TYPE, LOG_FIELD, keyword)
+    if candidates is None:
+        return like
+    watermark = log_index_watermark()
+    return or_(
+        and_(OperationLog.id <= watermark, OperationLog.id.in_(candidates), like),
+        and_(OperationLog.id > watermark, like),
+    )
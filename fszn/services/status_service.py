@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+项目状态（5 种业务状态）相关的 Service。
+
+设计目的：
+- 原来的 get_contract_status 每个合同要跑 6 次 COUNT，列表页循环调用，
+  合同一多就是上万次数据库往返；
+- 这里改成“按一批合同 ID 一次性查询”：每个合同一行，
+  用 EXISTS 子查询把各类标志位一起算出来，再统一推导状态；
+- 单个合同的 get_contract_status 也复用这里的逻辑，保证两边结果完全一致。
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import exists, and_, or_, case, select
+
+from .. import db
+from ..models import Contract, Task, Payment, Invoice, Acceptance, Feedback
+
+
+# SQL Server 单条语句最多 2100 个参数，IN 列表按批拆分，留足余量
+ID_BATCH_SIZE = 1000
+
+
+# 全部 5 种业务状态文本
+CONTRACT_STATUS_TEXTS = (
+    '未启动',
+    '生产中',
+    '已验收，待回款',
+    '已回款，有未解决问题',
+    '已完成',
+)
+
+# 状态排序序号：与 Python 里按状态文本 sorted() 的顺序一致，
+# 这样 SQL 里 ORDER BY 序号 和原来在 Python 层按文本排序结果相同
+STATUS_SORT_ORDER = {text: i for i, text in enumerate(sorted(CONTRACT_STATUS_TEXTS))}
+
+
+# 状态标志位的字段名（与下面 status_flag_columns 的 label 一一对应）
+STATUS_FLAG_KEYS = (
+    'has_tasks',
+    'has_payments',
+    'has_invoices',
+    'has_acceptance',
+    'has_accepted',
+    'has_unresolved_feedback',
+)
+
+
+def exists_flag(cond):
+    """EXISTS 标志位列：SQL Server 不允许 EXISTS 直接作为列，包一层 CASE 转成 1/0"""
+    return case((exists().where(cond), 1), else_=0)
+
+
+def _status_flags(contract_id_col) -> Dict:
+    """针对给定的合同 ID 列，构造 6 个 EXISTS 标志位表达式：{字段名: 1/0 表达式}"""
+    return {
+        'has_tasks': exists_flag(Task.contract_id == contract_id_col),
+        'has_payments': exists_flag(Payment.contract_id == contract_id_col),
+        'has_invoices': exists_flag(Invoice.contract_id == contract_id_col),
+        'has_acceptance': exists_flag(Acceptance.contract_id == contract_id_col),
+        'has_accepted': exists_flag(
+            and_(
+                Acceptance.contract_id == contract_id_col,
+                Acceptance.status == '通过',
+            )
+        ),
+        'has_unresolved_feedback': exists_flag(
+            and_(
+                Feedback.contract_id == contract_id_col,
+                Feedback.is_resolved == False,  # noqa: E712  与原 filter_by(is_resolved=False) 保持一致
+            )
+        ),
+    }
+
+
+def status_flag_columns(contract_id_col) -> List:
+    """针对给定的合同 ID 列，构造 6 个 EXISTS 标志位列。"""
+    return [expr.label(name) for name, expr in _status_flags(contract_id_col).items()]
+
+
+def status_text_expression(contract_id_col):
+    """
+    SQL 版的 derive_contract_status（只算状态文本），规则与 Python 版逐条对应：
+    用于汇总行缺失的合同在 SQL 里按状态筛选 / 排序。
+    """
+    flag = {name: expr == 1 for name, expr in _status_flags(contract_id_col).items()}
+    return case(
+        (~or_(flag['has_tasks'], flag['has_acceptance'], flag['has_payments'], flag['has_invoices']), '未启动'),
+        (~flag['has_accepted'], '生产中'),
+        (~flag['has_payments'], '已验收，待回款'),
+        (flag['has_unresolved_feedback'], '已回款，有未解决问题'),
+        else_='已完成',
+    )
+
+
+def status_sort_expression(status_text_expr):
+    """状态文本 -> 排序序号（与 STATUS_SORT_ORDER 一致）"""
+    return case(STATUS_SORT_ORDER, value=status_text_expr, else_=0)
+
+
+def derive_contract_status(
+    has_tasks: bool,
+    has_payments: bool,
+    has_invoices: bool,
+    has_acceptance: bool,
+    has_accepted: bool,
+    has_unresolved_feedback: bool,
+) -> Tuple[str, str]:
+    """根据标志位推导 5 种业务状态，返回 (状态文本, 颜色级别)"""
+    # 1）未启动：什么记录都没有
+    if (not has_tasks) and (not has_acceptance) and (not has_payments) and (not has_invoices):
+        return "未启动", "grey"
+
+    # 2）生产中：还没有任何“通过”的验收，但已经开始执行
+    if not has_accepted:
+        # 有任务 / 有验收记录（进行中或不通过） / 有发票等，都可以认为已经在执行
+        return "生产中", "blue"
+
+    # 3）已验收，待回款：有通过验收，但一分钱还没收到
+    if has_accepted and (not has_payments):
+        return "已验收，待回款", "orange"
+
+    # 4）已回款，有未解决问题：有通过验收 + 有收款 + 有未解决反馈
+    if has_accepted and has_payments and has_unresolved_feedback:
+        return "已回款，有未解决问题", "red"
+
+    # 5）已完成：有通过验收 + 有收款 + 没有未解决反馈
+    if has_accepted and has_payments and (not has_unresolved_feedback):
+        return "已完成", "green"
+
+    # 理论上不会走到这里，但为了安全，统一归为“生产中”
+    return "生产中", "blue"
+
+
+def get_contract_status_flags(contract_ids: Iterable[int]) -> Dict[int, Dict[str, bool]]:
+    """
+    批量查询一批合同的状态标志位。
+
+    返回：{contract_id: {has_tasks: bool, ...}}
+    不存在的合同 ID 不会出现在结果里。
+    """
+    ids = list(dict.fromkeys(cid for cid in contract_ids if cid is not None))
+    result: Dict[int, Dict[str, bool]] = {}
+
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[start:start + ID_BATCH_SIZE]
+        stmt = (
+            select(Contract.id, *status_flag_columns(Contract.id))
+            .where(Contract.id.in_(batch))
+        )
+        for row in db.session.execute(stmt):
+            result[row.id] = {key: bool(getattr(row, key)) for key in STATUS_FLAG_KEYS}
+
+    return result
+
+
+def get_contract_statuses(contract_ids: Iterable[int]) -> Dict[int, Tuple[str, str]]:
+    """
+    批量计算一批合同的业务状态。
+
+    返回：{contract_id: (状态文本, 颜色级别)}
+    每 1000 个合同只需一次数据库往返，结果与逐个调用 get_contract_status 相同。
+    """
+    flags_map = get_contract_status_flags(contract_ids)
+    return {cid: derive_contract_status(**flags) for cid, flags in flags_map.items()}
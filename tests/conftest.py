@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共夹具：每个测试一个全新的 SQLite 内存数据库 + 临时上传目录。
+
+夹具本身不保持 app context：每个请求和真实环境一样使用自己的 Session，
+测试里准备数据 / 检查结果时自己 with app.app_context()。
+
+运行：python -m pytest
+"""
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from fszn import create_app, db
+from fszn.models import User
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'LOG_ARCHIVE_FOLDER': str(tmp_path / 'log_archive'),
+        # 不跨请求缓存登录用户，每个请求固定查一次 users 表
+        'USER_CACHE_TTL': 0,
+        'AUDIT_ASYNC': False,
+        'CONTRACT_PURGE_ASYNC': False,
+    })
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+@pytest.fixture
+def make_user(app):
+    """创建用户，返回用户 ID"""
+    def _make_user(role='boss', username=None):
+        with app.app_context():
+            username = username or f'{role}-{User.query.count() + 1}'
+            user = User(username=username, email=f'{username}@example.com', password_hash='x', role=role)
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+    return _make_user
+
+
+@pytest.fixture
+def client(app, make_user):
+    """以 boss 身份登录的测试客户端（client.user_id 为登录用户的 ID）"""
+    client = app.test_client()
+    client.user_id = make_user('boss')
+    with client.session_transaction() as sess:
+        sess['user_id'] = client.user_id
+    return client
+
+
+@pytest.fixture
+def count_queries(app):
+    """统计代码块内执行的 SQL 语句：with count_queries() as statements: ..."""
+    with app.app_context():
+        engine = db.engine
+
+    @contextmanager
+    def _count_queries():
+        statements = []
+
+        def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', _before_cursor_execute)
+    return _count_queries
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""异步日志写入器：flush 等待队列写完，不额外创建线程"""
+
+import threading
+from datetime import datetime
+
+from fszn.models import OperationLog
+from fszn.services.audit_writer import AuditWriter
+
+
+def _row(i):
+    return dict(action='file.download', target_type='ProjectFile', target_id=i,
+                message=f'下载文件 {i}', created_at=datetime.utcnow())
+
+
+def test_flush_waits_for_queued_rows(app):
+    writer = AuditWriter(app, batch_size=7, flush_interval=0.05)
+    try:
+        for i in range(50):
+            assert writer.submit(_row(i))
+        threads = threading.active_count()
+        assert writer.flush(timeout=10)
+        assert threading.active_count() == threads
+        assert writer.stats()['written'] == 50
+        assert writer.stats()['backlog'] == 0
+        with app.app_context():
+            assert OperationLog.query.count() == 50
+    finally:
+        writer.shutdown()
+
+
+def test_flush_times_out_while_worker_is_busy(app):
+    writer = AuditWriter(app, flush_interval=0.05)
+    release = threading.Event()
+    write = writer._write
+
+    def slow_write(rows):
+        release.wait(10)
+        write(rows)
+
+    writer._write = slow_write
+    try:
+        writer.submit(_row(1))
+        assert not writer.flush(timeout=0.1)
+        release.set()
+        assert writer.flush(timeout=10)
+    finally:
+        release.set()
+        writer.shutdown()
+
+
+def test_flush_without_worker_returns_immediately(app):
+    assert AuditWriter(app).flush(timeout=0)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""批量查询每条语句的绑定参数不超过 SQL Server 的上限（2100）"""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+from fszn import db
+from fszn.models import Company, Contract, Invoice, Payment, Refund, SalesInfo
+from fszn.services.finance_service import ID_BATCH_SIZE, get_finance_summaries
+from fszn.services.status_service import get_contract_statuses
+
+MSSQL_MAX_PARAMETERS = 2100
+# 除合同 ID 外，语句里的常量（状态 '通过'、标志位 1/0 等）也会绑定成参数
+CONSTANT_PARAMETERS = 20
+
+
+@pytest.fixture
+def bound_parameters(app):
+    """每条语句的绑定参数个数列表"""
+    with app.app_context():
+        engine = db.engine
+    counts = []
+
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counts.append(len(parameters))
+
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    yield counts
+    event.remove(engine, 'before_cursor_execute', _before_cursor_execute)
+
+
+@pytest.mark.parametrize('batch_query', [get_finance_summaries, get_contract_statuses])
+def test_contract_ids_are_bound_once_per_statement(app, bound_parameters, batch_query):
+    ids = list(range(1, 2 * ID_BATCH_SIZE + 2))
+    with app.app_context():
+        batch_query(ids)
+
+    assert len(bound_parameters) == 3
+    assert max(bound_parameters) <= ID_BATCH_SIZE + CONSTANT_PARAMETERS <= MSSQL_MAX_PARAMETERS
+
+
+def test_finance_summaries_totals(app):
+    with app.app_context():
+        company = Company(name='客户公司')
+        db.session.add(company)
+        db.session.flush()
+        quoted = Contract(company_id=company.id, project_code='P1', contract_number='HT1', name='有报价')
+        empty = Contract(company_id=company.id, project_code='P2', contract_number='HT2', name='无明细')
+        db.session.add_all([quoted, empty])
+        db.session.flush()
+        db.session.add_all([
+            SalesInfo(contract_id=quoted.id, quote_amount=Decimal('1000')),
+            Payment(contract_id=quoted.id, amount=Decimal('300'), date=date(2024, 1, 1)),
+            Payment(contract_id=quoted.id, amount=Decimal('200'), date=date(2024, 2, 1)),
+            Refund(contract_id=quoted.id, amount=Decimal('50'), date=date(2024, 3, 1)),
+            Invoice(contract_id=quoted.id, amount=Decimal('600'), date=date(2024, 3, 1)),
+        ])
+        db.session.commit()
+
+        summaries = get_finance_summaries([quoted.id, empty.id, 999])
+
+    assert set(summaries) == {quoted.id, empty.id}
+    assert summaries[quoted.id]['net_received'] == Decimal('450')
+    assert summaries[quoted.id]['receivable_remaining'] == Decimal('550')
+    assert summaries[quoted.id]['invoice_remaining'] == Decimal('400')
+    assert summaries[empty.id]['paid_total'] == Decimal('0')
+    assert summaries[empty.id]['receivable_remaining'] is None
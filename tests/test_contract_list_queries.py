@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""合同列表页的查询次数不随合同数量增长（防止 N+1 懒加载回归）"""
+
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from fszn import db
+from fszn.contracts import STATUS_FILTERS
+from fszn.models import (
+    Company, Contract, ContractRollup, Department, Payment, Person,
+    ProjectDepartmentLeader, SalesInfo,
+)
+from fszn.pagination import encode_cursor
+
+
+def _seed_contracts(start, count):
+    """
+    追加 count 个合同，每个合同：独立的公司、销售信息（含销售负责人）、
+    两个部门负责人、一笔付款（付款会生成汇总行）
+    """
+    departments = Department.query.order_by(Department.id).all()
+    if not departments:
+        departments = [Department(name='机械'), Department(name='电气')]
+        db.session.add_all(departments)
+        db.session.flush()
+
+    base = datetime(2024, 1, 1)
+    for i in range(start, start + count):
+        company = Company(name=f'公司{i}')
+        sales = Person(name=f'销售{i}')
+        leaders = [Person(name=f'负责人{i}-{d.id}', department_id=d.id) for d in departments]
+        db.session.add_all([company, sales] + leaders)
+        db.session.flush()
+
+        contract = Contract(
+            company_id=company.id,
+            project_code=f'P{i:04d}',
+            contract_number=f'HT{i:04d}',
+            name=f'合同{i}',
+            created_at=base + timedelta(hours=i),
+        )
+        db.session.add(contract)
+        db.session.flush()
+
+        db.session.add(SalesInfo(
+            contract_id=contract.id, sales_person_id=sales.id,
+            quote_amount=100, deal_date=date(2024, 1, 1) + timedelta(days=i),
+        ))
+        for dept, person in zip(departments, leaders):
+            db.session.add(ProjectDepartmentLeader(
+                contract_id=contract.id, department_id=dept.id, person_id=person.id,
+            ))
+        db.session.add(Payment(contract_id=contract.id, amount=10, date=date(2024, 2, 1)))
+    db.session.commit()
+
+
+def _status_param():
+    """种子数据里所有合同状态相同，取对应的筛选参数"""
+    status_text = db.session.query(ContractRollup.status_text).limit(1).scalar()
+    return next(key for key, text in STATUS_FILTERS.items() if text == status_text)
+
+
+def _keyset_cursor():
+    """从第二个合同之后开始翻页（下一页包含其余全部合同）"""
+    contract = Contract.query.order_by(Contract.created_at.desc(), Contract.id.desc()).offset(1).first()
+    return encode_cursor(contract.created_at, contract.id)
+
+
+LIST_VARIANTS = {
+    'default': lambda: '/contracts/?per_page=200',
+    'status_filter': lambda: f'/contracts/?per_page=200&status={_status_param()}',
+    'status_order': lambda: '/contracts/?per_page=200&order=status_desc',
+    'keyset_after': lambda: f'/contracts/?per_page=200&after={_keyset_cursor()}',
+    'deal_date_order': lambda: '/contracts/?per_page=200&order=deal_date_desc',
+}
+
+
+def _query_count(app, client, count_queries, url_factory):
+    with app.app_context():
+        url = url_factory()
+    with count_queries() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(statements)
+
+
+def _seed(app, start, count):
+    with app.app_context():
+        _seed_contracts(start, count)
+
+
+@pytest.mark.parametrize('variant', sorted(LIST_VARIANTS))
+def test_list_query_count_does_not_grow_with_contracts(app, client, count_queries, variant):
+    _seed(app, 0, 5)
+    small = _query_count(app, client, count_queries, LIST_VARIANTS[variant])
+
+    # 共 15 个合同，是原来的 3 倍；每页 200 条，页面上的合同数同样变成 3 倍
+    _seed(app, 5, 10)
+    large = _query_count(app, client, count_queries, LIST_VARIANTS[variant])
+
+    assert small == large
+
+
+def test_list_page_renders_every_contract(app, client):
+    _seed(app, 0, 15)
+    body = client.get('/contracts/?per_page=200').get_data(as_text=True)
+    assert 'P0000' in body and 'P0014' in body
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""合同总览页的查询预算：登录用户 1 条 + 总览 2 条，与合同下挂多少记录无关"""
+
+from datetime import date
+
+import pytest
+
+from fszn import db
+from fszn.models import (
+    Acceptance, Company, Contract, Department, Feedback, Invoice, Payment, Person,
+    ProcurementItem, ProjectDepartmentLeader, ProjectFile, Refund, SalesInfo, Task,
+)
+
+# 登录用户查询 + 总览的合同聚合查询 + 部门负责人查询
+OVERVIEW_QUERY_BUDGET = 3
+
+
+def _seed_contract(children, uploader_id):
+    """一个合同，每类子记录各 children 条"""
+    company = Company(name='客户公司')
+    sales = Person(name='销售')
+    db.session.add_all([company, sales])
+    db.session.flush()
+
+    contract = Contract(company_id=company.id, project_code='P0001', contract_number='HT0001', name='合同')
+    db.session.add(contract)
+    db.session.flush()
+    db.session.add(SalesInfo(contract_id=contract.id, sales_person_id=sales.id, quote_amount=1000))
+
+    for i in range(children):
+        dept = Department(name=f'部门{i}')
+        db.session.add(dept)
+        db.session.flush()
+        person = Person(name=f'人员{i}', department_id=dept.id)
+        db.session.add(person)
+        db.session.flush()
+        db.session.add_all([
+            ProjectDepartmentLeader(contract_id=contract.id, department_id=dept.id, person_id=person.id),
+            Task(contract_id=contract.id, department_id=dept.id, person_id=person.id,
+                 title=f'任务{i}', start_date=date(2024, 1, 1)),
+            ProcurementItem(contract_id=contract.id, item_name=f'物料{i}', quantity=1),
+            Acceptance(contract_id=contract.id, stage_name=f'阶段{i}', date=date(2024, 2, 1)),
+            Payment(contract_id=contract.id, amount=10, date=date(2024, 3, 1)),
+            Invoice(contract_id=contract.id, amount=20, date=date(2024, 3, 1)),
+            Refund(contract_id=contract.id, amount=1, date=date(2024, 3, 2)),
+            Feedback(contract_id=contract.id, content=f'反馈{i}', handler_id=person.id),
+            ProjectFile(contract_id=contract.id, uploader_id=uploader_id, file_type='tech',
+                        original_filename=f'f{i}.pdf', stored_filename=f'f{i}.pdf'),
+        ])
+    db.session.commit()
+    return contract.id
+
+
+@pytest.mark.parametrize('children', [1, 20])
+def test_overview_query_budget(app, client, count_queries, children):
+    with app.app_context():
+        contract_id = _seed_contract(children, client.user_id)
+
+    with count_queries() as statements:
+        response = client.get(f'/contracts/{contract_id}/overview')
+
+    assert response.status_code == 200
+    assert len(statements) == OVERVIEW_QUERY_BUDGET, statements
+    body = response.get_data(as_text=True)
+    assert f'人员{children - 1}' in body
+
+
+def test_overview_missing_contract_is_404(app, client):
+    assert client.get('/contracts/999/overview').status_code == 404
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""合同墓碑删除：删除后所有查询都看不到它；后台分批清理子记录、磁盘文件和合同本身"""
+
+import hashlib
+import io
+import os
+from datetime import date
+
+import pytest
+
+from fszn import db
+from fszn.models import (
+    Acceptance, Company, Contract, ContractPurge, ContractRollup, Department, Feedback, Invoice,
+    Payment, Person, ProjectDepartmentLeader, ProjectFile, SalesInfo, Task,
+)
+from fszn.services import contract_purge
+from fszn.services.blob_store import blob_path, store_stream
+from fszn.services.contract_purge import (
+    INCLUDE_DELETED, PURGE_STEPS, find_contract_by_code, purge_deleted_contracts,
+)
+
+SHARED = b'shared drawing'
+OWN = b'only in the deleted contract'
+CHILD_MODELS = (Task, Acceptance, Payment, Invoice, Feedback, ProjectDepartmentLeader, SalesInfo, ProjectFile)
+
+
+def _seed_contract(code, company, dept, person, uploader_id, contents, upload_folder):
+    contract = Contract(company_id=company.id, project_code=code, contract_number=f'HT-{code}', name=code)
+    db.session.add(contract)
+    db.session.flush()
+    db.session.add_all([
+        SalesInfo(contract_id=contract.id, sales_person_id=person.id, quote_amount=100),
+        ProjectDepartmentLeader(contract_id=contract.id, department_id=dept.id, person_id=person.id),
+        Feedback(contract_id=contract.id, content='反馈'),
+    ])
+    for i in range(3):
+        db.session.add_all([
+            Task(contract_id=contract.id, department_id=dept.id, title=f'任务{i}', start_date=date(2024, 1, 1)),
+            Acceptance(contract_id=contract.id, stage_name=f'阶段{i}', date=date(2024, 2, 1)),
+            Payment(contract_id=contract.id, amount=10, date=date(2024, 3, 1)),
+            Invoice(contract_id=contract.id, amount=10, date=date(2024, 3, 1)),
+        ])
+    for i, content in enumerate(contents):
+        blob = store_stream(io.BytesIO(content), upload_folder)
+        db.session.add(ProjectFile(
+            contract_id=contract.id, uploader_id=uploader_id, file_type='tech',
+            original_filename=f'{code}-{i}.pdf', stored_filename=f'{code}-{i}.pdf',
+            content_hash=blob.content_hash, file_size=blob.size,
+        ))
+    db.session.flush()
+    return contract.id
+
+
+@pytest.fixture
+def contracts(app, client):
+    """要删除的合同 DEL（独占一个 blob，另一个 blob 与 KEEP 共用）和保留的合同 KEEP"""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    with app.app_context():
+        company = Company(name='客户公司')
+        dept = Department(name='机械')
+        db.session.add_all([company, dept])
+        db.session.flush()
+        person = Person(name='张工', department_id=dept.id)
+        db.session.add(person)
+        db.session.flush()
+        ids = dict(
+            deleted=_seed_contract('DEL', company, dept, person, client.user_id, [OWN, SHARED], upload_folder),
+            kept=_seed_contract('KEEP', company, dept, person, client.user_id, [SHARED], upload_folder),
+        )
+        db.session.commit()
+
+    # 修改时间很新的 blob 可能刚被其它上传复用，清理时会跳过；这里把修改时间调到很久以前
+    for content in (OWN, SHARED):
+        os.utime(_blob(app, content), (1e9, 1e9))
+    return ids
+
+
+def _blob(app, content):
+    return blob_path(app.config['UPLOAD_FOLDER'], hashlib.sha256(content).hexdigest())
+
+
+def _child_counts(contract_id):
+    return {model.__tablename__: model.query.filter_by(contract_id=contract_id).count() for model in CHILD_MODELS}
+
+
+def test_deleted_contract_is_hidden_everywhere(app, client, contracts):
+    deleted = contracts['deleted']
+    response = client.post(f'/contracts/{deleted}/delete')
+    assert response.status_code == 302
+
+    body = client.get('/contracts/?per_page=200').get_data(as_text=True)
+    assert 'KEEP' in body and 'DEL' not in body
+    assert client.get(f'/contracts/{deleted}/overview').status_code == 404
+
+    with app.app_context():
+        assert db.session.get(Contract, deleted) is None
+        assert Contract.query.filter_by(project_code='DEL').first() is None
+        assert [c.project_code for c in Company.query.one().contracts] == ['KEEP']
+        assert all(t.contract is None for t in Task.query.filter_by(contract_id=deleted))
+
+        # 显式要求时仍能看到；项目编号在清理完成前仍被占用
+        assert db.session.get(Contract, deleted, execution_options={INCLUDE_DELETED: True}) is not None
+        assert find_contract_by_code('DEL').id == deleted
+        purge = db.session.get(ContractPurge, deleted)
+        assert purge.finished_at is None and purge.requested_by_id == client.user_id
+
+
+def test_purge_removes_rows_and_unreferenced_blobs(app, client, contracts):
+    deleted, kept = contracts['deleted'], contracts['kept']
+    client.post(f'/contracts/{deleted}/delete')
+
+    with app.app_context():
+        before = _child_counts(deleted)
+        kept_before = _child_counts(kept)
+        result = purge_deleted_contracts(app.config['UPLOAD_FOLDER'], batch_size=2)
+
+        assert result['contracts'] == 1
+        assert result['rows'] == sum(before.values()) + 1  # 加上汇总行
+        assert result['files'] == 1 and result['bytes'] == len(OWN)
+        assert not os.path.exists(_blob(app, OWN))
+        assert os.path.exists(_blob(app, SHARED))
+
+        assert db.session.get(Contract, deleted, execution_options={INCLUDE_DELETED: True}) is None
+        assert set(_child_counts(deleted).values()) == {0}
+        assert ContractRollup.query.filter_by(contract_id=deleted).count() == 0
+        assert _child_counts(kept) == kept_before
+        assert db.session.get(ContractPurge, deleted).finished_at is not None
+
+        # 再跑一遍没有要清理的
+        assert purge_deleted_contracts(app.config['UPLOAD_FOLDER'])['contracts'] == 0
+
+
+def test_interrupted_purge_resumes_from_checkpoint(app, client, contracts, monkeypatch):
+    deleted = contracts['deleted']
+    client.post(f'/contracts/{deleted}/delete')
+
+    purge_batch = contract_purge._purge_batch
+
+    def failing_batch(upload_folder, model, purge, batch_size):
+        if model is Payment:
+            raise RuntimeError('数据库连接断开')
+        return purge_batch(upload_folder, model, purge, batch_size)
+
+    with app.app_context():
+        monkeypatch.setattr(contract_purge, '_purge_batch', failing_batch)
+        with pytest.raises(RuntimeError):
+            purge_deleted_contracts(app.config['UPLOAD_FOLDER'], batch_size=2)
+
+        purge = db.session.get(ContractPurge, deleted)
+        assert purge.finished_at is None and purge.locked_by is None
+        assert '数据库连接断开' in purge.last_error
+        assert purge.stage == PURGE_STEPS[PURGE_STEPS.index(Payment) - 1].__tablename__
+        assert Task.query.filter_by(contract_id=deleted).count() == 0
+        assert Payment.query.filter_by(contract_id=deleted).count() == 3
+
+        monkeypatch.setattr(contract_purge, '_purge_batch', purge_batch)
+        result = purge_deleted_contracts(app.config['UPLOAD_FOLDER'], batch_size=2)
+        assert result['contracts'] == 1
+        assert set(_child_counts(deleted).values()) == {0}
+        assert db.session.get(ContractPurge, deleted).last_error is None
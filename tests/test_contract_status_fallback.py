@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""缺汇总行的历史合同：列表按状态筛选 / 排序仍然正确，schema upgrade 会补建汇总行"""
+
+import re
+from datetime import date
+
+import pytest
+
+from fszn import db
+from fszn.contracts import STATUS_FILTERS
+from fszn.models import Acceptance, Company, Contract, ContractRollup, Department, Feedback, Payment, Task
+from fszn.services.rollup_service import compute_rollups, fill_missing_rollups
+
+
+def _seed_one_contract_per_status():
+    """每种状态各一个合同，项目编号为 PC-<状态筛选参数>"""
+    company = Company(name='客户公司')
+    dept = Department(name='机械')
+    db.session.add_all([company, dept])
+    db.session.flush()
+
+    contracts = {}
+    for key in STATUS_FILTERS:
+        contract = Contract(company_id=company.id, project_code=f'PC-{key}', contract_number=f'HT-{key}', name=key)
+        db.session.add(contract)
+        db.session.flush()
+        contracts[key] = contract.id
+
+    def accepted(cid):
+        db.session.add(Acceptance(contract_id=cid, stage_name='终验', date=date(2024, 2, 1), status='通过'))
+
+    def paid(cid):
+        db.session.add(Payment(contract_id=cid, amount=10, date=date(2024, 3, 1)))
+
+    db.session.add(Task(contract_id=contracts['in_production'], department_id=dept.id,
+                        title='装配', start_date=date(2024, 1, 1)))
+    accepted(contracts['accepted_pending_payment'])
+    accepted(contracts['paid_with_issues'])
+    paid(contracts['paid_with_issues'])
+    db.session.add(Feedback(contract_id=contracts['paid_with_issues'], content='异响', is_resolved=False))
+    accepted(contracts['finished'])
+    paid(contracts['finished'])
+    db.session.commit()
+    return contracts
+
+
+def _drop_rollups():
+    """模拟汇总表上线前的历史数据"""
+    db.session.execute(ContractRollup.__table__.delete())
+    db.session.commit()
+
+
+def _listed_codes(client, query):
+    body = client.get(f'/contracts/?per_page=200&{query}').get_data(as_text=True)
+    codes = re.findall(r'PC-(\w+)', body)
+    # 同一合同在一行里可能出现多次，按首次出现的顺序去重
+    return list(dict.fromkeys(codes))
+
+
+@pytest.fixture
+def contracts(app):
+    with app.app_context():
+        return _seed_one_contract_per_status()
+
+
+@pytest.mark.parametrize('status', sorted(STATUS_FILTERS))
+def test_status_filter_without_rollups(app, client, contracts, status):
+    with app.app_context():
+        _drop_rollups()
+    assert _listed_codes(client, f'status={status}') == [status]
+
+
+@pytest.mark.parametrize('order', ['status_asc', 'status_desc'])
+def test_status_order_without_rollups_matches_rollup_order(app, client, contracts, order):
+    expected = _listed_codes(client, f'order={order}')
+    assert sorted(expected) == sorted(STATUS_FILTERS)
+
+    with app.app_context():
+        _drop_rollups()
+    assert _listed_codes(client, f'order={order}') == expected
+
+
+def test_fill_missing_rollups(app, contracts):
+    with app.app_context():
+        _drop_rollups()
+        assert fill_missing_rollups() == len(contracts)
+        db.session.commit()
+
+        stored = {r.contract_id: r.status_text for r in ContractRollup.query}
+        expected = {cid: v['status_text'] for cid, v in compute_rollups(contracts.values()).items()}
+        assert stored == expected
+        assert {stored[cid] for cid in contracts.values()} == set(STATUS_FILTERS.values())
+
+        # 已有汇总行的合同不再补建
+        assert fill_missing_rollups() == 0
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+导出（合同 / 操作日志）：分块读取时，同一连接上不能有未读完的结果集。
+
+SQL Server 的 pyodbc 连接没开 MARS 时，上一个结果集还没读完就执行新查询会报
+“Connection is busy with results for another hstmt”；这里用包装过的游标在 SQLite 上模拟。
+"""
+
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.engine.default import DefaultExecutionContext
+
+from fszn import contracts as contracts_module
+from fszn import db
+from fszn.models import Company, Contract, Department, OperationLog, Person, ProjectDepartmentLeader
+
+CHUNK_SIZE = 3
+
+
+class _SingleResultCursor:
+    """执行时如果还有别的游标没关闭（结果集没读完），按 SQL Server 的报错处理"""
+
+    def __init__(self, cursor, open_cursors):
+        self._cursor = cursor
+        self._open = open_cursors
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _check(self):
+        if any(c is not self for c in self._open):
+            raise AssertionError('Connection is busy with results for another hstmt')
+        self._open.add(self)
+
+    def execute(self, *args):
+        self._check()
+        return self._cursor.execute(*args)
+
+    def executemany(self, *args):
+        self._check()
+        return self._cursor.executemany(*args)
+
+    def close(self):
+        self._open.discard(self)
+        return self._cursor.close()
+
+
+@pytest.fixture
+def single_result_connection(monkeypatch):
+    open_cursors = set()
+    original = DefaultExecutionContext.create_default_cursor
+
+    def create_default_cursor(self):
+        return _SingleResultCursor(original(self), open_cursors)
+
+    monkeypatch.setattr(DefaultExecutionContext, 'create_default_cursor', create_default_cursor)
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(contracts_module, 'EXPORT_CHUNK_SIZE', CHUNK_SIZE)
+
+
+def _seed_contracts(count):
+    company = Company(name='客户公司')
+    dept = Department(name='机械')
+    db.session.add_all([company, dept])
+    db.session.flush()
+    person = Person(name='张工', department_id=dept.id)
+    db.session.add(person)
+    db.session.flush()
+    for i in range(count):
+        contract = Contract(company_id=company.id, project_code=f'P{i:04d}', contract_number=f'HT{i:04d}',
+                            name=f'合同{i}', created_at=datetime(2024, 1, 1) + timedelta(hours=i))
+        db.session.add(contract)
+        db.session.flush()
+        db.session.add(ProjectDepartmentLeader(contract_id=contract.id, department_id=dept.id, person_id=person.id))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('order, expected', [
+    ('', [f'P{i:04d}' for i in reversed(range(10))]),
+    ('created_at_asc', [f'P{i:04d}' for i in range(10)]),
+    ('status_asc', [f'P{i:04d}' for i in reversed(range(10))]),
+])
+def test_contract_export_in_chunks(app, client, small_chunks, single_result_connection, order, expected):
+    with app.app_context():
+        _seed_contracts(10)
+
+    response = client.get(f'/contracts/export?format=csv&order={order}')
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True).lstrip('﻿'))))
+    assert [row[2] for row in rows[1:]] == expected
+    assert all('机械：张工' in row for row in rows[1:])
+
+
+def test_operation_log_export_in_pages(app, client, small_chunks, single_result_connection):
+    base = datetime(2024, 5, 1)
+    with app.app_context():
+        # 同一时间的多条日志跨页，检验 (created_at, id) 游标不重不漏
+        for i in range(10):
+            db.session.add(OperationLog(user_id=client.user_id, action='contract.update', target_id=i,
+                                        message=f'修改 {i}', created_at=base + timedelta(minutes=i // 4)))
+        db.session.commit()
+
+    response = client.get('/contracts/operation_logs/export?format=ndjson&action=contract.update')
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [r['target_id'] for r in records] == [9, 8, 7, 6, 5, 4, 3, 2, 1, 0]
+    assert {r['username'] for r in records} == {'boss-1'}
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""文件下载的校验头：Last-Modified 取文件记录的上传时间，不随共用 blob 的修改时间变化"""
+
+import io
+import json
+import os
+from datetime import datetime
+
+from werkzeug.http import http_date
+
+from fszn import db
+from fszn.models import Company, Contract, OperationLog, ProjectFile
+from fszn.services.blob_store import blob_path, store_stream
+
+CONTENT = b'%PDF-1.4 drawing'
+
+
+def _seed_shared_blob(app, uploader_id):
+    """同一内容的两条文件记录，上传时间不同；返回 (合同 ID, {文件 ID: 上传时间})"""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    with app.app_context():
+        company = Company(name='客户公司')
+        db.session.add(company)
+        db.session.flush()
+        contract = Contract(company_id=company.id, project_code='P0001', contract_number='HT0001', name='合同')
+        db.session.add(contract)
+        db.session.flush()
+
+        uploaded = {}
+        for i, created_at in enumerate([datetime(2024, 1, 1, 8), datetime(2024, 6, 1, 8)]):
+            blob = store_stream(io.BytesIO(CONTENT), upload_folder)
+            pf = ProjectFile(
+                contract_id=contract.id, uploader_id=uploader_id, file_type='tech',
+                original_filename=f'f{i}.pdf', stored_filename=f'f{i}.pdf',
+                content_hash=blob.content_hash, file_size=blob.size, created_at=created_at,
+            )
+            db.session.add(pf)
+            db.session.flush()
+            uploaded[pf.id] = created_at
+        db.session.commit()
+        return contract.id, uploaded
+
+
+def test_last_modified_is_per_file_and_survives_dedup(app, client):
+    contract_id, uploaded = _seed_shared_blob(app, client.user_id)
+    upload_folder = app.config['UPLOAD_FOLDER']
+
+    for file_id, created_at in uploaded.items():
+        response = client.get(f'/contracts/{contract_id}/files/{file_id}/download')
+        assert response.status_code == 200
+        assert response.data == CONTENT
+        assert response.headers['Last-Modified'] == http_date(created_at)
+
+    # 再次上传同样内容：blob 的修改时间被刷新，已有文件的校验头不变
+    blob = store_stream(io.BytesIO(CONTENT), upload_folder)
+    assert blob.deduplicated
+    os.utime(blob_path(upload_folder, blob.content_hash), (2e9, 2e9))
+
+    for file_id, created_at in uploaded.items():
+        response = client.get(
+            f'/contracts/{contract_id}/files/{file_id}/download',
+            headers={'If-Modified-Since': http_date(created_at)},
+        )
+        assert response.status_code == 304
+
+
+def _download_log_actions(app):
+    with app.app_context():
+        return [
+            (log.action, json.loads(log.extra_data or '{}').get('range'))
+            for log in OperationLog.query.filter(OperationLog.action.like('file.download%')).order_by(OperationLog.id)
+        ]
+
+
+def test_range_requests_are_logged_by_outcome(app, client):
+    contract_id, uploaded = _seed_shared_blob(app, client.user_id)
+    url = f'/contracts/{contract_id}/files/{next(iter(uploaded))}/download'
+
+    partial = client.get(url, headers={'Range': 'bytes=0-3'})
+    assert partial.status_code == 206
+    assert partial.data == CONTENT[:4]
+
+    beyond = client.get(url, headers={'Range': f'bytes={len(CONTENT) + 100}-'})
+    assert beyond.status_code == 416
+    assert beyond.headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+    assert _download_log_actions(app) == [
+        ('file.download_partial', 'bytes=0-3'),
+        ('file.download_range_not_satisfiable', f'bytes={len(CONTENT) + 100}-'),
+    ]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""下载权限：同一条规则的 Python 判断（test）和 SQL 条件（clause）结果一致"""
+
+from itertools import product
+
+import pytest
+
+from fszn import db
+from fszn.auth import CurrentUser
+from fszn.models import Company, Contract, ProjectFile
+from fszn.services.file_service import (
+    DOWNLOAD_POLICY, SameOwnerRole, evaluate_file_downloads, file_download_clause,
+)
+
+OWNER_ROLES = [None, '', '  ', 'sales', 'Sales', ' sales ', 'finance']
+
+# 策略表里出现的每个角色，加上“其它员工”和大小写 / 空格 / 空角色的变体
+POLICY_ROLES = sorted({role for rule in DOWNLOAD_POLICY for role in (rule.roles or ())})
+USER_ROLES = POLICY_ROLES + ['Boss', ' customer ', 'sales', 'SALES', ' Sales ', 'finance', '', None]
+
+
+def _user(role):
+    return CurrentUser(id=1, username='u', email='u@example.com', role=role)
+
+
+@pytest.fixture
+def files(app, make_user):
+    uploader_id = make_user('sales')
+    with app.app_context():
+        company = Company(name='客户公司')
+        db.session.add(company)
+        db.session.flush()
+        contract = Contract(company_id=company.id, project_code='P0001', contract_number='HT0001', name='合同')
+        db.session.add(contract)
+        db.session.flush()
+        for i, (owner_role, is_public, file_type) in enumerate(
+            product(OWNER_ROLES, [True, False], ['contract', 'tech', 'drawing'])
+        ):
+            db.session.add(ProjectFile(
+                contract_id=contract.id, uploader_id=uploader_id, file_type=file_type,
+                original_filename=f'f{i}.pdf', stored_filename=f'f{i}.pdf',
+                owner_role=owner_role, is_public=is_public,
+            ))
+        db.session.commit()
+
+
+@pytest.mark.parametrize('role', USER_ROLES + ['<anonymous>'])
+def test_python_and_sql_download_rules_agree(app, files, role):
+    user = None if role == '<anonymous>' else _user(role)
+    with app.app_context():
+        all_files = ProjectFile.query.all()
+        in_python = {file_id for file_id, ok in evaluate_file_downloads(user, all_files).items() if ok}
+        in_sql = {pf.id for pf in ProjectFile.query.filter(file_download_clause(user))}
+    assert in_python == in_sql
+
+
+@pytest.mark.parametrize('owner_role, user_role, allowed', [
+    (None, 'sales', True),
+    ('', 'sales', True),
+    ('sales', 'sales', True),
+    (None, None, True),
+    # 按原值精确比较：大小写、空格不同都不放行，全空格也算有归属
+    ('Sales', 'sales', False),
+    (' sales ', 'sales', False),
+    ('  ', 'sales', False),
+    ('finance', 'sales', False),
+    ('sales', None, False),
+    ('sales', '', False),
+])
+def test_same_owner_role_compares_exactly(owner_role, user_role, allowed):
+    pf = ProjectFile(owner_role=owner_role)
+    assert SameOwnerRole().test(pf, _user(user_role)) is allowed
+
+
+def test_same_owner_role_allows_anonymous():
+    assert SameOwnerRole().test(ProjectFile(owner_role='sales'), None)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""操作日志归档：归档后从数据库删除，读取时跨块按 (created_at, id) 归并，字段原样还原"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from fszn import db
+from fszn.models import OperationLog
+from fszn.services.log_archive import archive_operation_logs, iter_archived_logs, load_segment_index
+
+BLOCK_SIZE = 3
+
+
+def _add_logs(month_start, count, offset=0):
+    """按 ID 顺序插入，但创建时间打乱，归档出的各块时间范围互相交叠"""
+    for i in range(count):
+        db.session.add(OperationLog(
+            action='payment.create',
+            target_type='Payment',
+            target_id=offset + i,
+            contract_id=7,
+            project_code='P0007',
+            amount=Decimal('10.50') + i,
+            message=f'登记付款 {offset + i}',
+            extra_data='{"contract_id": 7}',
+            created_at=month_start + timedelta(hours=(i * 7) % count, minutes=offset),
+        ))
+    db.session.commit()
+
+
+def _key(log):
+    return (log.created_at, log.id)
+
+
+@pytest.fixture
+def archived(app):
+    """2024-01 / 2024-02 各 10 条旧日志归档，另有 1 条近期日志留在数据库；返回归档前的日志快照"""
+    folder = app.config['LOG_ARCHIVE_FOLDER']
+    with app.app_context():
+        _add_logs(datetime(2024, 1, 1), 10)
+        _add_logs(datetime(2024, 2, 1), 10, offset=100)
+        db.session.add(OperationLog(action='contract.update', message='近期', created_at=datetime.utcnow()))
+        db.session.commit()
+        snapshot = {
+            log.id: (log.created_at, log.message, log.amount, log.project_code, log.extra_data)
+            for log in OperationLog.query if log.message != '近期'
+        }
+
+        assert archive_operation_logs(folder, months=6, block_size=BLOCK_SIZE) == {'2024-01': 10, '2024-02': 10}
+    return folder, snapshot
+
+
+def test_archive_moves_old_rows_out_of_the_database(app, archived):
+    folder, snapshot = archived
+    with app.app_context():
+        assert [log.message for log in OperationLog.query] == ['近期']
+        assert len(load_segment_index(folder, '2024-01')['blocks']) == 4
+        # 重复执行不会再归档
+        assert archive_operation_logs(folder, months=6, block_size=BLOCK_SIZE) == {}
+
+
+def test_round_trip_preserves_fields_and_order(archived):
+    folder, snapshot = archived
+    logs = list(iter_archived_logs(folder))
+
+    assert {log.id for log in logs} == set(snapshot)
+    assert [_key(log) for log in logs] == sorted((_key(log) for log in logs), reverse=True)
+    for log in logs:
+        assert log.archived
+        assert (log.created_at, log.message, log.amount, log.project_code, log.extra_data) == snapshot[log.id]
+
+    ascending = list(iter_archived_logs(folder, descending=False))
+    assert [log.id for log in ascending] == [log.id for log in reversed(logs)]
+
+
+def test_late_block_is_merged_into_order(app, archived):
+    """追加归档一个时间落在已有块之间的块，读取顺序仍然正确"""
+    folder, _ = archived
+    with app.app_context():
+        _add_logs(datetime(2024, 1, 1), 4, offset=30)
+        assert archive_operation_logs(folder, months=6, block_size=BLOCK_SIZE) == {'2024-01': 4}
+
+    keys = [_key(log) for log in iter_archived_logs(folder, descending=False)]
+    assert len(keys) == 24
+    assert keys == sorted(keys)
+
+
+@pytest.mark.parametrize('descending', [True, False])
+def test_cursor_paging_covers_every_row_once(archived, descending):
+    folder, snapshot = archived
+    seen, after = [], None
+    while True:
+        page = []
+        for log in iter_archived_logs(folder, descending=descending, after=after):
+            page.append(log)
+            if len(page) == 4:
+                break
+        if not page:
+            break
+        seen.extend(page)
+        after = _key(page[-1])
+
+    assert [_key(log) for log in seen] == sorted((_key(log) for log in seen), reverse=descending)
+    assert sorted(log.id for log in seen) == sorted(snapshot)
+
+
+def test_time_range_and_row_filter(archived):
+    folder, snapshot = archived
+    february = list(iter_archived_logs(folder, start=datetime(2024, 2, 1), end=datetime(2024, 2, 29)))
+    assert {log.id for log in february} == {i for i, v in snapshot.items() if v[0].month == 2}
+
+    big = list(iter_archived_logs(folder, row_filter=lambda row: Decimal(row['amount']) >= Decimal('18')))
+    assert {log.amount for log in big} == {Decimal('18.50'), Decimal('19.50')}
+    assert len(big) == 4
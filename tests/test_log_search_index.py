@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""操作日志说明的 n-gram 索引：进度只推进到已落定的 ID，晚提交的日志不会被跳过"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from fszn import db
+from fszn.models import OperationLog, SearchGram, SearchIndexState
+from fszn.services.search_index import (
+    LOG_ENTITY_TYPE, index_operation_logs, log_index_watermark, log_message_condition,
+)
+
+GRACE = 60
+
+
+@pytest.fixture
+def grace(app):
+    app.config['SEARCH_LOG_INDEX_GRACE'] = GRACE
+
+
+def _add_log(log_id, message):
+    db.session.add(OperationLog(id=log_id, action='contract.update', message=message, created_at=datetime.utcnow()))
+    db.session.commit()
+
+
+def _indexed_ids():
+    return {
+        row[0] for row in
+        db.session.query(SearchGram.entity_id).filter(SearchGram.entity_type == LOG_ENTITY_TYPE).distinct()
+    }
+
+
+def _search(keyword):
+    return {log.id for log in OperationLog.query.filter(log_message_condition(keyword))}
+
+
+def _let_grace_pass():
+    state = db.session.get(SearchIndexState, LOG_ENTITY_TYPE)
+    state.pending_at -= timedelta(seconds=GRACE + 1)
+    db.session.commit()
+
+
+def test_late_commit_below_indexed_id_is_indexed(app, grace):
+    with app.app_context():
+        for log_id in (1, 2, 3, 5):
+            _add_log(log_id, f'发货通知 {log_id}')
+
+        # 刚写入的日志还没落定，先不建索引，检索走 ilike
+        assert index_operation_logs() == 0
+        assert _search('发货') == {1, 2, 3, 5}
+
+        # ID 4 在 5 之后才提交（异步写入 / 并发请求）
+        _add_log(4, '晚提交的验收记录')
+        _let_grace_pass()
+        assert index_operation_logs() == 5
+        assert log_index_watermark() == 5
+        assert _indexed_ids() == {1, 2, 3, 4, 5}
+        assert _search('晚提交') == {4}
+        assert _search('发货') == {1, 2, 3, 5}
+
+
+def test_rows_after_settled_id_wait_for_next_window(app, grace):
+    with app.app_context():
+        _add_log(1, '发货通知')
+        index_operation_logs()
+        _add_log(2, '付款登记')
+        _let_grace_pass()
+
+        # 窗口开始时只观察到 ID 1；ID 2 要等下一个宽限期
+        assert index_operation_logs() == 1
+        assert _indexed_ids() == {1}
+        assert _search('付款') == {2}
+
+        _let_grace_pass()
+        assert index_operation_logs() == 1
+        assert _indexed_ids() == {1, 2}
+        assert _search('付款') == {2}
+
+
+def test_zero_grace_indexes_immediately(app):
+    app.config['SEARCH_LOG_INDEX_GRACE'] = 0
+    with app.app_context():
+        _add_log(1, '发货通知')
+        assert index_operation_logs() == 1
+        assert _search('发货') == {1}
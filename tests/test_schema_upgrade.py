@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""flask schema upgrade：把模型里改成 BigInteger 的整数列放宽"""
+
+import pytest
+from sqlalchemy import types as sqltypes
+from sqlalchemy.dialects import mssql, mysql, postgresql, sqlite
+
+from fszn import db
+from fszn.models import Company, Contract, ProjectFile, UploadSession
+from fszn.schema import needs_widening, upgrade_schema, widen_column_sql
+
+FILE_SIZE = ProjectFile.__table__.c.file_size
+
+
+@pytest.mark.parametrize('column', [FILE_SIZE, UploadSession.__table__.c.total_size])
+def test_int_columns_need_widening(column):
+    assert needs_widening(sqltypes.INTEGER(), column)
+    assert needs_widening(sqltypes.SMALLINT(), column)
+    assert not needs_widening(sqltypes.BIGINT(), column)
+
+
+def test_non_bigint_columns_are_left_alone():
+    assert not needs_widening(sqltypes.INTEGER(), ProjectFile.__table__.c.id)
+    assert not needs_widening(sqltypes.VARCHAR(50), ProjectFile.__table__.c.file_type)
+
+
+@pytest.mark.parametrize('dialect, expected', [
+    (mssql.dialect(), 'ALTER TABLE project_files ALTER COLUMN file_size BIGINT NULL'),
+    (postgresql.dialect(), 'ALTER TABLE project_files ALTER COLUMN file_size TYPE BIGINT'),
+    (mysql.dialect(), 'ALTER TABLE project_files MODIFY COLUMN file_size BIGINT NULL'),
+    # SQLite 的 INTEGER 本来就是 64 位
+    (sqlite.dialect(), ''),
+])
+def test_widen_column_sql(dialect, expected):
+    assert widen_column_sql(dialect, 'project_files', FILE_SIZE) == expected
+
+
+def test_not_null_is_preserved():
+    sql = widen_column_sql(mssql.dialect(), 'upload_sessions', UploadSession.__table__.c.total_size)
+    assert sql == 'ALTER TABLE upload_sessions ALTER COLUMN total_size BIGINT NOT NULL'
+
+
+def test_upgrade_is_noop_on_current_schema(app):
+    with app.app_context():
+        assert not any(upgrade_schema().values())
+
+
+def test_file_size_above_2gib_round_trips(app, client):
+    size = 5 * 1024 ** 3
+    with app.app_context():
+        company = Company(name='客户公司')
+        db.session.add(company)
+        db.session.flush()
+        contract = Contract(company_id=company.id, project_code='P0001', contract_number='HT0001', name='合同')
+        db.session.add(contract)
+        db.session.flush()
+        pf = ProjectFile(contract_id=contract.id, uploader_id=client.user_id, file_type='tech',
+                         original_filename='scan.iso', stored_filename='scan.iso', file_size=size)
+        db.session.add(pf)
+        db.session.commit()
+        db.session.expire_all()
+        assert db.session.get(ProjectFile, pf.id).file_size == size
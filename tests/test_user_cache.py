@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""当前用户缓存：提交后才清除，回滚不清，批量 update()/delete() 清空全部"""
+
+import pytest
+from sqlalchemy import delete, update
+
+from fszn import db
+from fszn.auth import _load_user, _user_cache, invalidate_user_cache
+from fszn.models import User
+
+
+@pytest.fixture
+def cached_users(app, make_user):
+    """两个用户都已读进缓存"""
+    app.config['USER_CACHE_TTL'] = 300
+    invalidate_user_cache()
+    with app.app_context():
+        ids = [make_user('sales'), make_user('finance')]
+        for user_id in ids:
+            _load_user(user_id)
+    assert set(ids) <= set(_user_cache)
+    yield ids
+    invalidate_user_cache()
+
+
+def test_flush_keeps_cache_until_commit(app, cached_users):
+    user_id = cached_users[0]
+    with app.app_context():
+        db.session.get(User, user_id).role = 'boss'
+        db.session.flush()
+        assert user_id in _user_cache
+
+        db.session.commit()
+        assert user_id not in _user_cache
+        assert cached_users[1] in _user_cache
+        assert _load_user(user_id).role == 'boss'
+
+
+def test_rollback_keeps_cache(app, cached_users):
+    user_id = cached_users[0]
+    with app.app_context():
+        db.session.get(User, user_id).role = 'boss'
+        db.session.flush()
+        db.session.rollback()
+        assert user_id in _user_cache
+
+        # 回滚时记下的待清 ID 已丢弃，之后无关的提交不再清它
+        db.session.commit()
+        assert user_id in _user_cache
+        assert _load_user(user_id).role == 'sales'
+
+
+def test_savepoint_rollback_keeps_outer_changes(app, cached_users):
+    first, second = cached_users
+    with app.app_context():
+        db.session.get(User, first).role = 'boss'
+        db.session.flush()
+        with db.session.begin_nested() as savepoint:
+            db.session.get(User, second).role = 'boss'
+            db.session.flush()
+            savepoint.rollback()
+        db.session.commit()
+        assert first not in _user_cache
+
+
+@pytest.mark.parametrize('statement', [
+    lambda ids: update(User).where(User.id == ids[0]).values(role='boss'),
+    lambda ids: delete(User).where(User.id == ids[0]),
+    lambda ids: User.__table__.update().where(User.__table__.c.id == ids[0]).values(role='boss'),
+])
+def test_bulk_statement_clears_cache_on_commit(app, cached_users, statement):
+    with app.app_context():
+        db.session.execute(statement(cached_users))
+        assert set(cached_users) <= set(_user_cache)
+        db.session.commit()
+        assert not _user_cache